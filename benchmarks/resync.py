@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Fault injection benchmark of the frame resynchronisation.
+
+A stream of valid data frames is corrupted, at some rates, with noise bytes (half of them
+HEAD bytes) inserted between the frames and with bytes of the frames overwritten.
+The stream is decoded by the driver FrameReader and by the plain "cut 10 bytes after each
+HEAD and check them" decoder it replaces. For each rate it reports the frames got by both
+and the frames recovered by the resynchronisation for each corrupted byte::
+
+    python benchmarks/resync.py --frames 10000 --seed 1
+"""
+import argparse
+import logging
+import random
+import struct
+import sys
+
+from pysds011.driver import FRAME_HEAD
+from pysds011.driver import FRAME_LEN
+from pysds011.driver import FrameReader
+from pysds011.driver import frame_fault
+
+log = logging.getLogger('benchmark')
+log.addHandler(logging.NullHandler())
+log.propagate = False
+
+RATES = (0.001, 0.005, 0.01, 0.02, 0.05)
+
+
+def data_frame(pm25, pm10, id=b'\x12\x34'):
+    data = struct.pack('<HH', pm25, pm10) + id
+    return b'\xaa\xc0' + data + bytes([sum(data) % 256]) + b'\xab'
+
+
+def corrupt(frames, rate, rnd):
+    """Insert noise bytes between the frames and overwrite bytes of the frames
+
+    :return: corrupted stream and number of corrupted bytes
+    :rtype: tuple
+    """
+    out = bytearray()
+    corrupted = 0
+    for frame in frames:
+        while rnd.random() < rate:
+            out += FRAME_HEAD if rnd.random() < 0.5 else bytes([rnd.randrange(256)])
+            corrupted += 1
+        frame = bytearray(frame)
+        for i in range(FRAME_LEN):
+            if rnd.random() < rate:
+                frame[i] = rnd.randrange(256)
+                corrupted += 1
+        out += frame
+    return bytes(out), corrupted
+
+
+def decode_cut(data):
+    """Decoder without resynchronisation: 10 bytes are cut after each HEAD and dropped if not valid
+    """
+    frames = list()
+    i = data.find(FRAME_HEAD)
+    while 0 <= i <= len(data) - FRAME_LEN:
+        frame = data[i:i + FRAME_LEN]
+        if frame_fault(frame) is None:
+            frames.append(frame)
+        i = data.find(FRAME_HEAD, i + FRAME_LEN)
+    return frames
+
+
+def decode_resync(data):
+    """Decoder of the driver
+    """
+    reader = FrameReader(None, log)
+    reader.feed(data)
+    frames = list()
+    frame = reader.pop_frame()
+    while frame is not None:
+        frames.append(frame)
+        frame = reader.pop_frame()
+    return frames
+
+
+def delivered(frames, sent):
+    """
+    :return: number of decoded frames that are among the sent ones
+    :rtype: int
+    """
+    sent = set(sent)
+    return sum(1 for f in frames if f in sent)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pysds011 frame resynchronisation benchmark')
+    parser.add_argument('--frames', type=int, default=10000, help='number of frames sent')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    # all different, to tell a delivered frame from a corrupted one that is valid by chance
+    sent = [data_frame(i % 1000, i // 1000) for i in range(args.frames)]
+    print('{:>6} {:>10} {:>8} {:>8} {:>10} {:>12}'.format(
+        'rate', 'corrupted', 'cut', 'resync', 'recovered', 'per byte'))
+    for rate in RATES:
+        data, corrupted = corrupt(sent, rate, rnd)
+        cut = delivered(decode_cut(data), sent)
+        resync = delivered(decode_resync(data), sent)
+        print('{:>6} {:>10} {:>8} {:>8} {:>10} {:>12.3f}'.format(
+            rate, corrupted, cut, resync, resync - cut, (resync - cut) / max(corrupted, 1)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
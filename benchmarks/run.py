@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Benchmark suite of the driver hot paths and of the command line app.
+
+Each benchmark result is the best time per operation, in ns, over some repetitions.
+Results can be saved as a JSON baseline and later compared with a new run::
+
+    python benchmarks/run.py --save benchmarks/baseline.json
+    python benchmarks/run.py --compare benchmarks/baseline.json --threshold 0.2
+
+With --compare the exit code is 1 if any benchmark is slower than the baseline by more than threshold.
+"""
+import argparse
+import json
+import logging
+import os
+import struct
+import subprocess
+import sys
+import time
+import timeit
+
+from pysds011 import driver
+from pysds011.metrics import DriverMetrics
+from pysds011.sim import PtyBridge
+from pysds011.sim import SimulatedSDS011
+
+log = logging.getLogger('benchmark')
+log.addHandler(logging.NullHandler())
+log.setLevel(logging.WARNING)
+
+DATA_FRAME = bytes.fromhex('aac0d4043a0aabcd94ab')
+VERSION_FRAME = bytes.fromhex('aac5070f070aa16028ab')
+
+# (cmd, data) of all the PC->Sensor packets sent by the driver
+COMMANDS = [
+    (driver.CMD_SLEEP, [0x0, 0x0]),
+    (driver.CMD_SLEEP, [0x1, 0x0]),
+    (driver.CMD_MODE, [0x0, 0x0]),
+    (driver.CMD_MODE, [0x1, 0x1]),
+    (driver.CMD_QUERY_DATA, []),
+    (driver.CMD_FIRMWARE, []),
+    (driver.CMD_DEVICE_ID, [0, ]*10 + [0x12, 0x34]),
+    (driver.CMD_WORKING_PERIOD, [0x0]),
+    (driver.CMD_WORKING_PERIOD, [0x1, 0x5]),
+]
+DEST = b'\xab\xcd'
+
+BENCHMARKS = dict()
+
+
+def benchmark(number):
+    """Register a benchmark: the decorated function gets the number of operations to run
+    and returns the callable to be timed for each of them
+    """
+    def register(func):
+        BENCHMARKS[func.__name__] = (func, number)
+        return func
+    return register
+
+
+def legacy_construct_command(cmd, data, dest):
+    """Packet assembly as it was done by SDS011.__construct_command before the packet cache,
+    debug string formatting included
+    """
+    data = list(data)
+    debug = "data:" + str(data) + " dest:" + str(dest)
+    data += [0, ]*(12-len(data))
+    debug = "Resized data:" + str(data)
+    checksum = (sum(data)+sum(struct.unpack('<BB', dest))+cmd) % 256
+    ret = bytes().fromhex("aab4")
+    ret += bytes([cmd])
+    ret += bytes(data)
+    ret += dest
+    ret += bytes([checksum])
+    ret += bytes().fromhex("ab")
+    debug = '> ' + ret.hex()
+    del debug
+    return ret
+
+
+class LoopSerial(object):
+    """Serial that always has the same bytes waiting to be read"""
+
+    def __init__(self, data):
+        self.data = data
+        self.timeout = 0
+        self.in_waiting = len(data)
+
+    def read(self, size=1):
+        return self.data[:size]
+
+    def write(self, data):
+        return len(data)
+
+
+@benchmark(100000)
+def construct_command():
+    sd = driver.SDS011(None, log)
+    return lambda: sd._SDS011__construct_command(driver.CMD_QUERY_DATA, (), b'\xab\xcd')
+
+
+@benchmark(10000)
+def legacy_command():
+    """All the packets assembled as before the packet cache, reference of build_command and cached_command"""
+    for cmd, data in COMMANDS:
+        assert legacy_construct_command(cmd, data, DEST) == driver.get_command(cmd, data, DEST)
+    return lambda: [legacy_construct_command(cmd, data, DEST) for cmd, data in COMMANDS]
+
+
+@benchmark(10000)
+def build_command():
+    """All the packets assembled each time"""
+    return lambda: [driver.build_command(cmd, data, DEST) for cmd, data in COMMANDS]
+
+
+@benchmark(10000)
+def cached_command():
+    """All the packets taken from the cache"""
+    return lambda: [driver.get_command(cmd, data, DEST) for cmd, data in COMMANDS]
+
+
+@benchmark(100000)
+def read_response():
+    sd = driver.SDS011(LoopSerial(DATA_FRAME), log)
+    return lambda: sd._SDS011__read_response(driver.RSP_DATA)
+
+
+@benchmark(100000)
+def process_data():
+    sd = driver.SDS011(None, log)
+    return lambda: sd._SDS011__process_data(DATA_FRAME)
+
+
+@benchmark(100000)
+def process_version():
+    sd = driver.SDS011(None, log)
+    return lambda: sd._SDS011__process_version(VERSION_FRAME)
+
+
+@benchmark(10000)
+def query_data_roundtrip():
+    sd = driver.SDS011(SimulatedSDS011(mode=1), log)
+    return sd.cmd_query_data
+
+
+@benchmark(10000)
+def query_data_metrics():
+    """Same as query_data_roundtrip, with the driver metrics on"""
+    sd = driver.SDS011(SimulatedSDS011(mode=1), log, metrics=DriverMetrics())
+    return sd.cmd_query_data
+
+
+@benchmark(5)
+def cli_dust():
+    """Wall time of 'pysds011 dust' from process start to output, on a simulated sensor"""
+    if not hasattr(os, 'openpty'):
+        return None
+    bridge = PtyBridge(SimulatedSDS011(mode=1))
+    bridge.start()
+    cmd = [sys.executable, '-m', 'pysds011', '--port', bridge.port, 'dust', '--warmup', '0']
+
+    def run():
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    run.cleanup = bridge.stop
+    return run
+
+
+@benchmark(10)
+def cli_import():
+    """Wall time of a new interpreter importing the command line app, see tests/test_import_time.py"""
+    cmd = [sys.executable, '-c', 'import pysds011.cli']
+
+    def run():
+        subprocess.run(cmd, check=True)
+    return run
+
+
+def run_all(names, repeat, scale):
+    """Run the requested benchmarks
+
+    :return: ns per operation by benchmark name
+    :rtype: dict
+    """
+    results = dict()
+    for name in names:
+        func, number = BENCHMARKS[name]
+        number = max(1, int(number * scale))
+        op = func()
+        if op is None:
+            print('{:<24} skipped'.format(name))
+            continue
+        try:
+            best = min(timeit.repeat(op, number=number, repeat=repeat)) / number
+        finally:
+            getattr(op, 'cleanup', lambda: None)()
+        results[name] = best * 1e9
+        print('{:<24} {:>16.0f} ns'.format(name, results[name]))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Compare results with a baseline
+
+    :return: names of the benchmarks slower than baseline more than threshold
+    :rtype: list
+    """
+    regressions = list()
+    print('{:<24} {:>14} {:>14} {:>8}'.format('benchmark', 'baseline[ns]', 'current[ns]', 'ratio'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        ratio = results[name] / baseline[name]
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = ' REGRESSION'
+        print('{:<24} {:>14.0f} {:>14.0f} {:>8.2f}{}'.format(name, baseline[name], results[name], ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pysds011 benchmark suite')
+    parser.add_argument('names', nargs='*', help='benchmarks to run, all if none: ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions, the best one is kept')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier of the operations of each benchmark')
+    parser.add_argument('--save', help='write results as JSON baseline to this file')
+    parser.add_argument('--compare', help='JSON baseline to compare results with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='max allowed slowdown, as ratio')
+    args = parser.parse_args()
+
+    results = run_all(args.names or list(BENCHMARKS), args.repeat, args.scale)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'date': time.strftime('%Y-%m-%d'), 'results': results},
+                      f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
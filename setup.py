@@ -75,6 +75,8 @@ setup(
         'pyserial',
     ],
     extras_require={
+        'async': ['pyserial-asyncio'],
+        'numpy': ['numpy'],
     },
     entry_points={
         'console_scripts': [
@@ -0,0 +1,330 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Module that reduces a stream of Nove SDS011 readings to a single value, in constant memory.
+
+Readings are noisy: ``Aggregator`` takes them one at a time, from ``cmd_query_data`` or ``stream``,
+and keeps for PM 2.5 and PM 10 the running mean and variance (Welford algorithm) and
+median and percentiles, exact up to EXACT_SAMPLES readings and then estimated (P² algorithm),
+without storing all the samples::
+
+    agg = Aggregator(reject=3.0)
+    for pm in sd.stream(count=60):
+        agg.push(pm)
+    print(agg.result('median').pretty, agg.rejected)
+
+With ``reject`` set, spikes farther than ``reject`` times the median absolute deviation (MAD)
+from the median of the accepted readings are discarded. MIN_SAMPLES spikes in a row are taken
+as a level change: the median and the MAD used to reject restart from them.
+"""
+
+import math
+import time
+from bisect import insort
+
+from pysds011.driver import Measurement
+
+# samples needed before rejecting spikes, and spikes in a row taken as a level change
+MIN_SAMPLES = 5
+# values kept to compute quantiles exactly, they are estimated beyond
+EXACT_SAMPLES = 64
+# MAD to standard deviation of normally distributed samples
+MAD_SCALE = 1.4826
+# sensor resolution in μg/m^3, smallest deviation that can be rejected
+RESOLUTION = 0.1
+REDUCE = ('mean', 'median')
+
+
+class RunningStats(object):
+    """Count, mean, variance, min and max of a stream of values (Welford algorithm)
+    """
+
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        # sum of squares of differences from the mean
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def push(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+
+    @property
+    def variance(self):
+        """
+        :return: sample variance, 0.0 with less than two values
+        :rtype: float
+        """
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+class P2Quantile(object):
+    """Quantile of a stream of values, exact up to a number of values and then estimated
+    with five markers (P² algorithm, Jain and Chlamtac) placed on the exact values
+    """
+
+    __slots__ = ('p', 'exact', 'count', 'q', 'n', 'np', 'dn')
+
+    def __init__(self, p=0.5, exact=EXACT_SAMPLES):
+        """Constructor
+
+        :param p: quantile, between 0 and 1, defaults to 0.5 that is the median
+        :type p: float, optional
+        :param exact: number of values kept, and sorted, to compute the quantile exactly,
+                      at least 5, defaults to EXACT_SAMPLES
+        :type exact: int, optional
+        """
+        if not 0 <= p <= 1:
+            raise ValueError('Quantile %s not in [0, 1]' % p)
+        self.p = p
+        self.exact = max(exact, 5)
+        self.count = 0
+        # sorted values until there are more than exact, then marker heights
+        self.q = list()
+        # actual and desired marker positions, desired position increments
+        self.n = None
+        self.np = None
+        self.dn = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def __markers(self):
+        """Place the markers on the kept values, at the ranks of min, p/2, p, (1+p)/2 and max
+        """
+        last = len(self.q) - 1
+        n = [int(round(last * f)) for f in self.dn]
+        for i in (1, 2, 3, 4):
+            n[i] = max(n[i], n[i - 1] + 1)
+        n[4] = last
+        for i in (3, 2, 1, 0):
+            n[i] = min(n[i], n[i + 1] - 1)
+        self.q = [self.q[i] for i in n]
+        self.n = n
+        self.np = [last * f for f in self.dn]
+
+    def push(self, x):
+        self.count += 1
+        if self.count <= self.exact:
+            insort(self.q, x)
+            return
+        if self.count == self.exact + 1:
+            self.__markers()
+        q, n = self.q, self.n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.np[i] += self.dn[i]
+        for i in (1, 2, 3):
+            d = self.np[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                h = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < h < q[i + 1]:
+                    # parabolic prediction out of order, linear one
+                    h = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = h
+                n[i] += d
+
+    @property
+    def value(self):
+        """
+        :return: quantile estimate, None without values
+        :rtype: float
+        """
+        if not self.q:
+            return None
+        if self.count > self.exact:
+            return self.q[2]
+        # exact, interpolated between the closest ranks
+        pos = self.p * (len(self.q) - 1)
+        lo = int(pos)
+        hi = min(lo + 1, len(self.q) - 1)
+        return self.q[lo] + (pos - lo) * (self.q[hi] - self.q[lo])
+
+
+class Channel(object):
+    """Statistics of a single PM value
+    """
+
+    def __init__(self, quantiles=()):
+        self.stats = RunningStats()
+        self.median = P2Quantile(0.5)
+        self.quantiles = {p: P2Quantile(p) for p in quantiles}
+        # median and median of the absolute deviations from it (MAD) used to reject spikes,
+        # restarted after a level change
+        self.center = P2Quantile(0.5)
+        self.mad = P2Quantile(0.5)
+
+    def is_spike(self, x, reject):
+        """
+        :return: True if x is farther than reject MADs from the median
+        :rtype: bool
+        """
+        if self.center.count < MIN_SAMPLES:
+            return False
+        scale = max(MAD_SCALE * self.mad.value, RESOLUTION)
+        return abs(x - self.center.value) > reject * scale
+
+    def __track(self, x):
+        if self.center.count:
+            self.mad.push(abs(x - self.center.value))
+        self.center.push(x)
+
+    def push(self, x):
+        """Add an accepted value
+        """
+        self.__track(x)
+        self.stats.push(x)
+        self.median.push(x)
+        for q in self.quantiles.values():
+            q.push(x)
+
+    def restart(self, xs):
+        """Reject spikes around new values, after a level change
+
+        :param xs: values of the new level
+        :type xs: list of float
+        """
+        self.center = P2Quantile(0.5)
+        self.mad = P2Quantile(0.5)
+        for x in xs:
+            self.__track(x)
+
+    def summary(self):
+        res = {'count': self.stats.count, 'mean': self.stats.mean, 'std': self.stats.std,
+               'min': self.stats.min, 'max': self.stats.max, 'median': self.median.value}
+        for p, q in self.quantiles.items():
+            res['p%g' % (p * 100)] = q.value
+        return res
+
+
+class Aggregator(object):
+    """Reduce many readings of a sensor to one, in constant memory
+    """
+
+    def __init__(self, reject=None, quantiles=()):
+        """Constructor
+
+        :param reject: max distance from the median, in MADs, of an accepted reading,
+                       defaults to None that is 'accept all'
+        :type reject: float, optional
+        :param quantiles: quantiles to estimate besides the median, like 0.9, defaults to ()
+        :type quantiles: list of float, optional
+        """
+        self.reject = reject
+        self.pm25 = Channel(quantiles)
+        self.pm10 = Channel(quantiles)
+        self.rejected = 0
+        # spikes in a row, as (pm25, pm10)
+        self.spikes = list()
+        self.id = None
+        self.timestamp = None
+
+    @property
+    def count(self):
+        """
+        :return: number of accepted readings
+        :rtype: int
+        """
+        return self.pm25.stats.count
+
+    def push(self, pm):
+        """Add a reading
+
+        :param pm: dust data, None readings are ignored
+        :type pm: Measurement
+        :return: True if the reading is accepted, False if it is a spike or None
+        :rtype: bool
+        """
+        if pm is None:
+            return False
+        if self.reject is not None and (self.pm25.is_spike(pm['pm25'], self.reject) or
+                                        self.pm10.is_spike(pm['pm10'], self.reject)):
+            self.rejected += 1
+            self.spikes.append((pm['pm25'], pm['pm10']))
+            if len(self.spikes) >= MIN_SAMPLES:
+                # not spikes but a new level
+                self.pm25.restart([pm25 for pm25, _ in self.spikes])
+                self.pm10.restart([pm10 for _, pm10 in self.spikes])
+                self.spikes = list()
+            return False
+        self.spikes = list()
+        self.pm25.push(pm['pm25'])
+        self.pm10.push(pm['pm10'])
+        self.id = getattr(pm, 'id', None)
+        self.timestamp = getattr(pm, 'timestamp', None)
+        return True
+
+    def extend(self, readings):
+        """Add many readings, like the ones of SDS011.stream
+        """
+        for pm in readings:
+            self.push(pm)
+
+    def result(self, reduce='mean'):
+        """
+        :param reduce: 'mean' or 'median', defaults to 'mean'
+        :type reduce: str, optional
+        :return: reduced dust data, with the id and timestamp of the last accepted reading,
+                 None without accepted readings
+        :rtype: Measurement
+        :raises ValueError: for unknown reduce
+        """
+        if reduce not in REDUCE:
+            raise ValueError('Unknown reduce %s' % reduce)
+        if 0 == self.count:
+            return None
+        if 'mean' == reduce:
+            pm25, pm10 = self.pm25.stats.mean, self.pm10.stats.mean
+        else:
+            pm25, pm10 = self.pm25.median.value, self.pm10.median.value
+        return Measurement(round(pm25, 2), round(pm10, 2), self.id, self.timestamp)
+
+    def summary(self):
+        """
+        :return: statistics of PM 2.5 and PM 10, with the number of rejected readings
+        :rtype: dict
+        """
+        return {'pm25': self.pm25.summary(), 'pm10': self.pm10.summary(), 'rejected': self.rejected}
+
+
+def sample(sd, count, interval=1.0, id=b'\xff\xff'):
+    """Query a sensor many times, it has to be awake and in query mode
+
+    :param sd: driver
+    :type sd: SDS011
+    :param count: number of readings
+    :type count: int
+    :param interval: time in sec between two readings, the sensor measures once a second, defaults to 1.0
+    :type interval: float, optional
+    :param id: sensor id, defaults to b'\xff\xff'
+    :type id: 2 bytes, optional
+    :return: generator of dust data, None for the failed readings
+    :rtype: generator of Measurement
+    """
+    for i in range(count):
+        if i:
+            time.sleep(interval)
+        yield sd.cmd_query_data(id=id)
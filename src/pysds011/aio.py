@@ -0,0 +1,355 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Module that implements asyncio communication with Nove SDS011 sensor.
+
+Commands and responses are the same of :class:`pysds011.driver.SDS011`,
+but all the ``cmd_*`` methods are coroutines, so that a single event loop
+can drive many sensors at once.
+"""
+
+import asyncio
+
+from pysds011.driver import CMD_DEVICE_ID
+from pysds011.driver import CMD_FIRMWARE
+from pysds011.driver import CMD_MODE
+from pysds011.driver import CMD_QUERY_DATA
+from pysds011.driver import CMD_SLEEP
+from pysds011.driver import CMD_WORKING_PERIOD
+from pysds011.driver import MODE_ACTIVE
+from pysds011.driver import RSP_CMD
+from pysds011.driver import RSP_DATA
+from pysds011.driver import FrameReader
+from pysds011.driver import get_command
+from pysds011.driver import process_data
+from pysds011.driver import process_version
+
+# max number of bytes got from the stream with a single read
+READ_CHUNK = 1024
+
+
+async def open_sds011(port, log, baudrate=9600):
+    """Open a serial port in non blocking mode and create a driver on it.
+    It needs the optional pyserial-asyncio package (``pip install pysds011[async]``)
+
+    :param port: UART port to communicate with dust sensor
+    :type port: str
+    :param log: logging, configured, instance
+    :type log: logging
+    :param baudrate: serial speed, defaults to 9600
+    :type baudrate: int, optional
+    :return: driver instance
+    :rtype: AsyncSDS011
+    """
+    import serial_asyncio
+    reader, writer = await serial_asyncio.open_serial_connection(url=port, baudrate=baudrate)
+    return AsyncSDS011(reader, writer, log)
+
+
+class FakeTransport(object):
+    """In memory transport, to use AsyncSDS011 without any sensor.
+
+    It plays the role of both the stream reader (``reader`` attribute) and the stream writer.
+    Bytes written by the driver are recorded in ``written`` and, if a responder is provided,
+    passed to it: what it returns is received by the driver.
+    It can be created out of the event loop, its stream is created at first use.
+    """
+
+    def __init__(self, responder=None):
+        """Constructor
+
+        :param responder: function that get a PC->Sensor packet and return the sensor reply, defaults to None
+        :type responder: callable, optional
+        """
+        self.reader = self
+        self.responder = responder
+        self.written = list()
+        self.__stream = None
+
+    @property
+    def stream(self):
+        """asyncio.StreamReader of the received bytes"""
+        if self.__stream is None:
+            # on Python < 3.10 it is bound to the event loop current at its creation
+            self.__stream = asyncio.StreamReader()
+        return self.__stream
+
+    async def read(self, n=-1):
+        return await self.stream.read(n)
+
+    def feed(self, data):
+        """Simulate bytes sent by the sensor
+
+        :param data: bytes received by the driver
+        :type data: bytes
+        """
+        self.stream.feed_data(data)
+
+    def write(self, data):
+        self.written.append(data)
+        if self.responder is not None:
+            reply = self.responder(data)
+            if reply:
+                self.feed(reply)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.stream.feed_eof()
+
+
+class AsyncSDS011(object):
+    """asyncio driver class
+    """
+
+    def __init__(self, reader, writer, log, timeout=5.0):
+        """Constructor that just record streams and logging reference
+
+        :param reader: stream to read from, like asyncio.StreamReader
+        :type reader: asyncio.StreamReader
+        :param writer: stream to write to, like asyncio.StreamWriter
+        :type writer: asyncio.StreamWriter
+        :param log: logging, configured, instance
+        :type log: logging
+        :param timeout: max time in sec to wait for a reply, defaults to 5.0
+        :type timeout: float, optional
+        """
+        self.log = log
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.frames = FrameReader(None, log, timeout=timeout)
+        self.__lock = None
+
+    @property
+    def lock(self):
+        """Lock of the requests: sensor replies are not tagged, so only one request at a time"""
+        if self.__lock is None:
+            # created in the running loop: on Python < 3.10 a lock is bound to the event loop
+            # current at its creation, the driver can be created before the loop runs
+            self.__lock = asyncio.Lock()
+        return self.__lock
+
+    @property
+    def MODE_QUERY(self):
+        return 1
+
+    async def close(self):
+        """Close the writer stream
+        """
+        self.writer.close()
+
+    async def __read_response(self, cmd=None, sub=None, id=None, timeout=None, op=None):
+        """Read data from the sensor, see FrameReader.read_frame
+
+        :param timeout: max time in sec to wait for each chunk of the frame, defaults to None that is self.timeout
+        :type timeout: float, optional
+        :param op: expected 0:query or 1:set, see frame_match, defaults to None that is 'any'
+        :type op: int, optional
+        :return: read bytes
+        :rtype: bytes or None in case of error
+        """
+        timeout = self.timeout if timeout is None else timeout
+        self.frames.skipped = 0
+        self.frames.corrupted = 0
+        frame = self.frames.pop_frame(cmd, sub, id, op)
+        while frame is None:
+            if self.frames.skipped >= self.frames.max_skip:
+                self.log.error('Not get HEAD after %d read bytes', self.frames.skipped)
+                self.frames.count('resync', cmd, sub, id)
+                return None
+            # after a corrupted reply wait for a frame behind it, but not for the whole timeout
+            resync = self.frames.corrupted and not self.frames.buffer
+            try:
+                data = await asyncio.wait_for(self.reader.read(READ_CHUNK),
+                                              min(self.frames.resync_wait, timeout) if resync else timeout)
+            except asyncio.TimeoutError:
+                data = None
+            if not data and resync:
+                self.log.debug('No bytes after a corrupted frame')
+                return None
+            if not data:
+                self.frames.log_timeout()
+                self.frames.count('timeout', cmd, sub, id)
+                return None
+            self.frames.feed(data)
+            frame = self.frames.pop_frame(cmd, sub, id, op)
+        self.frames.log_frame(frame)
+        return frame
+
+    async def __transaction(self, cmd, data=(), id=b'\xff\xff', rsp=RSP_CMD, rsp_id=None):
+        """Write a command and wait for its reply
+
+        :param cmd: Command ID
+        :type cmd: int
+        :param data: command data, defaults to ()
+        :type data: list, optional
+        :param id: sensor id, defaults to b'\xff\xff'
+        :type id: 2 bytes, optional
+        :param rsp: expected sensor->PC commandID, None to not wait any reply, defaults to RSP_CMD
+        :type rsp: int, optional
+        :param rsp_id: expected sensor id in the reply, defaults to None that is 'same as id'
+        :type rsp_id: 2 bytes, optional
+        :return: reply
+        :rtype: bytes or None in case of error
+        """
+        async with self.lock:
+            self.frames.drop_pending(id)
+            self.writer.write(get_command(cmd, data, id))
+            await self.writer.drain()
+            if rsp is None:
+                return None
+            sub = cmd if rsp == RSP_CMD else None
+            # query and set replies of these commands differ only by the first data byte
+            op = data[0] if cmd in (CMD_MODE, CMD_SLEEP, CMD_WORKING_PERIOD) else None
+            return await self.__read_response(rsp, sub, id if rsp_id is None else rsp_id, op=op)
+
+    async def cmd_get_sleep(self, id=b'\xff\xff'):
+        """Get active sleep mode, see SDS011.cmd_get_sleep
+
+        :return: True if it is sleeping, False if wakeup, None in case of communication error
+        :rtype: bool
+        """
+        resp = await self.__transaction(CMD_SLEEP, [0x0, 0x0], id)
+        if resp is None:
+            self.log.error("No sensor response")
+            return None
+        if 0 != resp[4] and 1 != resp[4]:
+            self.log.error("No valid sensor response %d", resp[4])
+            return None
+        return 0 == resp[4]
+
+    async def cmd_set_sleep(self, sleep=1, id=b'\xff\xff'):
+        """Set sleep mode, see SDS011.cmd_set_sleep
+
+        :return: True is set is ok
+        :rtype: bool
+        """
+        assert id is not None
+        mode = 0 if sleep else 1
+        resp = await self.__transaction(CMD_SLEEP, [0x1, mode], id)
+        return resp is not None
+
+    async def cmd_get_mode(self, id=b'\xff\xff'):
+        """Get active reporting mode, see SDS011.cmd_get_mode
+
+        :return: mode if it is ok, None if error
+        :rtype: int
+        """
+        assert id is not None
+        resp = await self.__transaction(CMD_MODE, [0x0, 0x0], id)
+        if resp is None:
+            self.log.error("No valid sensor response")
+            return None
+        return resp[4]
+
+    async def cmd_set_mode(self, mode=1, id=b'\xff\xff'):
+        """Set data reporting mode, see SDS011.cmd_set_mode
+
+        :return: True is set is ok
+        :rtype: bool
+        """
+        assert id is not None
+        resp = await self.__transaction(CMD_MODE, [0x1, mode], id)
+        if resp is None:
+            self.log.error("No valid sensor response")
+            return False
+        if mode != resp[4]:
+            self.log.error("Requested configuration not applied")
+            return False
+        return True
+
+    async def cmd_firmware_ver(self, id=b'\xff\xff'):
+        """Get FW version, see SDS011.cmd_firmware_ver
+
+        :return: version description dictionary  or None if error
+        :rtype: dict
+        """
+        assert id is not None
+        d = await self.__transaction(CMD_FIRMWARE, id=id)
+        return process_version(d, self.log)
+
+    async def cmd_query_data(self, id=b'\xff\xff'):
+        """Read dust values from the sensor, see SDS011.cmd_query_data
+
+        :return: dust data
+        :rtype: Measurement
+        """
+        assert id is not None
+        d = await self.__transaction(CMD_QUERY_DATA, id=id, rsp=RSP_DATA)
+        if d is None:
+            self.log.error("No data from query")
+            return None
+        return process_data(d, self.log)
+
+    async def cmd_set_id(self, id, new_id):
+        """Set a device ID to a specific sensor, see SDS011.cmd_set_id
+
+        :return: operation result
+        :rtype: bool
+        """
+        assert id is not None
+        assert new_id is not None
+        d = await self.__transaction(CMD_DEVICE_ID, [0, ]*10 + [new_id[0], new_id[1]], id, rsp_id=new_id)
+        if d is None:
+            self.log.error("Error in sensor response")
+            return False
+        return d[-4] == new_id[0] and d[-3] == new_id[1]
+
+    async def cmd_set_working_period(self, period=0, id=b'\xff\xff'):
+        """Set working period, see SDS011.cmd_set_working_period
+
+        :return: result
+        :rtype: bool
+        """
+        assert id is not None
+        if period > 30:
+            return False
+        await self.__transaction(CMD_WORKING_PERIOD, [0x01, period], id, rsp=None)
+        return True
+
+    async def cmd_get_working_period(self, id=b'\xff\xff'):
+        """Get current working period, see SDS011.cmd_get_working_period
+
+        :return: working period in minutes
+        :rtype: int
+        """
+        assert id is not None
+        d = await self.__transaction(CMD_WORKING_PERIOD, [0x00], id)
+        if d is None:
+            self.log.error("Error in sensor response")
+            return None
+        return d[4]
+
+    async def stream(self, id=b'\xff\xff', count=None, max_errors=3, period=None):
+        """Put the sensor in active mode and yield the measurements it pushes,
+        see SDS011.stream
+
+        :return: asynchronous generator of dust data Measurement
+        :rtype: async generator
+        """
+        assert id is not None
+        if period is None:
+            period = await self.cmd_get_working_period(id=id)
+            if period is None:
+                self.log.warning('Working period not known, reports are expected every second')
+                period = 0
+        if await self.cmd_set_mode(MODE_ACTIVE, id=id) is not True:
+            self.log.error('Set MODE_ACTIVE failure')
+            return
+        errors = 0
+        while count is None or count > 0:
+            async with self.lock:
+                d = await self.__read_response(RSP_DATA, id=id, timeout=self.timeout + 60 * period)
+            res = process_data(d, self.log) if d is not None else None
+            if res is None:
+                errors += 1
+                if errors >= max_errors:
+                    self.log.error('Stream stopped after %d errors', errors)
+                    return
+                continue
+            errors = 0
+            if count is not None:
+                count -= 1
+            yield res
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Module that runs a script of commands on one or more Nove SDS011 sensors.
+
+A script has one command for each line, '#' starts a comment::
+
+    # configure and read
+    mode 1
+    period 0
+    wait 3
+    dust
+    fw_version
+
+Commands are the ones of the command line app, 'period' sets the working period
+and 'wait' pauses the script for some sec. A command without value gets the actual one.
+"""
+
+import time
+
+# command: (min, max) number of arguments
+COMMANDS = {
+    'dust': (0, 0),
+    'mode': (0, 1),
+    'sleep': (0, 1),
+    'period': (0, 1),
+    'fw_version': (0, 0),
+    'id': (0, 1),
+    'wait': (1, 1),
+}
+
+
+def parse_script(lines):
+    """Parse and validate a script
+
+    :param lines: script lines
+    :type lines: iterable of str
+    :return: (line number, command, arguments) of each command
+    :rtype: list of tuple
+    :raises ValueError: for unknown commands or wrong arguments
+    """
+    script = list()
+    for n, line in enumerate(lines, 1):
+        words = line.split('#', 1)[0].split()
+        if not words:
+            continue
+        cmd, args = words[0].lower(), words[1:]
+        if cmd not in COMMANDS:
+            raise ValueError('line %d: unknown command %s' % (n, cmd))
+        lo, hi = COMMANDS[cmd]
+        if not lo <= len(args) <= hi:
+            raise ValueError('line %d: %s needs %d to %d arguments' % (n, cmd, lo, hi))
+        try:
+            if 'id' == cmd:
+                args = [bytes.fromhex(a) for a in args]
+                if args and 2 != len(args[0]):
+                    raise ValueError('4 hex digits expected')
+            elif 'wait' == cmd:
+                args = [float(a) for a in args]
+            else:
+                args = [int(a) for a in args]
+        except ValueError as e:
+            raise ValueError('line %d: %s' % (n, e))
+        script.append((n, cmd, args))
+    return script
+
+
+def execute(sd, cmd, args, id):
+    """Execute a single command on a sensor
+
+    :param sd: driver
+    :type sd: SDS011
+    :return: True if the command succeeded and its result, JSON friendly.
+             Getters succeed on any not None value, like False for an awake sensor,
+             setters only on True
+    :rtype: tuple
+    """
+    if 'dust' == cmd:
+        pm = sd.cmd_query_data(id=id)
+        return pm is not None, pm._asdict() if pm is not None else None
+    if 'fw_version' == cmd:
+        fw = sd.cmd_firmware_ver(id=id)
+        return fw is not None, dict(fw, id=fw['id'].hex()) if fw is not None else None
+    if 'id' == cmd:
+        if not args:
+            fw = sd.cmd_firmware_ver(id=id)
+            return fw is not None, fw['id'].hex() if fw is not None else None
+        res = sd.cmd_set_id(id=id, new_id=args[0])
+        return res is True, res
+    getter, setter = {
+        'mode': (sd.cmd_get_mode, sd.cmd_set_mode),
+        'sleep': (sd.cmd_get_sleep, sd.cmd_set_sleep),
+        'period': (sd.cmd_get_working_period, sd.cmd_set_working_period),
+    }[cmd]
+    if args:
+        res = setter(args[0], id=id)
+        return res is True, res
+    res = getter(id=id)
+    return res is not None, res
+
+
+def run_script(sd, script, ids):
+    """Run the commands of a script, each one on all the sensors.
+    Sensors have to be already awake.
+
+    :param sd: driver
+    :type sd: SDS011
+    :param script: commands as returned by parse_script
+    :type script: list of tuple
+    :param ids: sensor ids, updated by the 'id' commands that set a new one
+    :type ids: list of 2 bytes
+    :return: generator of results with fields 'line', 'cmd', 'id', 'ok' and 'result'
+    :rtype: generator of dict
+    """
+    for n, cmd, args in script:
+        if 'wait' == cmd:
+            time.sleep(args[0])
+            yield {'line': n, 'cmd': cmd, 'id': None, 'ok': True, 'result': args[0]}
+            continue
+        for i, id in enumerate(ids):
+            ok, res = execute(sd, cmd, args, id)
+            if ok and 'id' == cmd and args:
+                ids[i] = args[0]
+            yield {'line': n, 'cmd': cmd, 'id': id.hex(), 'ok': ok, 'result': res}
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Module that decodes large captures of raw sensor->PC traffic at once, with NumPy vectorised operations.
+
+It needs the optional NumPy package (``pip install pysds011[numpy]``)::
+
+    with open('capture.bin', 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        res = decode_frames(m)
+    print(len(res.data), 'readings,', res.rejected, 'rejected frames')
+    pm25 = res.data['pm25'] / 10.0
+"""
+
+import collections
+
+import numpy
+
+from pysds011.driver import FRAME_LEN
+from pysds011.driver import RSP_CMD
+from pysds011.driver import RSP_DATA
+
+# byte offset in the capture, raw PM values in tenths of μg/m^3 and sensor id as big endian integer
+DATA_DTYPE = numpy.dtype([('offset', numpy.int64), ('pm25', numpy.uint16), ('pm10', numpy.uint16), ('id', numpy.uint16)])
+# byte offset in the capture, PC->Sensor command the frame is reply to, 3 data bytes and sensor id
+REPLY_DTYPE = numpy.dtype([('offset', numpy.int64), ('cmd', numpy.uint8), ('data', numpy.uint8, (3,)),
+                           ('id', numpy.uint16)])
+# bytes processed at once, to bound the memory used on huge captures
+CHUNK_SIZE = 1 << 20
+
+Decoded = collections.namedtuple('Decoded', ['data', 'replies', 'rejected'])
+
+
+def _valid_starts(buf, start, stop):
+    """Find the frames starting in buf[start:stop]
+
+    :return: start of the frames with good checksum and of the ones with head, tail and bad checksum
+    :rtype: tuple
+    """
+    end = min(stop + FRAME_LEN - 1, len(buf))
+    window = buf[start:end]
+    last = end - start - FRAME_LEN + 1
+    if last <= 0:
+        return numpy.empty(0, numpy.int64), numpy.empty(0, numpy.int64)
+    cand = numpy.flatnonzero((window[:last] == 0xaa) & (window[FRAME_LEN - 1:] == 0xab))
+    frames = window[cand[:, None] + numpy.arange(FRAME_LEN)]
+    good = (frames[:, 2:8].sum(axis=1, dtype=numpy.uint16) % 256) == frames[:, 8]
+    good &= (frames[:, 1] == RSP_DATA) | (frames[:, 1] == RSP_CMD)
+    return cand[good] + start, cand[~good] + start
+
+
+def _drop_overlaps(starts, last_end):
+    """Keep, in order, only the frames that do not overlap a previous one
+
+    :return: accepted frame starts and end of the last one
+    :rtype: tuple
+    """
+    if len(starts) and starts[0] >= last_end and numpy.all(numpy.diff(starts) >= FRAME_LEN):
+        return starts, int(starts[-1]) + FRAME_LEN
+    keep = list()
+    for s in starts.tolist():
+        if s >= last_end:
+            keep.append(s)
+            last_end = s + FRAME_LEN
+    return numpy.array(keep, dtype=numpy.int64), last_end
+
+
+def decode_frames(raw, chunk_size=CHUNK_SIZE):
+    """Find and decode all the sensor->PC frames in a capture of raw serial traffic.
+
+    A frame is 10 bytes from 0xAA to 0xAB with a good checksum; bytes between frames are skipped.
+    Frames with head and tail but wrong checksum, that do not overlap a good frame, are counted as rejected.
+
+    :param raw: captured bytes
+    :type raw: bytes, bytearray, memoryview or mmap
+    :param chunk_size: bytes processed at once, defaults to CHUNK_SIZE
+    :type chunk_size: int, optional
+    :return: data frames (DATA_DTYPE structured array), reply frames (REPLY_DTYPE structured array)
+             and number of rejected frames
+    :rtype: Decoded
+    """
+    buf = numpy.frombuffer(raw, dtype=numpy.uint8)
+    accepted = list()
+    rejected = 0
+    last_end = 0
+    for start in range(0, max(len(buf) - FRAME_LEN + 1, 0), chunk_size):
+        good, bad = _valid_starts(buf, start, start + chunk_size)
+        good, chunk_end = _drop_overlaps(good, last_end)
+        # bad frames inside a good one are just bytes of it
+        if len(good):
+            inside = numpy.searchsorted(good, bad, side='right') - 1
+            covered = (inside >= 0) & (bad < good[numpy.maximum(inside, 0)] + FRAME_LEN)
+            bad = bad[~covered]
+        rejected += int(numpy.count_nonzero(bad >= last_end))
+        last_end = max(last_end, chunk_end)
+        accepted.append(good)
+    starts = numpy.concatenate(accepted) if accepted else numpy.empty(0, numpy.int64)
+    data, replies = _split(buf[starts[:, None] + numpy.arange(FRAME_LEN)], starts)
+    return Decoded(data, replies, rejected)
+
+
+def decode_records(frames):
+    """Decode frames already aligned one per row, like the ones in a capture file
+
+    :param frames: one frame each row
+    :type frames: numpy array of uint8 with shape (n, 10)
+    :return: data frames and reply frames, as in decode_frames, with the row as offset,
+             and number of rows that are not a valid frame
+    :rtype: Decoded
+    """
+    good = (frames[:, 0] == 0xaa) & (frames[:, FRAME_LEN - 1] == 0xab)
+    good &= (frames[:, 2:8].sum(axis=1, dtype=numpy.uint16) % 256) == frames[:, 8]
+    good &= (frames[:, 1] == RSP_DATA) | (frames[:, 1] == RSP_CMD)
+    rows = numpy.flatnonzero(good)
+    data, replies = _split(frames[rows], rows)
+    return Decoded(data, replies, len(frames) - len(rows))
+
+
+def _split(frames, starts):
+    """Extract the fields of valid frames
+
+    :return: data frames and reply frames structured arrays
+    :rtype: tuple
+    """
+    ids = frames[:, 6].astype(numpy.uint16) << 8 | frames[:, 7]
+
+    is_data = frames[:, 1] == RSP_DATA
+    data = numpy.empty(numpy.count_nonzero(is_data), dtype=DATA_DTYPE)
+    data['offset'] = starts[is_data]
+    data['pm25'] = frames[is_data, 2] | frames[is_data, 3].astype(numpy.uint16) << 8
+    data['pm10'] = frames[is_data, 4] | frames[is_data, 5].astype(numpy.uint16) << 8
+    data['id'] = ids[is_data]
+
+    replies = numpy.empty(len(starts) - len(data), dtype=REPLY_DTYPE)
+    replies['offset'] = starts[~is_data]
+    replies['cmd'] = frames[~is_data, 2]
+    replies['data'] = frames[~is_data, 3:6]
+    replies['id'] = ids[~is_data]
+    return data, replies
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Module that manages many Nove SDS011 sensors sharing the same serial line.
+"""
+
+import time
+
+from pysds011.driver import CMD_QUERY_DATA
+from pysds011.driver import RSP_DATA
+from pysds011.driver import SDS011
+from pysds011.driver import FrameReader
+from pysds011.driver import get_command
+from pysds011.driver import process_data
+
+
+class SDS011Bus(SDS011):
+    """Driver for many sensors on the same serial line (RS485 or shared UART)
+
+    All the ``cmd_*`` methods of :class:`pysds011.driver.SDS011` are available.
+    Each reply is routed to the request with the same sensor ID and command:
+    replies from other sensors are kept, up to max_pending, for the requests they belong to.
+    Frames kept from a sensor are dropped when a new request is sent to it, as they are stale.
+    """
+
+    def __init__(self, ser, log, ids=(), max_pending=64, capture=None, metrics=None):
+        """Constructor
+
+        :param ser: serial, configured and opened, instance
+        :type ser: pyserial
+        :param log: logging, configured, instance
+        :type log: logging
+        :param ids: IDs of the sensors on the bus, defaults to ()
+        :type ids: list of 2 bytes, optional
+        :param max_pending: max number of replies kept for later requests, defaults to 64
+        :type max_pending: int, optional
+        :param capture: function called with each chunk of received bytes, see SDS011, defaults to None
+        :type capture: callable, optional
+        :param metrics: requests, latencies and failures recorder, see SDS011, defaults to None
+        :type metrics: DriverMetrics, optional
+        """
+        super(SDS011Bus, self).__init__(ser, log, metrics=metrics)
+        self.ids = list(ids)
+        self.reader = FrameReader(ser, log, max_pending=max_pending)
+        self.reader.capture = capture
+        self.reader.metrics = metrics
+
+    def for_each(self, method, ids=None, **kwargs):
+        """Call a driver command for each sensor on the bus
+
+        :param method: name of the command, like 'cmd_set_sleep'
+        :type method: str
+        :param ids: IDs of the sensors, defaults to None that is 'all the bus'
+        :type ids: list of 2 bytes, optional
+        :return: command results by sensor ID
+        :rtype: dict
+        """
+        func = getattr(self, method)
+        return {id: func(id=id, **kwargs) for id in (self.ids if ids is None else ids)}
+
+    def poll(self, ids=None):
+        """Read dust values from all the sensors with a single sweep:
+        all the queries are sent at once, then replies are collected
+        and associated to the sensor they come from.
+
+        :param ids: IDs of the sensors, defaults to None that is 'all the bus'
+        :type ids: list of 2 bytes, optional
+        :return: dust data Measurement by sensor ID, None for sensors that do not reply
+        :rtype: dict
+        """
+        ids = list(self.ids if ids is None else ids)
+        for id in ids:
+            self.reader.drop_pending(id)
+        self.ser.write(b''.join(get_command(CMD_QUERY_DATA, dest=id) for id in ids))
+        start = time.perf_counter()
+        res = dict()
+        for id in ids:
+            d = self.reader.read_frame(RSP_DATA, id=id)
+            if self.metrics is not None:
+                self.metrics.request(CMD_QUERY_DATA, id)
+                self.metrics.reply(CMD_QUERY_DATA, id, time.perf_counter() - start, d is not None)
+            if d is None:
+                self.log.error('No data from sensor %s', id.hex())
+                res[id] = None
+            else:
+                res[id] = process_data(d, self.log)
+        return res
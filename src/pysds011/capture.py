@@ -0,0 +1,362 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Module that records the bytes received from Nove SDS011 sensors in an append-only binary file,
+and replays them without the hardware. Bytes are recorded as read from the serial, before any
+frame is cut from them: noise and corrupted frames are kept, to reproduce the driver behavior.
+
+File is an 8 bytes header followed by fixed size, 20 bytes, records::
+
+    [8:monotonic time, double] | [2:port tag] | [1:length] | [9:received bytes]
+
+The port tag is the index of the port name, declared by a record with tag PORT_TAG
+(name length and index in place of the data) followed by records with tag NAME_TAG
+holding the name, 18 bytes each. Bytes read at once, more than 9, take some records:
+all but the last one have the MORE bit set in the length.
+Each session, that is each CaptureWriter, starts with a record with tag ANCHOR_TAG
+holding the wall clock time of its monotonic time, so that appended sessions share a timeline.
+Record a session with::
+
+    with CaptureWriter('field.cap') as cap:
+        sd = driver.SDS011(ser, log, capture=cap.hook(ser.port))
+        ...
+
+and replay it::
+
+    with CaptureReader('field.cap') as cap:
+        for timestamp, port, data in cap:
+            ...
+"""
+
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+
+from pysds011.driver import FRAME_LEN
+
+MAGIC = b'SDSCAP02'
+RECORD = struct.Struct('<dH%ds' % FRAME_LEN)
+# received bytes held by a record, after the length
+CHUNK = FRAME_LEN - 1
+# length bit of a record continued by the next one
+MORE = 0x80
+# port declaration: data field holds port index and name length
+PORT_TAG = 0xffff
+PORT = struct.Struct('<HH%dx' % (FRAME_LEN - 4))
+# port name: time and data fields hold 18 bytes of the name
+NAME_TAG = 0xfffe
+NAME_CHUNK = RECORD.size - 2
+# session start: data field holds the wall clock time, time.time(), of the record time
+ANCHOR_TAG = 0xfffd
+ANCHOR = struct.Struct('<d%dx' % (FRAME_LEN - 8))
+
+
+class CaptureError(Exception):
+    """File is not a capture"""
+
+
+def _check_magic(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise CaptureError('%s is not a capture file' % f.name)
+
+
+class CaptureWriter(object):
+    """Append received bytes to a capture file, created if it does not exist
+    """
+
+    def __init__(self, path, autoflush=True):
+        """Constructor
+
+        :param path: capture file
+        :type path: str
+        :param autoflush: flush each record to the OS, so that a crash of the process does not lose
+                          the tail of the capture, defaults to True
+        :type autoflush: bool, optional
+        """
+        self.path = path
+        self.autoflush = autoflush
+        self.ports = dict()
+        if os.path.exists(path) and os.path.getsize(path):
+            with CaptureReader(path) as reader:
+                self.ports = {name: tag for tag, name in enumerate(reader.ports)}
+        self.file = open(path, 'ab')
+        if 0 == self.file.tell():
+            self.file.write(MAGIC)
+        self.__lock = threading.Lock()
+        with self.__lock:
+            self.file.write(RECORD.pack(time.monotonic(), ANCHOR_TAG, ANCHOR.pack(time.time())))
+            self.__flush()
+
+    def __flush(self):
+        if self.autoflush:
+            self.file.flush()
+
+    def __tag(self, port):
+        tag = self.ports.get(port)
+        if tag is None:
+            tag = len(self.ports)
+            name = port.encode('utf-8')
+            self.file.write(RECORD.pack(time.monotonic(), PORT_TAG, PORT.pack(tag, len(name))))
+            for i in range(0, len(name), NAME_CHUNK):
+                chunk = name[i:i + NAME_CHUNK].ljust(NAME_CHUNK, b'\x00')
+                self.file.write(chunk[:8] + struct.pack('<H', NAME_TAG) + chunk[8:])
+            self.ports[port] = tag
+        return tag
+
+    def write(self, data, port='', timestamp=None):
+        """Append received bytes
+
+        :param data: bytes, as read from the serial
+        :type data: bytes
+        :param port: name of the port the bytes are received from, defaults to ''
+        :type port: str, optional
+        :param timestamp: time of the bytes as returned by time.monotonic(), defaults to None that is 'now'
+        :type timestamp: float, optional
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        data = bytes(data)
+        with self.__lock:
+            tag = self.__tag(port)
+            for i in range(0, len(data), CHUNK):
+                chunk = data[i:i + CHUNK]
+                size = len(chunk) | (MORE if i + CHUNK < len(data) else 0)
+                self.file.write(RECORD.pack(timestamp, tag, bytes((size,)) + chunk))
+            self.__flush()
+
+    def hook(self, port=''):
+        """Get the function to give as capture to the driver
+
+        :param port: name of the port, defaults to ''
+        :type port: str, optional
+        :return: function that writes the bytes received from port
+        :rtype: callable
+        """
+        return lambda data: self.write(data, port)
+
+    def flush(self):
+        with self.__lock:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CaptureReader(object):
+    """Memory map a capture file to replay it
+    """
+
+    def __init__(self, path):
+        """Constructor
+
+        :param path: capture file
+        :type path: str
+        :raises CaptureError: if the file is not a capture
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            _check_magic(f)
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # a record partially written at the end is ignored
+        self.count = (len(self.map) - len(MAGIC)) // RECORD.size
+        self.ports = list()
+        # (record index, monotonic time, wall clock time) of each session start
+        self.sessions = list()
+        self.__load_declarations()
+
+    def __tag_at(self, i):
+        return struct.unpack_from('<H', self.map, len(MAGIC) + i * RECORD.size + 8)[0]
+
+    def __load_declarations(self):
+        # tag high bytes, to find the declarations without unpacking all the records
+        high = self.map[len(MAGIC) + 9:len(MAGIC) + self.count * RECORD.size:RECORD.size]
+        i = high.find(b'\xff')
+        while i >= 0:
+            tag = self.__tag_at(i)
+            if ANCHOR_TAG == tag:
+                timestamp, _, field = RECORD.unpack_from(self.map, len(MAGIC) + i * RECORD.size)
+                self.sessions.append((i, timestamp, ANCHOR.unpack(field)[0]))
+            elif PORT_TAG == tag:
+                _, _, field = RECORD.unpack_from(self.map, len(MAGIC) + i * RECORD.size)
+                tag, size = PORT.unpack(field)
+                name = bytearray()
+                j = i + 1
+                while len(name) < size and j < self.count and NAME_TAG == self.__tag_at(j):
+                    chunk = self.map[len(MAGIC) + j * RECORD.size:len(MAGIC) + (j + 1) * RECORD.size]
+                    name += chunk[:8] + chunk[10:]
+                    j += 1
+                del self.ports[tag:]
+                self.ports.append(name[:size].decode('utf-8'))
+            i = high.find(b'\xff', i + 1)
+
+    def wall_clock(self, i, timestamp):
+        """Convert the monotonic time of a record to wall clock time, by the anchor of its session
+
+        :param i: record index
+        :type i: int
+        :param timestamp: record time
+        :type timestamp: float
+        :return: time as returned by time.time(), or timestamp itself if the session has no anchor
+        :rtype: float
+        """
+        k = bisect.bisect_right(self.sessions, (i, float('inf'))) - 1
+        if k < 0:
+            return timestamp
+        _, monotonic, wall = self.sessions[k]
+        return wall + timestamp - monotonic
+
+    def __iter__(self):
+        """Received bytes in the order they were read
+
+        :return: generator of (wall clock time, port name, bytes)
+        :rtype: generator
+        """
+        data = bytearray()
+        for i in range(self.count):
+            timestamp, tag, field = RECORD.unpack_from(self.map, len(MAGIC) + i * RECORD.size)
+            if tag >= ANCHOR_TAG:
+                continue
+            data += field[1:1 + min(field[0] & (MORE - 1), CHUNK)]
+            if not field[0] & MORE:
+                yield self.wall_clock(i, timestamp), self.ports[tag], bytes(data)
+                del data[:]
+
+    def chunks(self, port=None):
+        """Bytes received from a port, as they were read
+
+        :param port: port name, defaults to None that is 'all'
+        :type port: str, optional
+        :return: generator of bytes
+        :rtype: generator
+        """
+        for _, p, data in self:
+            if port is None or p == port:
+                yield data
+
+    def serial(self, port=None):
+        """Serial that returns the captured bytes, to replay them into the driver
+
+        :param port: port name, defaults to None that is 'all'
+        :type port: str, optional
+        :rtype: ReplaySerial
+        """
+        return ReplaySerial(self.chunks(port), port)
+
+    def records(self):
+        """All the records, with NumPy, without any copy of the file.
+        Data records are the ones with 'tag' lower than ANCHOR_TAG.
+        The reader cannot be closed while the returned array, or a view of it, is alive.
+
+        :return: structured array with fields 'time', 'tag' and 'data' (10 uint8, length included)
+        :rtype: numpy.ndarray
+        """
+        import numpy
+
+        dtype = numpy.dtype([('time', '<f8'), ('tag', '<u2'), ('data', numpy.uint8, (FRAME_LEN,))])
+        return numpy.frombuffer(self.map, dtype=dtype, count=self.count, offset=len(MAGIC))
+
+    def decode(self):
+        """Decode all the captured bytes at once, each port by itself, see pysds011.bulk
+
+        :return: wall clock time and port tag of each received byte, with the bulk decoder result
+                 whose offsets are indexes in them
+        :rtype: tuple
+        """
+        import numpy
+        from pysds011.bulk import DATA_DTYPE, REPLY_DTYPE, Decoded, decode_frames
+
+        rec = self.records()
+        index = numpy.flatnonzero(rec['tag'] < ANCHOR_TAG)
+        rec = rec[index]
+        size = numpy.minimum(rec['data'][:, 0] & (MORE - 1), CHUNK)
+        wall = rec['time'].copy()
+        if self.sessions:
+            start, monotonic, clock = (numpy.array(v) for v in zip(*self.sessions))
+            k = numpy.searchsorted(start, index, side='right') - 1
+            anchored = k >= 0
+            wall[anchored] += clock[k[anchored]] - monotonic[k[anchored]]
+        times, tags = [numpy.empty(0)], [numpy.empty(0, numpy.uint16)]
+        data, replies = [numpy.empty(0, DATA_DTYPE)], [numpy.empty(0, REPLY_DTYPE)]
+        rejected = 0
+        base = 0
+        for tag in numpy.unique(rec['tag']):
+            mine = rec['tag'] == tag
+            raw = rec['data'][mine, 1:][numpy.arange(CHUNK) < size[mine, None]]
+            res = decode_frames(raw)
+            res.data['offset'] += base
+            res.replies['offset'] += base
+            data.append(res.data)
+            replies.append(res.replies)
+            rejected += res.rejected
+            times.append(numpy.repeat(wall[mine], size[mine]))
+            tags.append(numpy.full(len(raw), tag, numpy.uint16))
+            base += len(raw)
+        return (numpy.concatenate(times), numpy.concatenate(tags),
+                Decoded(numpy.concatenate(data), numpy.concatenate(replies), rejected))
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ReplaySerial(object):
+    """Serial that returns captured bytes, what is written is ignored
+    """
+
+    def __init__(self, chunks, port=None):
+        """Constructor
+
+        :param chunks: bytes to return
+        :type chunks: iterable of bytes
+        :param port: port name, defaults to None
+        :type port: str, optional
+        """
+        self.port = port
+        self.baudrate = 9600
+        self.timeout = None
+        self.is_open = True
+        self.__chunks = iter(chunks)
+        self.__buffer = bytearray()
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def flushInput(self):
+        # captured bytes are never dropped
+        pass
+
+    reset_input_buffer = flushInput
+
+    @property
+    def in_waiting(self):
+        return len(self.__buffer)
+
+    def write(self, data):
+        return len(data)
+
+    def read(self, size=1):
+        while len(self.__buffer) < size:
+            chunk = next(self.__chunks, None)
+            if chunk is None:
+                break
+            self.__buffer += chunk
+        ret = bytes(self.__buffer[:size])
+        del self.__buffer[:size]
+        return ret
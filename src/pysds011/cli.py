@@ -16,51 +16,122 @@ Module that contains the command line app.
 #
 #  Also see (1) from http://click.pocoo.org/5/setuptools/#setuptools-integration
 
-from pysds011 import driver
+#  Only what is needed to parse the command line is imported here,
+#  each subcommand imports the modules it uses: the app is often run many times in a row.
 import click
 import click_log
 import logging
-import serial
 import sys
-import time
-import json
 
 FORMAT = "[%(filename)s:%(lineno)s - %(funcName)15s()]::%(message)s"
-logging.basicConfig(format=FORMAT, level=logging.DEBUG)
 log = logging.getLogger(__name__)
 click_log.basic_config(log)
 
 
+def positive(ctx, param, value):
+    """Click callback that rejects values not greater than 0, FloatRange has no open bounds in click 7"""
+    if value is not None and value <= 0:
+        raise click.BadParameter('%s is not greater than 0' % value)
+    return value
+
+
+def new_serial(port):
+    """Serial instance of a sensor port, configured and not opened"""
+    import serial
+
+    ser = serial.Serial()
+    ser.port = port
+    ser.baudrate = 9600
+    return ser
+
+
 class Context(object):
-    def __init__(self, ser=None, id=None):
-        self.serial = ser
+    def __init__(self, port=None, id=None, socket=None, use_daemon=True):
+        self.port = port
         self.id = id
+        self.socket = socket
+        self.use_daemon = use_daemon
+        self.__serial = None
+        self.__daemon = False
+
+    @property
+    def serial(self):
+        """Serial instance, configured and not opened, created at first use"""
+        if self.__serial is None:
+            self.__serial = new_serial(self.port)
+        return self.__serial
+
+    def target_serials(self, target):
+        """Group the sensors by port
+
+        :param target: sensors as PORT[@ID], see pysds011.fleet.parse_target, --port and --id if empty
+        :type target: list of str
+        :return: serial instance, configured and not opened, and ids of the sensors on it, for each port
+        :rtype: list of tuple
+        """
+        from pysds011.fleet import parse_target
+
+        ports = dict()
+        for port, id in [parse_target(t) for t in target] or [(self.port, self.id)]:
+            ports.setdefault(port, []).append(id)
+        return [(new_serial(port), ids) for port, ids in ports.items()]
+
+    @property
+    def daemon(self):
+        """Client of the daemon that owns the port, None if there is not"""
+        if self.__daemon is False:
+            self.__daemon = None
+            if self.use_daemon:
+                from pysds011.daemon import DaemonClient
+
+                if DaemonClient.running(self.socket):
+                    client = DaemonClient(self.socket)
+                    try:
+                        if self.port in client.request('ports'):
+                            self.__daemon = client
+                    except Exception as e:
+                        log.debug('Daemon not available: %s', e)
+        return self.__daemon
+
+
+def forward(ctx, cmd, value=None):
+    """Send a command to the daemon that owns the port
+
+    :return: result of the command, None in case of error
+    """
+    log.debug('Forward %s to daemon', cmd)
+    try:
+        return ctx.daemon.request(cmd, port=ctx.port, id=ctx.id, value=value)
+    except Exception as e:
+        log.error('Daemon error: %s', e)
+        return None
 
 
 @click.group()
 @click.option('--port', default='/dev/ttyUSB0', help='UART port to communicate with dust sensor.')
 @click.option('--id', help='ID of sensor to use. If not provided, the driver will internally use FFFF that targets all.')
+@click.option('--socket', help='Unix socket of the daemon, see serve command.')
+@click.option('--daemon/--no-daemon', default=True, help='Forward commands to the daemon, if it owns the port.')
 @click_log.simple_verbosity_option(log)
 @click.pass_context
-def main(ctx, port, id):
+def main(ctx, port, id, socket, daemon):
     """
     pysds011 cli app entry point
     """
-    main_ser = serial.Serial()
-    main_ser.port = port
-    main_ser.baudrate = 9600
+    # verbosity option is already applied: other loggers get the same level
+    logging.basicConfig(format=FORMAT, level=log.getEffectiveLevel())
     sensor_id = None
     if id:
         sensor_id = bytes.fromhex(id)
     else:
         sensor_id = b'\xff\xff'
-    ctx.obj = Context(ser=main_ser, id=sensor_id)
+    ctx.obj = Context(port=port, id=sensor_id, socket=socket, use_daemon=daemon)
     log.debug('Process subcommands')
 
 
 @main.resultcallback()
 def process_result(result, **kwargs):
-    log.debug('process_result res:%s' % str(result))
+    log.debug('process_result res:%s', result)
     sys.exit(result)
 
 
@@ -78,6 +149,27 @@ def help(ctx, subcommand):
         click.echo(subcommand_obj.get_help(ctx))
 
 
+def echo_fw_version(fw_str, format):
+    """Print FW version
+
+    :return: exit value
+    :rtype: int
+    """
+    import json
+
+    if not fw_str:
+        log.error('Invalid FW version')
+        return 1
+    if 'PRETTY' in format:
+        click.echo('FW version %s' % fw_str['pretty'])
+    elif 'JSON' in format:
+        click.echo(json.dumps(fw_str))
+    else:
+        log.error('Unknown format %s', format)
+        return 1
+    return 0
+
+
 @main.command()
 @click.option('--format', default='PRETTY', help='result format (PRETTY|JSON|PM2.5|PM10)')
 @click.pass_obj
@@ -85,27 +177,20 @@ def fw_version(ctx, format):
     """
     Get SDS011 FW version
     """
+    from pysds011 import driver
+
     sd = None
     exit_val = 0
     log.debug('BEGIN')
+    if ctx.daemon is not None:
+        return echo_fw_version(forward(ctx, 'fw_version'), format)
     try:
         ctx.serial.open()
         ctx.serial.flushInput()
         sd = driver.SDS011(ctx.serial, log)
         sd.cmd_set_sleep(0)
         sd.cmd_set_mode(sd.MODE_QUERY)
-        fw_str = sd.cmd_firmware_ver()
-        if fw_str:
-            if 'PRETTY' in format:
-                click.echo('FW version %s' % fw_str['pretty'])
-            elif 'JSON' in format:
-                click.echo(json.dumps(fw_str))
-            else:
-                log.error('Unknown format %s' % format)
-                exit_val = 1
-        else:
-            log.error('Invalid FW version')
-            exit_val = 1
+        exit_val = echo_fw_version(sd.cmd_firmware_ver(), format)
     except Exception as e:
         log.exception(e)
         exit_val = 1
@@ -113,10 +198,28 @@ def fw_version(ctx, format):
         if sd is not None:
             sd.cmd_set_sleep(1)
         ctx.serial.close()
-    log.debug('END exit_val:%d' % exit_val)
+    log.debug('END exit_val:%d', exit_val)
     return exit_val
 
 
+def echo_get_set(res, value, error):
+    """Print the result of a get, or check the one of a set
+
+    :param res: command result
+    :param value: value set, None for a get
+    :param error: message of a set failure
+    :return: exit value
+    :rtype: int
+    """
+    if value:
+        if not res:
+            log.error(error)
+            return 1
+    else:
+        click.echo(res)
+    return 0
+
+
 @main.command()
 @click.argument('mode', type=click.Choice(['0', '1']), required=False)
 @click.pass_obj
@@ -125,14 +228,18 @@ def sleep(ctx, mode):
     Get and Set sleep MODE 1:sleep 0:wakeup
     Just 'sleep' without a number result in querying the actual value applied in the sensor
     """
+    from pysds011 import driver
+
     sd = None
     exit_val = 0
+    if ctx.daemon is not None:
+        return echo_get_set(forward(ctx, 'sleep', int(mode) if mode else None), mode, 'cmd_set_sleep error')
     try:
         ctx.serial.open()
         ctx.serial.flushInput()
         sd = driver.SDS011(ctx.serial, log)
         if mode:
-            log.debug('BEGIN cli query mode:%d' % int(mode))
+            log.debug('BEGIN cli query mode:%s', mode)
             if not sd.cmd_set_sleep(int(mode), id=ctx.id):
                 log.error('cmd_set_sleep error')
                 exit_val = 1
@@ -143,7 +250,7 @@ def sleep(ctx, mode):
         exit_val = 1
     finally:
         ctx.serial.close()
-    log.debug('END exit_val:%d' % exit_val)
+    log.debug('END exit_val:%d', exit_val)
     return exit_val
 
 
@@ -156,14 +263,18 @@ def mode(ctx, mode):
     1: QUERY mode：Sensor received query data command to report a measurement data.
     0: ACTIVE mode：Sensor automatically reports a measurement data in a work period.
     """
+    from pysds011 import driver
+
     sd = None
     exit_val = 0
+    if ctx.daemon is not None:
+        return echo_get_set(forward(ctx, 'mode', int(mode) if mode else None), mode, 'cmd_set_mode error')
     try:
         ctx.serial.open()
         ctx.serial.flushInput()
         sd = driver.SDS011(ctx.serial, log)
         if mode:
-            log.debug('BEGIN cli acquisition mode:%d' % int(mode))
+            log.debug('BEGIN cli acquisition mode:%s', mode)
             if not sd.cmd_set_mode(int(mode), id=ctx.id):
                 log.error('cmd_set_mode error')
                 exit_val = 1
@@ -174,21 +285,60 @@ def mode(ctx, mode):
         exit_val = 1
     finally:
         ctx.serial.close()
-    log.debug('END exit_val:%d' % exit_val)
+    log.debug('END exit_val:%d', exit_val)
     return exit_val
 
 
+def echo_dust(pm, format):
+    """Print dust value
+
+    :return: exit value
+    :rtype: int
+    """
+    import json
+
+    if pm is None:
+        log.error('Empty data')
+        return 1
+    if 'PRETTY' in format:
+        click.echo(str(pm['pretty']))
+    elif 'JSON' in format:
+        click.echo(json.dumps(dict(pm)))
+    elif 'PM2.5' in format:
+        click.echo(pm['pm25'])
+    elif 'PM10' in format:
+        click.echo(pm['pm10'])
+    else:
+        log.error('Unknown format %s', format)
+        return 1
+    return 0
+
+
 @main.command()
 @click.option('--warmup', default=3, help='Time in sec to warm up the sensor')
+@click.option('--adaptive', is_flag=True, help='Stop warm up as soon as readings are stable, warmup is the max time')
+@click.option('--tolerance', default=1.0, help='Max difference in μg/m^3 between stable readings, with --adaptive')
+@click.option('--samples', default=1, type=click.IntRange(min=1), help='Number of readings, one a second, to reduce to one')
+@click.option('--reduce', default='mean', type=click.Choice(['mean', 'median']), help='How to reduce many samples')
+@click.option('--reject', default=None, type=float, help='Discard samples farther than REJECT MADs from the median')
 @click.option('--format', default='PRETTY', help='result format (PRETTY|JSON|PM2.5|PM10)')
 @click.pass_obj
-def dust(ctx, warmup, format):
+def dust(ctx, warmup, adaptive, tolerance, samples, reduce, reject, format):
     """
     Get dust value
     """
+    import time
+
+    from pysds011 import driver
+
     sd = None
     exit_val = 0
     log.debug('BEGIN')
+    if ctx.daemon is not None:
+        # daemon keeps the sensor warm
+        if samples > 1:
+            log.warning('--samples ignored, a single reading is requested to the daemon')
+        return echo_dust(forward(ctx, 'dust'), format)
     try:
         ctx.serial.open()
         ctx.serial.flushInput()
@@ -201,23 +351,22 @@ def dust(ctx, warmup, format):
             log.error('Set MODE_QUERY failure')
             exit_val = 1
             return exit_val  # this jump to finally
-        time.sleep(warmup)
-        pm = sd.cmd_query_data(id=ctx.id)
-        if pm is not None:
-            if 'PRETTY' in format:
-                click.echo(str(pm['pretty']))
-            elif 'JSON' in format:
-                click.echo(json.dumps(pm))
-            elif 'PM2.5' in format:
-                click.echo(pm['pm25'])
-            elif 'PM10' in format:
-                click.echo(pm['pm10'])
-            else:
-                log.error('Unknown format %s' % format)
-                exit_val = 1
+        if adaptive:
+            pm = sd.wait_warmup(max_time=warmup, tolerance=tolerance, id=ctx.id)
         else:
-            log.error('Empty data')
-            exit_val = 1
+            time.sleep(warmup)
+            pm = sd.cmd_query_data(id=ctx.id)
+        if samples > 1:
+            from pysds011.aggregate import Aggregator
+            from pysds011.aggregate import sample
+
+            agg = Aggregator(reject=reject)
+            agg.push(pm)
+            agg.extend(sample(sd, samples - 1, id=ctx.id))
+            if agg.rejected:
+                log.info('%d samples rejected', agg.rejected)
+            pm = agg.result(reduce)
+        exit_val = echo_dust(pm, format)
     except Exception as e:
         log.exception(e)
         exit_val = 1
@@ -226,7 +375,7 @@ def dust(ctx, warmup, format):
         if sd is not None:
             sd.cmd_set_sleep(1, id=ctx.id)
         ctx.serial.close()
-    log.debug('END exit_val:%d' % exit_val)
+    log.debug('END exit_val:%d', exit_val)
     return exit_val
 
 
@@ -237,6 +386,8 @@ def id(ctx, id):
     """
     Get and set the sensor address
     """
+    from pysds011 import driver
+
     sd = None
     exit_val = 0
     log.debug('BEGIN')
@@ -245,6 +396,13 @@ def id(ctx, id):
         if id and (ctx.id is None or ctx.id == b'\xff\xff'):
             log.error("Missing current id")
             exit_val = 1
+        elif ctx.daemon is not None:
+            res = forward(ctx, 'id', id)
+            if not res:
+                log.error('cmd_set_id failure' if id else 'cmd_firmware_ver failure')
+                exit_val = 1
+            elif not id:
+                click.echo(res)
         else:
             ctx.serial.open()
             ctx.serial.flushInput()
@@ -262,7 +420,7 @@ def id(ctx, id):
                     log.error('cmd_firmware_ver failure')
                     exit_val = 1
                     return exit_val
-                log.debug("fw:"+str(fw))
+                log.debug("fw:%s", fw)
                 click.echo(''.join('%02x' % i for i in fw['id']))
     except Exception as e:
         log.exception(e)
@@ -272,5 +430,243 @@ def id(ctx, id):
         if sd is not None:
             sd.cmd_set_sleep(1, id=sleep_address)
         ctx.serial.close()
-    log.debug('END exit_val:%d' % exit_val)
+    log.debug('END exit_val:%d', exit_val)
+    return exit_val
+
+
+@main.command()
+@click.option('--interval', default=60.0, callback=positive, help='Time in sec between two samples')
+@click.option('--count', default=0, help='Number of samples, 0 is forever')
+@click.option('--warmup', default=3.0, help='Time in sec to warm up the sensor before each sample')
+@click.option('--min-sleep', type=float, help='Min time in sec the sensor sleeps between two samples, '
+              'it is kept awake if the interval is shorter. Defaults to 30')
+@click.option('--format', default='CSV', type=click.Choice(['CSV', 'NDJSON'], case_sensitive=False),
+              help='result format, one record per line')
+@click.pass_obj
+def monitor(ctx, interval, count, warmup, min_sleep, format):
+    """
+    Sample dust values continuously, keeping the port open
+    """
+    import json
+
+    from pysds011.session import MIN_SLEEP
+    from pysds011.session import SDS011Session
+
+    exit_val = 0
+    log.debug('BEGIN')
+    csv = 'CSV' == format.upper()
+    if csv:
+        click.echo('timestamp,id,pm25,pm10')
+    try:
+        with SDS011Session(ctx.serial, log, id=ctx.id) as s:
+            for pm in s.monitor(interval, count=count or None, warmup=warmup,
+                                min_sleep=MIN_SLEEP if min_sleep is None else min_sleep):
+                if pm is None:
+                    log.error('Empty data')
+                    exit_val = 1
+                elif csv:
+                    click.echo('%.3f,%s,%s,%s' % (pm.timestamp, pm.id.hex(), pm.pm25, pm.pm10))
+                else:
+                    click.echo(json.dumps({'timestamp': pm.timestamp, 'id': pm.id.hex(),
+                                           'pm25': pm.pm25, 'pm10': pm.pm10}))
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        log.exception(e)
+        exit_val = 1
+    log.debug('END exit_val:%d', exit_val)
+    return exit_val
+
+
+@main.command()
+@click.option('--output', '-o', required=True, help='Capture file, bytes are appended if it already exists')
+@click.option('--count', default=60, help='Number of measurements to capture, 0 is forever')
+@click.pass_obj
+def capture(ctx, output, count):
+    """
+    Capture the bytes received from the sensor in active mode
+    """
+    from pysds011 import driver
+    from pysds011.capture import CaptureWriter
+
+    sd = None
+    exit_val = 0
+    log.debug('BEGIN')
+    readings = 0
+    cap = None
+    try:
+        cap = CaptureWriter(output)
+        ctx.serial.open()
+        ctx.serial.flushInput()
+        sd = driver.SDS011(ctx.serial, log, capture=cap.hook(ctx.serial.port))
+        if sd.cmd_set_sleep(0, id=ctx.id) is not True:
+            log.error('WakeUp failure')
+            exit_val = 1
+            return exit_val  # this jump to finally
+        try:
+            for pm in sd.stream(id=ctx.id, count=count or None):
+                readings += 1
+                log.debug(pm.pretty)
+        except KeyboardInterrupt:
+            pass
+        if count and readings < count:
+            log.error('Stream interrupted')
+            exit_val = 1
+    except Exception as e:
+        log.exception(e)
+        exit_val = 1
+    finally:
+        if sd is not None:
+            sd.cmd_set_sleep(1, id=ctx.id)
+        ctx.serial.close()
+        if cap is not None:
+            cap.close()
+    click.echo('%d measurements captured in %s' % (readings, output))
+    log.debug('END exit_val:%d', exit_val)
+    return exit_val
+
+
+@main.command()
+@click.argument('script', type=click.File('r'), default='-')
+@click.option('--target-id', '-i', multiple=True,
+              help='ID of a sensor to run the script on, 4 hex digits. Can be repeated. Defaults to --id')
+@click.pass_obj
+def batch(ctx, script, target_id):
+    """
+    Run the commands of SCRIPT file (stdin if not provided), one for each line,
+    with one wake up and one final sleep. Print a JSON line for each result
+    """
+    import json
+
+    from pysds011 import driver
+    from pysds011.batch import parse_script
+    from pysds011.batch import run_script
+
+    sd = None
+    exit_val = 0
+    log.debug('BEGIN')
+    try:
+        commands = parse_script(script)
+        ids = [bytes.fromhex(i) for i in target_id] or [ctx.id]
+    except ValueError as e:
+        log.error('Invalid script: %s', e)
+        return 1
+    try:
+        ctx.serial.open()
+        ctx.serial.flushInput()
+        sd = driver.SDS011(ctx.serial, log)
+        for id in ids:
+            if sd.cmd_set_sleep(0, id=id) is not True:
+                log.error('WakeUp failure %s', id.hex())
+                exit_val = 1
+                return exit_val  # this jump to finally
+        for res in run_script(sd, commands, ids):
+            if not res['ok']:
+                exit_val = 1
+            click.echo(json.dumps(res))
+    except Exception as e:
+        log.exception(e)
+        exit_val = 1
+    finally:
+        if sd is not None:
+            for id in ids:
+                sd.cmd_set_sleep(1, id=id)
+        ctx.serial.close()
+    log.debug('END exit_val:%d', exit_val)
+    return exit_val
+
+
+@main.command()
+@click.option('--target', '-t', multiple=True, required=True,
+              help='Sensor to read as PORT[@ID], ID is 4 hex digits. Can be repeated.')
+@click.option('--warmup', default=3, help='Time in sec to warm up the sensors')
+@click.option('--workers', default=8, help='Max number of sensors read at the same time')
+@click.option('--format', default='PRETTY', help='result format (PRETTY|JSON)')
+def fleet(target, warmup, workers, format):
+    """
+    Get dust value of many sensors, each one on its own port, concurrently
+    """
+    import json
+
+    from pysds011.fleet import parse_target
+    from pysds011.fleet import poll_fleet
+
+    exit_val = 0
+    log.debug('BEGIN')
+    results = poll_fleet([parse_target(t) for t in target], log, warmup=warmup, max_workers=workers)
+    for r in results:
+        if r['dust'] is None:
+            log.error('Empty data from %s', r['port'])
+            exit_val = 1
+    if 'PRETTY' in format:
+        for r in results:
+            click.echo('{} {}: {}'.format(r['port'], r['id'], r['dust']['pretty'] if r['dust'] else 'ERROR'))
+    elif 'JSON' in format:
+        click.echo(json.dumps([dict(r, dust=dict(r['dust']) if r['dust'] is not None else None) for r in results]))
+    else:
+        log.error('Unknown format %s', format)
+        exit_val = 1
+    log.debug('END exit_val:%d', exit_val)
+    return exit_val
+
+
+@main.command()
+@click.option('--target', '-t', multiple=True,
+              help='Sensor to serve as PORT[@ID], ID is 4 hex digits. Can be repeated. Defaults to --port and --id')
+@click.option('--refresh', default=10.0, help='Time in sec between two readings of each sensor')
+@click.option('--max-age', default=30.0, help='Max age in sec of the cached reading returned by dust')
+@click.option('--warmup', default=10.0, help='Max time in sec to warm up a sensor after waking it up')
+@click.pass_obj
+def serve(ctx, target, refresh, max_age, warmup):
+    """
+    Run a daemon that owns the ports and keeps the sensors warm,
+    other commands on the same ports are forwarded to it
+    """
+    from pysds011.daemon import SDS011Daemon
+
+    exit_val = 0
+    log.debug('BEGIN')
+    sers = ctx.target_serials(target)
+    d = SDS011Daemon(sers, log, path=ctx.socket, refresh=refresh, max_age=max_age, warmup=warmup)
+    try:
+        log.info('Serve %s on %s', ', '.join(ser.port for ser, _ in sers), d.path)
+        d.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        log.exception(e)
+        exit_val = 1
+    log.debug('END exit_val:%d', exit_val)
+    return exit_val
+
+
+@main.command()
+@click.option('--target', '-t', multiple=True,
+              help='Sensor to export as PORT[@ID], ID is 4 hex digits. Can be repeated. Defaults to --port and --id')
+@click.option('--listen', default='localhost', help='Address to serve /metrics on')
+@click.option('--http-port', default=None, type=int, help='TCP port to serve /metrics on, defaults to 9611')
+@click.option('--interval', default=60.0, help='Time in sec between two readings of each sensor')
+@click.option('--warmup', default=10.0, help='Time in sec to warm up the sensors before each reading')
+@click.pass_obj
+def exporter(ctx, target, listen, http_port, interval, warmup):
+    """
+    Serve the readings as Prometheus metrics, sensors are sampled in background
+    """
+    from pysds011.exporter import DEFAULT_PORT
+    from pysds011.exporter import SDS011Exporter
+
+    exit_val = 0
+    log.debug('BEGIN')
+    sers = ctx.target_serials(target)
+    address = (listen, DEFAULT_PORT if http_port is None else http_port)
+    e = SDS011Exporter(sers, log, address=address, interval=interval, warmup=warmup)
+    try:
+        log.info('Export %s on http://%s:%d/metrics', ', '.join(ser.port for ser, _ in sers), *address)
+        e.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except Exception as ex:
+        log.exception(ex)
+        exit_val = 1
+    log.debug('END exit_val:%d', exit_val)
     return exit_val
@@ -0,0 +1,417 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Module that implements a resident daemon owning the serial ports of Nove SDS011 sensors,
+and its client. Sensors are kept awake and read periodically, so that a dust request
+is answered from a fresh cached reading, with no warm up. A sensor is warmed up each time
+it is woken up, before its readings are cached.
+
+Requests and replies are JSON objects, one per line, on a local Unix socket::
+
+    {"cmd": "dust", "port": "/dev/ttyUSB0", "id": "ffff"}
+    {"result": {"pm25": 6.0, "pm10": 16.5, ...}}
+
+    {"cmd": "sleep", "port": "/dev/ttyUSB0", "id": "ffff", "value": 1}
+    {"error": "Unknown port /dev/ttyUSB9"}
+
+A dust request can take the warm up time of the sensor, that the daemon tells with::
+
+    {"cmd": "warmup", "port": "/dev/ttyUSB0"}
+    {"result": 10.0}
+"""
+
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+
+from pysds011 import driver
+
+# max time in sec to wait for a daemon reply, a dust one also the warm up of the sensor
+CLIENT_TIMEOUT = 10.0
+# directory of the socket without XDG_RUNTIME_DIR, formatted with the user id
+FALLBACK_DIR = '/tmp/pysds011-%d'
+
+
+def default_socket():
+    """
+    :return: path of the daemon socket, private to the user
+    :rtype: str
+    """
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, 'pysds011.sock')
+    return os.path.join(FALLBACK_DIR % os.getuid(), 'pysds011.sock')
+
+
+class DaemonError(Exception):
+    """Request failed in the daemon"""
+
+
+def private_dir(path):
+    """Create a directory accessible only by the user, or check that an existing one is
+
+    :param path: directory
+    :type path: str
+    :raises DaemonError: if the directory exists and it is not private to the user
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        st = os.lstat(path)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise DaemonError('%s is not a directory private to the user' % path)
+
+
+def measurement_dict(pm):
+    """JSON friendly dust data, with sensor id and timestamp
+
+    :type pm: Measurement
+    :rtype: dict
+    """
+    res = pm._asdict()
+    res['id'] = pm.id.hex() if pm.id is not None else None
+    res['timestamp'] = pm.timestamp
+    return res
+
+
+class SensorPort(object):
+    """Serial port owned by the daemon, with the sensors on it
+    """
+
+    def __init__(self, ser, log, ids=(), warmup=10.0):
+        """Constructor
+
+        :param ser: serial, configured, instance
+        :type ser: pyserial
+        :param log: logging, configured, instance
+        :type log: logging
+        :param ids: sensors to keep awake and read, defaults to ()
+        :type ids: list of 2 bytes, optional
+        :param warmup: max time in sec to warm up a sensor after waking it up, see SDS011.wait_warmup,
+                       defaults to 10.0
+        :type warmup: float, optional
+        """
+        self.ser = ser
+        self.log = log
+        self.warmup = warmup
+        # the daemon owns the port, no one else sends commands to these sensors:
+        # their known state is reliable, as long as they are not power cycled
+        self.sd = driver.SDS011(ser, log, cache=True)
+        self.ids = list(ids)
+        self.lock = threading.Lock()
+        # last reading by sensor id
+        self.readings = dict()
+
+    def open(self):
+        self.ser.open()
+        self.ser.flushInput()
+        for id in self.ids:
+            with self.lock:
+                pm = self.read(id)
+            if pm is not None:
+                self.readings[id] = pm
+
+    def close(self):
+        with self.lock:
+            if not self.ser.is_open:
+                return
+            for id in self.ids:
+                self.sd.cmd_set_sleep(1, id=id)
+            self.ser.close()
+
+    def wake(self, id):
+        """Wake up a sensor and set it in query mode, port lock has to be held
+
+        :return: True if the sensor is ready to be read
+        :rtype: bool
+        """
+        if self.sd.cmd_set_sleep(0, id=id) is not True:
+            self.log.error('%s WakeUp failure', self.ser.port)
+            return False
+        if self.sd.cmd_set_mode(self.sd.MODE_QUERY, id=id) is not True:
+            self.log.error('%s Set MODE_QUERY failure', self.ser.port)
+            return False
+        return True
+
+    def read(self, id):
+        """Read a sensor, woken up and warmed up first if it is not known to be awake,
+        port lock has to be held
+
+        :rtype: Measurement or None in case of error
+        """
+        awake = self.sd.state.get(bytes(id), {}).get('sleep') is False
+        if not self.wake(id):
+            return None
+        if awake:
+            return self.sd.cmd_query_data(id=id)
+        return self.sd.wait_warmup(max_time=self.warmup, id=id)
+
+    def asleep(self, id):
+        """
+        :return: True if the sensor has been put to sleep by a request
+        :rtype: bool
+        """
+        return self.sd.state.get(bytes(id), {}).get('sleep') is True
+
+    def refresh(self):
+        """Read all the sensors that are not sleeping
+        """
+        for id in list(self.ids):
+            with self.lock:
+                if self.asleep(id):
+                    continue
+                pm = self.sd.cmd_query_data(id=id)
+            if pm is not None:
+                self.readings[id] = pm
+
+    def dust(self, id, max_age):
+        """Get a reading not older than max_age, from cache or from the sensor
+
+        :rtype: Measurement or None in case of error
+        """
+        pm = self.readings.get(id)
+        if pm is not None and time.time() - pm.timestamp <= max_age and not self.asleep(id):
+            return pm
+        with self.lock:
+            if id not in self.ids:
+                self.ids.append(id)
+            pm = self.read(id)
+        if pm is not None:
+            self.readings[id] = pm
+        return pm
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                res = {'result': self.server.daemon.execute(json.loads(line.decode('utf-8')))}
+            except Exception as e:
+                res = {'error': str(e)}
+            self.wfile.write(json.dumps(res).encode('utf-8') + b'\n')
+
+
+class SDS011Daemon(object):
+    """Own serial ports and answer to requests on a Unix socket::
+
+        d = SDS011Daemon([(ser, [b'\xff\xff'])], log)
+        d.serve_forever()
+    """
+
+    def __init__(self, ports, log, path=None, refresh=10.0, max_age=30.0, warmup=10.0):
+        """Constructor
+
+        :param ports: serial, configured, instance and ids of the sensors on it
+        :type ports: list of tuple
+        :param log: logging, configured, instance
+        :type log: logging
+        :param path: Unix socket, defaults to None that is default_socket()
+        :type path: str, optional
+        :param refresh: time in sec between two readings of each sensor, defaults to 10.0
+        :type refresh: float, optional
+        :param max_age: max age in sec of a cached reading returned to a dust request, defaults to 30.0
+        :type max_age: float, optional
+        :param warmup: max time in sec to warm up a sensor after waking it up, defaults to 10.0
+        :type warmup: float, optional
+        """
+        self.log = log
+        self.path = path or default_socket()
+        self.refresh = refresh
+        self.max_age = max_age
+        self.ports = {ser.port: SensorPort(ser, log, ids, warmup) for ser, ids in ports}
+        self.server = None
+        self.__stop = threading.Event()
+        self.__threads = list()
+
+    def start(self):
+        """Open the ports, then read the sensors and answer to requests in background threads
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory) or directory == os.path.abspath(FALLBACK_DIR % os.getuid()):
+            # in a shared directory, like /tmp, the socket path is predictable
+            private_dir(directory)
+        if os.path.exists(self.path):
+            if DaemonClient.running(self.path):
+                raise DaemonError('Daemon already running on %s' % self.path)
+            # left by a daemon that did not exit cleanly
+            os.unlink(self.path)
+        for p in self.ports.values():
+            p.open()
+        # socket created already private to the user
+        umask = os.umask(0o177)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(self.path, RequestHandler)
+        finally:
+            os.umask(umask)
+        self.server.daemon = self
+        self.server.daemon_threads = True
+        self.__stop.clear()
+        self.__threads = [threading.Thread(target=self.__refresh, daemon=True),
+                          threading.Thread(target=self.server.serve_forever, daemon=True)]
+        for t in self.__threads:
+            t.start()
+
+    def serve_forever(self):
+        """Start and wait until stopped or interrupted by the user
+        """
+        try:
+            self.start()
+            while not self.__stop.is_set():
+                self.__stop.wait(1.0)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop listening, put the sensors to sleep and close the ports
+        """
+        self.__stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+        for t in self.__threads:
+            t.join()
+        self.__threads = list()
+        if self.server is not None:
+            self.server.server_close()
+            self.server = None
+            os.unlink(self.path)
+        for p in self.ports.values():
+            p.close()
+
+    def __refresh(self):
+        # sensors have just been read by open
+        while not self.__stop.wait(self.refresh):
+            for p in self.ports.values():
+                p.refresh()
+
+    def execute(self, req):
+        """Execute a request
+
+        :param req: request with fields 'cmd', 'port', 'id' (4 hex digits) and 'value'
+        :type req: dict
+        :return: JSON friendly result
+        :raises DaemonError: for unknown command or port
+        """
+        cmd = req.get('cmd')
+        if 'ports' == cmd:
+            return sorted(self.ports)
+        p = self.ports.get(req.get('port'))
+        if p is None:
+            raise DaemonError('Unknown port %s' % req.get('port'))
+        if 'warmup' == cmd:
+            return p.warmup
+        id = bytes.fromhex(req.get('id') or 'ffff')
+        value = req.get('value')
+        if 'dust' == cmd:
+            pm = p.dust(id, self.max_age)
+            return measurement_dict(pm) if pm is not None else None
+        with p.lock:
+            if 'mode' == cmd:
+                if value is None:
+                    return p.sd.cmd_get_mode(id=id)
+                return p.sd.cmd_set_mode(int(value), id=id)
+            if 'sleep' == cmd:
+                if value is None:
+                    return p.sd.cmd_get_sleep(id=id)
+                return p.sd.cmd_set_sleep(int(value), id=id)
+            if 'fw_version' == cmd:
+                fw = p.sd.cmd_firmware_ver(id=id)
+                if fw is not None:
+                    fw = dict(fw, id=fw['id'].hex())
+                return fw
+            if 'id' == cmd:
+                if value is None:
+                    fw = p.sd.cmd_firmware_ver(id=id)
+                    return fw['id'].hex() if fw is not None else None
+                new_id = bytes.fromhex(value)
+                res = p.sd.cmd_set_id(id=id, new_id=new_id)
+                if res and id in p.ids:
+                    p.ids[p.ids.index(id)] = new_id
+                    p.readings.pop(id, None)
+                return res
+        raise DaemonError('Unknown command %s' % cmd)
+
+
+class DaemonClient(object):
+    """Send requests to a running daemon
+    """
+
+    def __init__(self, path=None, timeout=CLIENT_TIMEOUT):
+        """Constructor
+
+        :param path: Unix socket, defaults to None that is default_socket()
+        :type path: str, optional
+        :param timeout: max time in sec to wait for a reply, defaults to CLIENT_TIMEOUT
+        :type timeout: float, optional
+        """
+        self.path = path or default_socket()
+        self.timeout = timeout
+        # warm up time in sec of the sensors, by port
+        self.warmups = dict()
+
+    @staticmethod
+    def running(path=None):
+        """
+        :return: True if a daemon is listening on path
+        :rtype: bool
+        """
+        path = path or default_socket()
+        if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+            return False
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.settimeout(1.0)
+                s.connect(path)
+            return True
+        except OSError:
+            return False
+
+    def warmup(self, port):
+        """
+        :return: max time in sec the daemon warms up a sensor of port, before reading it
+        :rtype: float
+        """
+        if port not in self.warmups:
+            try:
+                self.warmups[port] = self.request('warmup', port=port) or 0.0
+            except DaemonError:
+                # daemon that does not tell it
+                self.warmups[port] = 0.0
+        return self.warmups[port]
+
+    def request(self, cmd, port=None, id=None, value=None):
+        """Send a request and wait the reply. A dust request waits also the sensor warm up,
+        as the daemon wakes up a sleeping sensor.
+
+        :param cmd: 'ports', 'warmup', 'dust', 'mode', 'sleep', 'fw_version' or 'id'
+        :type cmd: str
+        :param port: serial port of the sensor, defaults to None
+        :type port: str, optional
+        :param id: sensor id, defaults to None that is FF FF
+        :type id: 2 bytes, optional
+        :param value: value to set, defaults to None that is 'get'
+        :type value: int or str, optional
+        :return: result of the command, as returned by the driver
+        :raises DaemonError: if the daemon cannot execute the request
+        """
+        timeout = self.timeout
+        if 'dust' == cmd:
+            timeout += self.warmup(port)
+        req = {'cmd': cmd, 'port': port, 'id': id.hex() if id else None, 'value': value}
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            s.connect(self.path)
+            with s.makefile('rwb') as f:
+                f.write(json.dumps(req).encode('utf-8') + b'\n')
+                f.flush()
+                line = f.readline()
+        if not line:
+            raise DaemonError('No reply from daemon')
+        res = json.loads(line.decode('utf-8'))
+        if 'error' in res:
+            raise DaemonError(res['error'])
+        return res['result']
@@ -4,36 +4,611 @@
 Module that implements low level communication with Nove SDS011 sensor.
 """
 
+import collections
+import collections.abc
+import logging
 import struct
+import time
 
 DEBUG = 1
 CMD_MODE = 2
 CMD_QUERY_DATA = 4
 CMD_DEVICE_ID = 5
 CMD_SLEEP = 6
+CMD_FIRMWARE = 7
 CMD_WORKING_PERIOD = 8
 MODE_ACTIVE = 0
+# sensor->PC commandID
+RSP_DATA = 0xc0
+RSP_CMD = 0xc5
+
+# destination of the commands to all the sensors
+BROADCAST_ID = b'\xff\xff'
+
+# all sensor->PC responses are 10bytes long
+#   [1:HEAD] | [1:commandID] | [6:data] | [1:CHECKSUM] | [1:TAIL]
+FRAME_HEAD = b'\xaa'
+FRAME_TAIL = 0xab
+FRAME_LEN = 10
+
+
+# max number of packets kept by get_command
+COMMAND_CACHE_SIZE = 1024
+_command_cache = {}
+
+
+def build_command(cmd, data=(), dest=b'\xff\xff'):
+    """
+    Assemble packet to write to sensor. This function add
+      - HEAD 1byte at the beginning
+      - CHECKSUM + TAIL at the end
+    :param cmd: Command ID
+    :type cmd: int
+    :param data: data to sent composed by DATA + DESTINATION 2bytes, defaults to ()
+    :type data: list, optional
+    :param dest: 2 bytes sensor id, defaults to FF FF
+    :type dest: 2 bytes
+    :return: bytes array ready to be sent to the sensor
+    :rtype: bytes
+    """
+    # all commands are 19bytes long
+    #   [1:HEAD] | [1:commandID] | [cmd] | [data] | [2:DESTINATION] | [1:CHECKSUM] | [1:TAIL]
+    # this function is in charge of 6 bytes
+    # user needs to provide 13bytes = 1byte for cmd + some (max12) bytes for data
+    assert len(data) <= 12
+    # calculate the checksum: TODO has the dest to be included?
+    checksum = (sum(data)+sum(struct.unpack('<BB', dest))+cmd) % 256
+    # head:AA  CommandID:B4 --> are common to all PC->Sensor commands
+    # not provided data are filled with zero
+    return b'\xaa\xb4' + bytes([cmd]) + bytes(data) + bytes(12-len(data)) + bytes(dest) + bytes([checksum, 0xab])
+
+
+def get_command(cmd, data=(), dest=b'\xff\xff'):
+    """Same as build_command, but packets are built only once and then
+    got from a cache indexed by (cmd, data, dest).
+
+    Cache stops growing at COMMAND_CACHE_SIZE packets,
+    other packets are built each time.
+
+    :return: bytes array ready to be sent to the sensor
+    :rtype: bytes
+    """
+    key = (cmd, tuple(data), bytes(dest))
+    ret = _command_cache.get(key)
+    if ret is None:
+        ret = build_command(cmd, data, dest)
+        if len(_command_cache) < COMMAND_CACHE_SIZE:
+            _command_cache[key] = ret
+    return ret
+
+
+def response_checksum(data):
+    """Checksum of a sensor->PC frame, calculated on the 6 data bytes
+
+    :param data: 10 bytes frame
+    :type data: bytes
+    :return: checksum
+    :rtype: int
+    """
+    return sum(v for v in data[2:8]) % 256
+
+
+def process_version(d, log):
+    """Get bytes and validate them and eventually return a version dictionary
+
+    :param d: input raw bytes from the sensor
+    :type d: bytes
+    :param log: logging, configured, instance
+    :type log: logging
+    :return: version dictionary or None if error
+    :rtype: dict
+    """
+    if d is None:
+        log.error("Empty data for version")
+        return
+    # Expected response is like
+    # |  AA  |  C5  |   7   | YEAR | MONTH | DAY | DevID1 | DevID2 | CHECKSUM |  AB  |
+    #  head   cmdID  cmdVER |       ------response------           |          | TAIL |
+    # < : little endian
+    # B : unsigned char
+    # H : unsigned short
+    r = struct.unpack('<BBBBBBB', d[3:])
+    log.debug(r)
+    checksum = response_checksum(d)
+    if checksum != r[5]:
+        log.error('Checksum error')
+        return None
+    if r[6] != 0xab:
+        log.error('Tail error')
+        return None
+    res = dict()
+    res['year'] = r[0]
+    res['month'] = r[1]
+    res['day'] = r[2]
+    # how many square brakets on the right side
+    # of the next line :-)
+    # r[3] is an integer and bytes accept both
+    #  bytest(int) and bytes([])
+    # but bytes(int) means gimme an int long bytes array
+    # and bytes([]) means tlaslate int array to bytes array
+    # so bytes([r[3]]) means : gimmi a byte array with one element of value r[3]
+    res['id'] = bytes([r[3], r[4]])
+    res['pretty'] = "Y: {}, M: {}, D: {}, ID: {}".format(r[0], r[1], r[2], ''.join('%02x' % i for i in res['id']))
+
+    return res
+
+
+class Measurement(collections.abc.Mapping):
+    """One dust reading: immutable, slotted, record.
+
+    For compatibility with the dictionary returned in the past it is also
+    a read only mapping with keys 'pm25', 'pm10' and 'pretty'::
+
+        pm = sd.cmd_query_data()
+        pm.pm25 == pm['pm25']
+        json.dumps(pm._asdict())
+
+    Unlike the old dictionary it is not serialised by json.dumps as it is: use _asdict().
+    Two readings are equal if all their fields are, sensor id and timestamp included.
+    The 'pretty' text is only formatted when asked.
+    """
+    __slots__ = ('pm25', 'pm10', 'id', 'timestamp')
+    KEYS = ('pm25', 'pm10', 'pretty')
+
+    def __init__(self, pm25, pm10, id=None, timestamp=None):
+        """Constructor
+
+        :param pm25: PM 2.5 in μg/m^3
+        :type pm25: float
+        :param pm10: PM 10 in μg/m^3
+        :type pm10: float
+        :param id: id of the sensor that took the reading, defaults to None
+        :type id: 2 bytes, optional
+        :param timestamp: time of the reading as returned by time.time(), defaults to None
+        :type timestamp: float, optional
+        """
+        object.__setattr__(self, 'pm25', pm25)
+        object.__setattr__(self, 'pm10', pm10)
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'timestamp', timestamp)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Measurement is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Measurement is immutable')
+
+    @property
+    def pretty(self):
+        return "PM 2.5: {} μg/m^3  PM 10: {} μg/m^3".format(self.pm25, self.pm10)
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __fields(self):
+        return (self.pm25, self.pm10, self.id, self.timestamp)
+
+    def __eq__(self, other):
+        if isinstance(other, Measurement):
+            return self.__fields() == other.__fields()
+        # a plain mapping, like the old dictionary, has only the keys
+        return collections.abc.Mapping.__eq__(self, other)
+
+    def __hash__(self):
+        return hash(self.__fields())
+
+    def _asdict(self):
+        """
+        :return: JSON friendly dictionary with keys 'pm25', 'pm10' and 'pretty', as the old dust data
+        :rtype: dict
+        """
+        return dict(self)
+
+    def __repr__(self):
+        return 'Measurement(pm25={!r}, pm10={!r}, id={!r}, timestamp={!r})'.format(
+            self.pm25, self.pm10, self.id, self.timestamp)
+
+    def __reduce__(self):
+        return (Measurement, (self.pm25, self.pm10, self.id, self.timestamp))
+
+
+def process_data(d, log):
+    """Get bytes and validate them and eventually return a Measurement
+
+    :param d: input raw bytes from the sensor
+    :type d: bytes
+    :param log: logging, configured, instance
+    :type log: logging
+    :return: dust data or None if error
+    :rtype: Measurement
+    """
+    if d[1] != RSP_DATA:
+        log.error("Not executed as d[1]="+hex(d[1]))
+        return None
+    checksum = response_checksum(d)
+
+    r = struct.unpack('<HHxxBB', d[2:])
+    if checksum != r[2]:
+        log.error("Checksum error")
+        return None
+
+    if r[3] != 0xab:
+        log.error("Wrong tail")
+        return None
+    return Measurement(r[0]/10.0, r[1]/10.0, bytes(d[6:8]), time.time())
+
+
+def frame_match(frame, cmd=None, sub=None, id=None, op=None):
+    """Check if a sensor->PC frame is the expected one
+
+    :param frame: 10 bytes frame
+    :type frame: bytes
+    :param cmd: expected sensor->PC commandID, defaults to None that is 'any'
+    :type cmd: int, optional
+    :param sub: expected PC->Sensor command the frame is reply to, defaults to None that is 'any'
+    :type sub: int, optional
+    :param id: expected sensor id, defaults to None and FF FF that are 'any'
+    :type id: 2 bytes, optional
+    :param op: expected 0:query or 1:set of a mode, sleep or working period reply, defaults to None that is 'any'
+    :type op: int, optional
+    :rtype: bool
+    """
+    # |  AA  | C0 or C5 | DATA1 (C5: command) | DATA2 (C5: query/set) | ... | DevID1 | DevID2 | CHECKSUM |  AB  |
+    return ((cmd is None or frame[1] == cmd) and
+            (sub is None or frame[2] == sub) and
+            (op is None or frame[3] == op) and
+            (id is None or id == b'\xff\xff' or frame[6:8] == id))
+
+
+def frame_fault(frame):
+    """Check if 10 bytes starting with HEAD are a valid sensor->PC frame
+
+    :param frame: 10 bytes frame
+    :type frame: bytes
+    :return: None if valid, otherwise 'head' (unknown commandID), 'checksum' or 'tail'
+    :rtype: str
+    """
+    if frame[1] != RSP_DATA and frame[1] != RSP_CMD:
+        return 'head'
+    if sum(frame[2:8]) % 256 != frame[8]:
+        return 'checksum'
+    if FRAME_TAIL != frame[9]:
+        return 'tail'
+    return None
+
+
+def reply_to(cmd=None, sub=None):
+    """Get the PC->Sensor command a requested frame is reply to, used as metrics key
+
+    :param cmd: expected sensor->PC commandID, defaults to None that is 'any'
+    :type cmd: int, optional
+    :param sub: expected PC->Sensor command, defaults to None that is 'any'
+    :type sub: int, optional
+    :return: command, CMD_QUERY_DATA for data frames (also the ones pushed in active mode),
+             None if not known
+    :rtype: int
+    """
+    if sub is not None:
+        return sub
+    return CMD_QUERY_DATA if RSP_DATA == cmd else None
+
+
+class FrameReader(object):
+    """Buffered reader that extracts response frames from the serial stream
+
+    Instead of looking for the HEAD one byte at a time, it reads in a single call
+    all the bytes needed to complete a frame (or all the ones already waiting in the
+    serial input buffer, if more), then looks for the HEAD in the local buffer.
+    Bytes received after a complete frame are kept for the next call.
+
+    A HEAD is accepted only if commandID, checksum and TAIL of the 10 bytes starting
+    with it are valid: otherwise it was a noise or data byte, or the frame is corrupted,
+    and only the HEAD is dropped, so that a frame starting in the following bytes is recovered.
+    """
+
+    def __init__(self, ser, log, max_skip=20, timeout=5.0, max_pending=0, resync_wait=0.1):
+        """Constructor
+
+        :param ser: serial, configured, instance
+        :type ser: pyserial
+        :param log: logging, configured, instance
+        :type log: logging
+        :param max_skip: max number of not HEAD bytes to discard before giving up, defaults to 20
+        :type max_skip: int, optional
+        :param timeout: serial timeout in sec applied while reading a frame, defaults to 5.0
+        :type timeout: float, optional
+        :param max_pending: max number of valid frames, not matching the requested one, kept for
+                            later calls, defaults to 0 that is 'discard them'
+        :type max_pending: int, optional
+        :param resync_wait: time in sec to wait for a frame behind a corrupted one, when no other byte
+                            has been received, defaults to 0.1 that is some frame times at 9600 baud
+        :type resync_wait: float, optional
+        """
+        self.ser = ser
+        self.log = log
+        self.max_skip = max_skip
+        self.timeout = timeout
+        self.resync_wait = resync_wait
+        self.buffer = bytearray()
+        self.pending = collections.deque(maxlen=max_pending)
+        self.skipped = 0
+        # HEAD bytes dropped because not starting a valid frame
+        self.corrupted = 0
+        # function called with each chunk of received bytes, see pysds011.capture
+        self.capture = None
+        # failures counter, see pysds011.metrics.DriverMetrics
+        self.metrics = None
+
+    def reset(self):
+        """Drop all the buffered bytes and frames
+        """
+        del self.buffer[:]
+        self.pending.clear()
+
+    def count(self, kind, cmd=None, sub=None, id=None, n=1):
+        """Report a failure to metrics, if any
+
+        :param kind: 'skipped' (bytes before a HEAD), 'checksum', 'tail', 'timeout' or 'resync'
+                     (no HEAD within max_skip bytes)
+        :type kind: str
+        """
+        if self.metrics is not None:
+            self.metrics.count(kind, reply_to(cmd, sub), id, n)
+
+    def drop_pending(self, id=None):
+        """Drop the frames kept for later calls that come from a sensor,
+        because a new request has been sent to it: they would be taken as its reply
+
+        :param id: sensor id, defaults to None and FF FF that are 'all the sensors'
+        :type id: 2 bytes, optional
+        """
+        if not self.pending:
+            return
+        if id is None or id == b'\xff\xff':
+            self.pending.clear()
+            return
+        kept = [frame for frame in self.pending if frame[6:8] != id]
+        self.pending.clear()
+        self.pending.extend(kept)
+
+    def feed(self, data):
+        """Append bytes, received from the sensor, to the buffer
+
+        :param data: received bytes
+        :type data: bytes
+        """
+        if self.capture is not None:
+            self.capture(data)
+        self.buffer += data
+
+    def pop_frame(self, cmd=None, sub=None, id=None, op=None):
+        """Look for a complete and valid frame in the buffered bytes, no serial access.
+        Discarded bytes are accumulated in the skipped attribute,
+        HEAD bytes not starting a valid frame also in the corrupted one.
+
+        :param cmd: expected sensor->PC commandID, defaults to None that is 'any'
+        :type cmd: int, optional
+        :param sub: expected PC->Sensor command the frame is reply to, defaults to None that is 'any'
+        :type sub: int, optional
+        :param id: expected sensor id, defaults to None that is 'any'
+        :type id: 2 bytes, optional
+        :param op: expected 0:query or 1:set, see frame_match, defaults to None that is 'any'
+        :type op: int, optional
+        :return: 10 bytes frame, commandID, checksum and TAIL verified
+        :rtype: bytes or None if more bytes are needed
+        """
+        for frame in self.pending:
+            if frame_match(frame, cmd, sub, id, op):
+                self.pending.remove(frame)
+                return frame
+        while True:
+            # align the buffer to the response beginning
+            head = self.buffer.find(FRAME_HEAD)
+            if head < 0:
+                head = len(self.buffer)
+            if head:
+                self.skipped += head
+                self.count('skipped', cmd, sub, id, head)
+                del self.buffer[:head]
+            if len(self.buffer) < FRAME_LEN:
+                return None
+            frame = bytes(self.buffer[:FRAME_LEN])
+            fault = frame_fault(frame)
+            if fault is not None:
+                # slide by one byte: a real frame could start right after this HEAD
+                if 'checksum' == fault:
+                    self.log.error('Wrong rep checksum: expected %d and get %d', sum(frame[2:8]) % 256, frame[8])
+                elif 'tail' == fault:
+                    self.log.error('Wrong TAIL %d', frame[9])
+                if 'head' != fault:
+                    self.count(fault, cmd, sub, id)
+                self.count('skipped', cmd, sub, id)
+                self.skipped += 1
+                self.corrupted += 1
+                del self.buffer[:1]
+                continue
+            del self.buffer[:FRAME_LEN]
+            if frame_match(frame, cmd, sub, id, op):
+                return frame
+            # in active mode the sensor could push data just before the reply
+            # that we are waiting for, on a bus other sensors could reply too
+            if len(self.pending) < self.pending.maxlen:
+                if self.log.isEnabledFor(logging.DEBUG):
+                    self.log.debug('Keep frame %s', frame.hex())
+            else:
+                if self.log.isEnabledFor(logging.DEBUG):
+                    self.log.debug('Discard frame %s', frame.hex())
+                self.skipped += FRAME_LEN
+            self.pending.append(frame)
+
+    def log_frame(self, frame):
+        """Dump a frame got from pop_frame on the debug log channel
+        """
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug('< ' + frame.hex())
+
+    def __fill(self):
+        """Read from serial all the bytes needed to complete a frame
+        or all the ones already available, if more
+
+        :return: number of read bytes, 0 in case of timeout
+        :rtype: int
+        """
+        size = max(FRAME_LEN - len(self.buffer), getattr(self.ser, 'in_waiting', 0))
+        data = self.ser.read(size=size)
+        if not data:
+            return 0
+        self.feed(data)
+        return len(data)
+
+    def read_frame(self, cmd=None, sub=None, id=None, op=None):
+        """Get the next response frame with a valid checksum.
+        Frames not matching the requested one are discarded, or kept for later calls if max_pending allows it.
+
+        :param cmd: expected sensor->PC commandID, defaults to None that is 'any'
+        :type cmd: int, optional
+        :param sub: expected PC->Sensor command the frame is reply to, defaults to None that is 'any'
+        :type sub: int, optional
+        :param id: expected sensor id, defaults to None that is 'any'
+        :type id: 2 bytes, optional
+        :param op: expected 0:query or 1:set, see frame_match, defaults to None that is 'any'
+        :type op: int, optional
+        :return: 10 bytes frame, HEAD and TAIL included
+        :rtype: bytes or None in case of error
+        """
+        self.skipped = 0
+        self.corrupted = 0
+        orig_timeout = self.ser.timeout
+        self.ser.timeout = self.timeout
+        try:
+            frame = self.pop_frame(cmd, sub, id, op)
+            while frame is None:
+                if self.skipped >= self.max_skip:
+                    self.log.error('Not get HEAD after %d read bytes', self.skipped)
+                    self.count('resync', cmd, sub, id)
+                    return None
+                if self.corrupted and not self.buffer:
+                    # corrupted reply: wait for a frame behind it, but not for the whole timeout
+                    self.ser.timeout = min(self.resync_wait, self.timeout)
+                    received = self.__fill()
+                    self.ser.timeout = self.timeout
+                    if not received:
+                        self.log.debug('No bytes after a corrupted frame')
+                        return None
+                elif not self.__fill():
+                    self.log_timeout()
+                    self.count('timeout', cmd, sub, id)
+                    return None
+                frame = self.pop_frame(cmd, sub, id, op)
+        finally:
+            # restore timeout of original
+            # serial instance injected in constructor
+            self.ser.timeout = orig_timeout
+        self.log_frame(frame)
+        return frame
+
+    def log_timeout(self):
+        """Report a frame read interrupted by timeout
+        """
+        if self.buffer:
+            self.log.error('Timeout reading body')
+        else:
+            self.log.debug('No bytes within %.1fsec', self.timeout)
 
 
 class SDS011(object):
     """Main driver class
     """
 
-    def __init__(self, ser, log):
+    def __init__(self, ser, log, cache=False, capture=None, metrics=None):
         """Constructor that just record serial and logging reference
 
         :param ser: serial, configured, instance
         :type ser: pyserial
         :param log: logging, configured, instance
         :type log: logging
+        :param cache: keep the known state of each sensor and skip commands that
+                      would not change it. Enable it only if this driver is the only one
+                      sending commands to the sensors: a state changed by someone else,
+                      or by a power cycle, is not seen. Defaults to False
+        :type cache: bool, optional
+        :param capture: function called with each chunk of received bytes, noise and corrupted
+                        frames included, like CaptureWriter.hook, defaults to None
+        :type capture: callable, optional
+        :param metrics: requests, latencies and failures recorder, like pysds011.metrics.DriverMetrics,
+                        defaults to None
+        :type metrics: DriverMetrics, optional
         """
         self.log = log
         self.ser = ser
+        self.reader = FrameReader(ser, log)
+        self.reader.capture = capture
+        self.reader.metrics = metrics
+        self.metrics = metrics
+        # command, sensor id and time of the last request, while waiting for its reply
+        self.sent = None
+        self.cache = cache
+        # known state by sensor id, with keys 'sleep', 'mode', 'period' and 'firmware'
+        self.state = dict()
 
     @property
     def MODE_QUERY(self):
         return 1
 
+    def invalidate(self, id=None):
+        """Forget the known state of a sensor, for example because
+        it has been power cycled or configured by someone else
+
+        :param id: sensor id, defaults to None that is 'all the sensors'
+        :type id: 2 bytes, optional
+        """
+        if id is None:
+            self.state.clear()
+        else:
+            self.state.pop(bytes(id), None)
+
+    def __known(self, id, key, value):
+        """Check if a sensor is already known to be in the requested state
+
+        :return: True if the command can be skipped
+        :rtype: bool
+        """
+        state = self.state.get(bytes(id), {})
+        if not self.cache or state.get(key) != value:
+            return False
+        if 'sleep' == key and state.get('period'):
+            # the sensor sleeps and wakes up on its own
+            return False
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug('%s already %s:%s', id.hex(), key, value)
+        return True
+
+    def __learn(self, id, key, value):
+        """Record a sensor state got from a response
+        """
+        if self.cache:
+            self.state.setdefault(bytes(id), dict())[key] = value
+
+    def __forget(self, id, key):
+        """Forget a state changed by a command: a broadcast command changes it for
+        all the sensors, a command to a single sensor makes the broadcast one unknown
+        """
+        id = bytes(id)
+        if BROADCAST_ID == id:
+            for state in self.state.values():
+                state.pop(key, None)
+        else:
+            for i in (id, BROADCAST_ID):
+                self.state.get(i, {}).pop(key, None)
+
     def __dump(self, d, prefix=''):
         """Dump bytes as string on the debug log channel
 
@@ -42,153 +617,71 @@ class SDS011(object):
         :param prefix: string to prepend, defaults to ''
         :type prefix: str, optional
         """
-        if d:
+        if d and self.log.isEnabledFor(logging.DEBUG):
             self.log.debug(prefix + d.hex())
 
-    def __construct_command(self, cmd, data=[], dest=b'\xff\xff'):
+    def __construct_command(self, cmd, data=(), dest=b'\xff\xff', reply_id=None, reply=True):
         """
-        Assemble packet to write to sensor. This function add
-          - HEAD 1byte at the beginning
-          - CHECKSUM + TAIL at the end
+        Get packet to write to sensor, see build_command.
+        Packets are built once and then reused from a module level cache.
+        Frames kept from dest are dropped, and the request is recorded by metrics, if any.
+
         :param cmd: Command ID
         :type cmd: int
-        :param data: data to sent composed by DATA + DESTINATION 2bytes, defaults to []
+        :param data: data to sent composed by DATA + DESTINATION 2bytes, defaults to ()
         :type data: list, optional
         :param dest: 2 bytes sensor id, defaults to FF FF
         :type dest: 2 bytes
+        :param reply_id: id of the sensor expected to reply, request and reply are recorded under it,
+                         defaults to None that is dest
+        :type reply_id: 2 bytes, optional
+        :param reply: False if the reply is not read, so the request is not recorded, defaults to True
+        :type reply: bool, optional
         :return: bytes array ready to be sent to the sensor
         :rtype: bytes
         """
-        # all commands are 19bytes long
-        #   [1:HEAD] | [1:commandID] | [cmd] | [data] | [2:DESTINATION] | [1:CHECKSUM] | [1:TAIL]
-        # this method is in charge of 6 bytes
-        # user needs to provide 13bytes = 1byte for cmd + some (max12) bytes for data
-        assert len(data) <= 12
-        self.log.debug("data:" + str(data) + " dest:" + str(dest))
-        # feel not provided data with zero
-        data += [0, ]*(12-len(data))
-        self.log.debug("Resized data:" + str(data))
-        # calculate the checksum: TODO has the dest to be included?
-        checksum = (sum(data)+sum(struct.unpack('<BB', dest))+cmd) % 256
-        # head:AA  CommandID:B4 --> are common to all PC->Sensor commands
-        ret = bytes().fromhex("aab4")  # head
-        ret += bytes([cmd])
-        ret += bytes(data)
-        ret += dest
-        ret += bytes([checksum])
-        ret += bytes().fromhex("ab")  # tail
+        ret = get_command(cmd, data, dest)
         self.__dump(ret, '> ')
+        self.reader.drop_pending(dest)
+        if self.metrics is not None and reply:
+            reply_id = dest if reply_id is None else reply_id
+            self.metrics.request(cmd, reply_id)
+            self.sent = (cmd, reply_id, time.perf_counter())
         return ret
 
-    def __read_response(self):
+    def __read_response(self, cmd=None, sub=None, id=None, op=None):
         """Read data from the sensor
 
+        :param cmd: expected sensor->PC commandID, defaults to None that is 'any'
+        :type cmd: int, optional
+        :param sub: expected PC->Sensor command the frame is reply to, defaults to None that is 'any'
+        :type sub: int, optional
+        :param id: expected sensor id, defaults to None that is 'any'
+        :type id: 2 bytes, optional
+        :param op: expected 0:query or 1:set, see frame_match, defaults to None that is 'any'
+        :type op: int, optional
         :return: read bytes
         :rtype: bytes or None in case of error
         """
-        # initialize it to something not like 0xAA
-        # as 0xAA is the response beginning that we are looking for.
-        # None is not a good value for this dummy initialization as
-        # None is the value returned in case of timeout
-        byte = b'\xff'
-        orig_timeout = self.ser.timeout
-        self.ser.timeout = 5.0
-        max_driver_reply_len = 20
-
-        # this loop is to aligne to byte
-        # that correspond to response beginning
-        while byte is not None and byte != b'\xaa' and 0 != len(byte) and max_driver_reply_len > 0:
-            max_driver_reply_len -= 1
-            byte = self.ser.read(size=1)
-            if byte is not None:
-                self.log.debug('<first byte:%s:%s:%d', str(byte), str(type(byte)), len(byte))
-        # restore timeout of original
-        # serial instance injected in constructor
-        self.ser.timeout = orig_timeout
-        if max_driver_reply_len == 0:
-            self.log.error('Not get HEAD after 20 read bytes')
-            return None
-        if byte is None or 0 == len(byte):
-            self.log.debug('No bytes within 5sec')
-            return None
-        d = self.ser.read(size=9)
-        if d is None:
-            self.log.error('Timeout reading body')
-            return None
-
-        checksum = sum(v for v in d[1:-2]) % 256
-        if checksum != d[-2]:
-            self.log.error('Wrong rep checksum: expected ' + str(checksum) + ' and get ' + str(d[-2]))
-            return None
-        # if b'\xab' != d[-1]: # commented as it always result True
-        #    self.log.error('Wrong TAIL ' + str(d[-1]))
-        #    return None
-        self.__dump(d, '< ')
-        return byte + d
-
-    def __response_checksum(self, data):
-        return sum(v for v in data[2:8]) % 256
+        if self.metrics is None:
+            return self.reader.read_frame(cmd, sub, id, op)
+        frame = self.reader.read_frame(cmd, sub, id, op)
+        if self.sent is not None and self.sent[0] == reply_to(cmd, sub):
+            self.metrics.reply(self.sent[0], self.sent[1], time.perf_counter() - self.sent[2], frame is not None)
+            self.sent = None
+        return frame
 
     def __process_version(self, d):
-        """Get bytes and validate them and eventually return a version dictionary
-
-        :param d: input raw bytes from the sensor
-        :type d: bytes
-        :return: version dictionary or None if error
-        :rtype: dict
+        """Get bytes and validate them and eventually return a version dictionary,
+        see process_version
         """
-        if d is None:
-            self.log.error("Empty data for version")
-            return
-        # Expected response is like
-        # |  AA  |  C5  |   7   | YEAR | MONTH | DAY | DevID1 | DevID2 | CHECKSUM |  AB  |
-        #  head   cmdID  cmdVER |       ------response------           |          | TAIL |
-        # < : little endian
-        # B : unsigned char
-        # H : unsigned short
-        r = struct.unpack('<BBBBBBB', d[3:])
-        self.log.debug(r)
-        checksum = self.__response_checksum(d)
-        if checksum != r[5]:
-            self.log.error('Checksum error')
-            return None
-        if r[6] != 0xab:
-            self.log.error('Tail error')
-            return None
-        res = dict()
-        res['year'] = r[0]
-        res['month'] = r[1]
-        res['day'] = r[2]
-        # how many square brakets on the right side
-        # of the next line :-)
-        # r[3] is an integer and bytes accept both
-        #  bytest(int) and bytes([])
-        # but bytes(int) means gimme an int long bytes array
-        # and bytes([]) means tlaslate int array to bytes array
-        # so bytes([r[3]]) means : gimmi a byte array with one element of value r[3]
-        res['id'] = bytes([r[3], r[4]])
-        res['pretty'] = "Y: {}, M: {}, D: {}, ID: {}".format(r[0], r[1], r[2], ''.join('%02x' % i for i in res['id']))
-
-        return res
+        return process_version(d, self.log)
 
     def __process_data(self, d):
-        if d[1] != int(b'0xc0', 16):
-            self.log.error("Not executed as d[1]="+hex(d[1]))
-            return None
-        checksum = self.__response_checksum(d)
-
-        r = struct.unpack('<HHxxBB', d[2:])
-        if checksum != r[2]:
-            self.log.error("Checksum error")
-            return None
-
-        if r[3] != 0xab:
-            self.log.error("Wrong tail")
-            return None
-        pm25 = r[0]/10.0
-        pm10 = r[1]/10.0
-        res_str = "PM 2.5: {} μg/m^3  PM 10: {} μg/m^3".format(pm25, pm10)
-        return {'pm25': pm25, 'pm10': pm10, 'pretty': res_str}
+        """Get bytes and validate them and eventually return a Measurement,
+        see process_data
+        """
+        return process_data(d, self.log)
 
     def cmd_get_sleep(self,  id=b'\xff\xff'):
         """Get active sleep mode
@@ -204,13 +697,16 @@ class SDS011(object):
         :rtype: bool
         """
         self.ser.write(self.__construct_command(CMD_SLEEP, [0x0, 0x0], id))
-        resp = self.__read_response()
+        resp = self.__read_response(RSP_CMD, CMD_SLEEP, id, op=0)
         if resp is None:
             self.log.error("No sensor response")
+            self.invalidate(id)
             return None
         if 0 != resp[4] and 1 != resp[4]:
             self.log.error("No valid sensor response %d", resp[4])
+            self.invalidate(id)
             return None
+        self.__learn(id, 'sleep', 0 == resp[4])
         return 0 == resp[4]
 
     def cmd_set_sleep(self, sleep=1, id=b'\xff\xff'):
@@ -224,12 +720,19 @@ class SDS011(object):
         :rtype: bool
         """
         assert id is not None
-        self.log.debug('is:%s', str(id))
+        self.log.debug('is:%s', id)
+        if self.__known(id, 'sleep', bool(sleep)):
+            return True
         mode = 0 if sleep else 1
         self.log.debug('driver mode:%d', mode)
         self.ser.write(self.__construct_command(CMD_SLEEP, [0x1, mode], id))
-        resp = self.__read_response()
-        return resp is not None
+        resp = self.__read_response(RSP_CMD, CMD_SLEEP, id, op=1)
+        self.__forget(id, 'sleep')
+        if resp is None:
+            self.invalidate(id)
+            return False
+        self.__learn(id, 'sleep', bool(sleep))
+        return True
 
     def cmd_get_mode(self, id=b'\xff\xff'):
         """Get active reporting mode
@@ -241,10 +744,12 @@ class SDS011(object):
         """
         assert id is not None
         self.ser.write(self.__construct_command(CMD_MODE, [0x0, 0x0], id))
-        resp = self.__read_response()
+        resp = self.__read_response(RSP_CMD, CMD_MODE, id, op=0)
         if resp is None:
             self.log.error("No valid sensor response")
+            self.invalidate(id)
             return None
+        self.__learn(id, 'mode', resp[4])
         return resp[4]
 
     def cmd_set_mode(self, mode=1, id=b'\xff\xff'):
@@ -259,14 +764,20 @@ class SDS011(object):
         """
         assert id is not None
         self.log.debug('mode:%d', mode)
+        if self.__known(id, 'mode', mode):
+            return True
         self.ser.write(self.__construct_command(CMD_MODE, [0x1, mode], id))
-        resp = self.__read_response()
+        resp = self.__read_response(RSP_CMD, CMD_MODE, id, op=1)
+        self.__forget(id, 'mode')
         if resp is None:
             self.log.error("No valid sensor response")
+            self.invalidate(id)
             return False
         if mode != resp[4]:
             self.log.error("Requested configuration not applied")
+            self.invalidate(id)
             return False
+        self.__learn(id, 'mode', mode)
         return True
 
     def cmd_firmware_ver(self, id=b'\xff\xff'):
@@ -277,30 +788,79 @@ class SDS011(object):
         :rtype: dict
         """
         assert id is not None
-        # 7: CMD_FIRMWARE: not needs any PC->Sensor data
-        self.ser.write(self.__construct_command(7, dest=id))
-        d = self.__read_response()
-        self.log.debug('fw ver byte:%s', str(d))
-        return self.__process_version(d)
+        if self.cache and 'firmware' in self.state.get(bytes(id), {}):
+            return dict(self.state[bytes(id)]['firmware'])
+        # CMD_FIRMWARE: not needs any PC->Sensor data
+        self.ser.write(self.__construct_command(CMD_FIRMWARE, dest=id))
+        d = self.__read_response(RSP_CMD, CMD_FIRMWARE, id)
+        self.log.debug('fw ver byte:%s', d)
+        res = self.__process_version(d)
+        if res is None:
+            self.invalidate(id)
+        else:
+            self.__learn(id, 'firmware', dict(res))
+        return res
 
     def cmd_query_data(self, id=b'\xff\xff'):
         """Read dust values from the sensor
 
         :param id: Sensor ID, defaults to b'\xff\xff'
         :type id: 2 bytes, optional
-        :return: dust data as dictionary
-        :rtype: dict
+        :return: dust data
+        :rtype: Measurement
         """
         assert id is not None
         self.ser.write(self.__construct_command(CMD_QUERY_DATA, dest=id))
-        d = self.__read_response()
+        d = self.__read_response(RSP_DATA, id=id)
         self.log.debug(d)
         if d is None:
             self.log.error("No data from query")
+            self.invalidate(id)
             return None
-
+        # a sleeping sensor does not reply
+        self.__learn(id, 'sleep', False)
         return self.__process_data(d)
 
+    def wait_warmup(self, max_time=3, tolerance=1.0, stable=2, interval=1.0, id=b'\xff\xff'):
+        """Query the sensor, at its 1Hz update rate, until the readings converge:
+        both PM values of the last stable+1 readings are within tolerance one to the next.
+        Sensor has to be already awake and in query mode.
+
+        :param max_time: max time in sec to wait for convergence, defaults to 3
+        :type max_time: float, optional
+        :param tolerance: max difference in μg/m^3 between successive readings, defaults to 1.0
+        :type tolerance: float, optional
+        :param stable: number of successive differences within tolerance, defaults to 2
+        :type stable: int, optional
+        :param interval: time in sec between queries, defaults to 1.0
+        :type interval: float, optional
+        :param id: Sensor ID, defaults to b'\xff\xff'
+        :type id: 2 bytes, optional
+        :return: last dust data, also if not converged within max_time
+        :rtype: Measurement or None in case of error
+        """
+        deadline = time.monotonic() + max_time
+        last = None
+        converged = 0
+        while True:
+            pm = self.cmd_query_data(id=id)
+            if pm is not None:
+                if last is not None and \
+                   abs(pm['pm25'] - last['pm25']) <= tolerance and \
+                   abs(pm['pm10'] - last['pm10']) <= tolerance:
+                    converged += 1
+                else:
+                    converged = 0
+                last = pm
+                if converged >= stable:
+                    self.log.debug('Warm up converged')
+                    return last
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.log.debug('Warm up not converged within %.1fsec', max_time)
+                return last
+            time.sleep(min(interval, remaining))
+
     def cmd_set_id(self, id, new_id):
         """Set a device ID to a specific sensor
 
@@ -314,8 +874,11 @@ class SDS011(object):
         assert id is not None
         assert new_id is not None
 
-        self.ser.write(self.__construct_command(CMD_DEVICE_ID, [0, ]*10 + [new_id[0], new_id[1]], id))
-        d = self.__read_response()
+        # the reply comes from the new id, as the failures reading it: record the request under it too
+        self.ser.write(self.__construct_command(CMD_DEVICE_ID, [0, ]*10 + [new_id[0], new_id[1]], id, reply_id=new_id))
+        d = self.__read_response(RSP_CMD, CMD_DEVICE_ID, new_id)
+        self.invalidate(id)
+        self.invalidate(new_id)
         if d is None:
             self.log.error("Error in sensor response")
             return False
@@ -338,8 +901,13 @@ class SDS011(object):
         assert id is not None
         if period > 30:
             return False
-        self.ser.write(self.__construct_command(CMD_WORKING_PERIOD, [0x01, period], id))
-
+        if self.__known(id, 'period', period):
+            return True
+        self.ser.write(self.__construct_command(CMD_WORKING_PERIOD, [0x01, period], id, reply=False))
+        # reply is not read, so the new period is not known yet,
+        # and a sensor with a period sleeps on its own
+        self.__forget(id, 'period')
+        self.__forget(id, 'sleep')
         return True
 
     def cmd_get_working_period(self, id=b'\xff\xff'):
@@ -350,9 +918,62 @@ class SDS011(object):
         """
         assert id is not None
         self.ser.write(self.__construct_command(CMD_WORKING_PERIOD, [0x00], id))
-        d = self.__read_response()
+        d = self.__read_response(RSP_CMD, CMD_WORKING_PERIOD, id, op=0)
         if d is None:
             self.log.error("Error in sensor response")
+            self.invalidate(id)
             return None
         self.log.debug(d)
+        self.__learn(id, 'period', d[4])
         return d[4]
+
+    def stream(self, id=b'\xff\xff', count=None, max_errors=3, period=None):
+        """Put the sensor in active mode and yield the measurements it pushes
+
+        No command is sent for each sample: the sensor reports a new measurement
+        every second (or once per working period). The sensor is left in active mode,
+        use cmd_set_mode to go back to query mode.
+
+        :param id: Sensor ID, defaults to b'\xff\xff'
+        :type id: 2 bytes, optional
+        :param count: number of measurements to get, defaults to None that is 'forever'
+        :type count: int, optional
+        :param max_errors: consecutive read errors that stop the stream, defaults to 3
+        :type max_errors: int, optional
+        :param period: working period in minutes of the sensor, a report is waited for up to
+                       period minutes plus the read timeout, defaults to None that is
+                       'the known one, or ask it to the sensor'
+        :type period: int, optional
+        :return: generator of dust data Measurement, same as cmd_query_data
+        :rtype: generator
+        """
+        assert id is not None
+        if period is None:
+            period = self.state.get(bytes(id), {}).get('period')
+        if period is None:
+            period = self.cmd_get_working_period(id=id)
+            if period is None:
+                self.log.warning('Working period not known, reports are expected every second')
+                period = 0
+        if self.cmd_set_mode(MODE_ACTIVE, id=id) is not True:
+            self.log.error('Set MODE_ACTIVE failure')
+            return
+        timeout = self.reader.timeout
+        self.reader.timeout = timeout + 60 * period
+        try:
+            errors = 0
+            while count is None or count > 0:
+                d = self.__read_response(RSP_DATA, id=id)
+                res = self.__process_data(d) if d is not None else None
+                if res is None:
+                    errors += 1
+                    if errors >= max_errors:
+                        self.log.error('Stream stopped after %d errors', errors)
+                        return
+                    continue
+                errors = 0
+                if count is not None:
+                    count -= 1
+                yield res
+        finally:
+            self.reader.timeout = timeout
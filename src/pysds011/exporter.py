@@ -0,0 +1,219 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Module that exports the readings of Nove SDS011 sensors to Prometheus.
+
+Sensors are sampled in background threads, one for each port, by a
+:class:`pysds011.schedule.DutyCycleScheduler`. Each reading updates an in memory cache
+that ``/metrics`` is served from, so that a scrape never touches the serial ports::
+
+    # HELP sds011_pm25_ugm3 PM 2.5 of the last reading in μg/m^3
+    # TYPE sds011_pm25_ugm3 gauge
+    sds011_pm25_ugm3{port="/dev/ttyUSB0",id="abcd"} 6.0
+    ...
+    sds011_sample_age_seconds{port="/dev/ttyUSB0",id="abcd"} 12.4
+"""
+
+import http.server
+import threading
+import time
+
+from pysds011.bus import SDS011Bus
+from pysds011.metrics import DriverMetrics
+from pysds011.schedule import DutyCycleScheduler
+
+DEFAULT_PORT = 9611
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# name, type, help and field of the cache entry
+METRICS = (
+    ('sds011_pm25_ugm3', 'gauge', 'PM 2.5 of the last reading in μg/m^3', 'pm25'),
+    ('sds011_pm10_ugm3', 'gauge', 'PM 10 of the last reading in μg/m^3', 'pm10'),
+    ('sds011_samples_total', 'counter', 'Successful readings', 'samples'),
+    ('sds011_read_errors_total', 'counter', 'Failed readings', 'errors'),
+    ('sds011_checksum_errors_total', 'counter', 'Frames with a wrong checksum', 'checksum'),
+    ('sds011_timeouts_total', 'counter', 'Replies not received within the timeout', 'timeout'),
+)
+AGE = ('sds011_sample_age_seconds', 'gauge', 'Time in sec since the last reading')
+
+
+def _labels(port, id):
+    port = port.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{port="%s",id="%s"}' % (port, id.hex())
+
+
+class MetricsCache(object):
+    """Last reading and counters of each sensor, with the exposition text ready to be served
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # entry by (port, sensor id)
+        self.entries = dict()
+        self.text = b''
+        self.ages = list()
+
+    def register(self, port, id):
+        """Add a sensor not read yet
+        """
+        with self.lock:
+            self.entries.setdefault((port, id), {'pm25': None, 'pm10': None, 'timestamp': None,
+                                                 'samples': 0, 'errors': 0, 'checksum': 0, 'timeout': 0})
+            self.__render()
+
+    def update(self, port, id, pm, failures):
+        """Record a reading
+
+        :param port: port name
+        :type port: str
+        :param id: sensor id
+        :type id: 2 bytes
+        :param pm: dust data, None for a failed reading
+        :type pm: Measurement
+        :param failures: failures reading from the sensor, see DriverMetrics.totals
+        :type failures: dict
+        """
+        self.register(port, id)
+        with self.lock:
+            e = self.entries[port, id]
+            if pm is None:
+                e['errors'] += 1
+            else:
+                e['samples'] += 1
+                e['pm25'], e['pm10'], e['timestamp'] = pm.pm25, pm.pm10, pm.timestamp
+            e['checksum'] = failures['checksum']
+            e['timeout'] = failures['timeout']
+            self.__render()
+
+    def __render(self):
+        """Build the text of all the metrics but the age, lock has to be held
+        """
+        lines = list()
+        for name, kind, doc, field in METRICS:
+            lines.append('# HELP %s %s' % (name, doc))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for (port, id), e in sorted(self.entries.items()):
+                if e[field] is not None:
+                    lines.append('%s%s %s' % (name, _labels(port, id), e[field]))
+        self.text = ('\n'.join(lines) + '\n').encode('utf-8')
+        self.ages = [(_labels(port, id), e['timestamp']) for (port, id), e in sorted(self.entries.items())
+                     if e['timestamp'] is not None]
+
+    def render(self, now=None):
+        """
+        :param now: time as returned by time.time(), defaults to None that is 'now'
+        :type now: float, optional
+        :return: exposition text of all the metrics
+        :rtype: bytes
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            text, ages = self.text, self.ages
+        name, kind, doc = AGE
+        lines = ['# HELP %s %s' % (name, doc), '# TYPE %s %s' % (name, kind)]
+        lines.extend('%s%s %.3f' % (name, labels, now - ts) for labels, ts in ages)
+        return text + ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.exporter.cache.render()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.exporter.log.debug(format, *args)
+
+
+class SDS011Exporter(object):
+    """Sample sensors in background and serve their metrics over HTTP::
+
+        e = SDS011Exporter([(ser, [b'\xff\xff'])], log)
+        e.serve_forever()
+    """
+
+    def __init__(self, ports, log, address=('localhost', DEFAULT_PORT), interval=60.0, warmup=10.0):
+        """Constructor
+
+        :param ports: serial, configured, instance and ids of the sensors on it
+        :type ports: list of tuple
+        :param log: logging, configured, instance
+        :type log: logging
+        :param address: host and TCP port to listen on, defaults to ('localhost', DEFAULT_PORT)
+        :type address: tuple, optional
+        :param interval: time in sec between two readings of each sensor, defaults to 60.0
+        :type interval: float, optional
+        :param warmup: time in sec needed by the sensors to give stable readings, defaults to 10.0
+        :type warmup: float, optional
+        """
+        self.ports = [(ser, list(ids)) for ser, ids in ports]
+        self.log = log
+        self.address = address
+        self.interval = interval
+        self.warmup = warmup
+        self.cache = MetricsCache()
+        self.server = None
+        self.__stop = threading.Event()
+        self.__threads = list()
+
+    def start(self):
+        """Open the ports, then sample the sensors and answer to scrapes in background threads
+        """
+        self.__stop.clear()
+        for ser, ids in self.ports:
+            ser.open()
+            ser.flushInput()
+            for id in ids:
+                self.cache.register(ser.port, id)
+        self.server = http.server.ThreadingHTTPServer(self.address, MetricsHandler)
+        self.server.exporter = self
+        self.server.daemon_threads = True
+        self.__threads = [threading.Thread(target=self.__sample, args=(ser, ids), daemon=True)
+                          for ser, ids in self.ports]
+        self.__threads.append(threading.Thread(target=self.server.serve_forever, daemon=True))
+        for t in self.__threads:
+            t.start()
+
+    def serve_forever(self):
+        """Start and wait until stopped or interrupted by the user
+        """
+        try:
+            self.start()
+            while not self.__stop.is_set():
+                self.__stop.wait(1.0)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop sampling and listening, sensors are put to sleep and ports closed
+        """
+        self.__stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+        for t in self.__threads:
+            t.join()
+        self.__threads = list()
+        if self.server is not None:
+            self.server.server_close()
+            self.server = None
+
+    def __sample(self, ser, ids):
+        sd = SDS011Bus(ser, self.log, ids, metrics=DriverMetrics())
+        sched = DutyCycleScheduler(self.log)
+        for id in ids:
+            sched.add(sd, id, self.interval, self.warmup)
+        try:
+            for id, pm in sched.run(stop=self.__stop):
+                self.cache.update(ser.port, id, pm, sd.metrics.totals(id))
+        except Exception as e:
+            self.log.exception(e)
+        finally:
+            for id in ids:
+                sd.cmd_set_sleep(1, id=id)
+            ser.close()
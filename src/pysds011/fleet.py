@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Module that reads many Nove SDS011 sensors, each one on its own serial port, concurrently.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import serial
+
+from pysds011 import driver
+
+
+def parse_target(target):
+    """Parse a sensor description in the PORT[@ID] form
+
+    :param target: serial port, optionally followed by '@' and 4 hex digits sensor ID
+    :type target: str
+    :return: port and sensor id (FF FF if not provided)
+    :rtype: tuple
+    """
+    port, sep, id = target.rpartition('@')
+    if sep and 4 == len(id):
+        try:
+            return port, bytes.fromhex(id)
+        except ValueError:
+            pass
+    return target, b'\xff\xff'
+
+
+def poll_sensor(port, id, log, warmup=3):
+    """Read the dust values of a single sensor: open the port, wake the sensor up,
+    wait for the warm up time, query it and then put it to sleep and close the port.
+
+    :param port: UART port to communicate with dust sensor
+    :type port: str
+    :param id: sensor id
+    :type id: 2 bytes
+    :param log: logging, configured, instance
+    :type log: logging
+    :param warmup: time in sec to warm up the sensor, defaults to 3
+    :type warmup: int, optional
+    :return: result with fields 'port', 'id' and 'dust' (None in case of error)
+    :rtype: dict
+    """
+    res = {'port': port, 'id': id.hex(), 'dust': None}
+    ser = serial.Serial()
+    ser.port = port
+    ser.baudrate = 9600
+    sd = None
+    try:
+        ser.open()
+        ser.flushInput()
+        sd = driver.SDS011(ser, log)
+        if sd.cmd_set_sleep(0, id=id) is not True:
+            log.error('%s WakeUp failure', port)
+            return res
+        if sd.cmd_set_mode(sd.MODE_QUERY, id=id) is not True:
+            log.error('%s Set MODE_QUERY failure', port)
+            return res
+        time.sleep(warmup)
+        res['dust'] = sd.cmd_query_data(id=id)
+    except Exception as e:
+        log.error('%s %s', port, e)
+    finally:
+        if sd is not None:
+            sd.cmd_set_sleep(1, id=id)
+        ser.close()
+    return res
+
+
+def poll_fleet(targets, log, warmup=3, max_workers=8):
+    """Read the dust values of many sensors, each one on its own serial port.
+    Sensors are read concurrently by a bounded pool of threads,
+    so that all the warm up periods overlap.
+
+    :param targets: (port, id) of each sensor
+    :type targets: list of tuple
+    :param log: logging, configured, instance
+    :type log: logging
+    :param warmup: time in sec to warm up the sensors, defaults to 3
+    :type warmup: int, optional
+    :param max_workers: max number of sensors read at the same time, defaults to 8
+    :type max_workers: int, optional
+    :return: result of each sensor, see poll_sensor, in the same order of targets
+    :rtype: list
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(poll_sensor, port, id, log, warmup) for port, id in targets]
+        return [f.result() for f in futures]
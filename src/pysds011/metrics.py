@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Module that records what the driver does, per command and sensor id: requests, replies,
+round trip latencies and failures reading the replies::
+
+    metrics = DriverMetrics()
+    sd = driver.SDS011(ser, log, metrics=metrics)
+    ...
+    print(json.dumps(metrics.snapshot()))
+
+Recording is a few counter increments for each request, cheap enough to be left on.
+Data frames pushed in active mode, see ``SDS011.stream``, are not replies to a request
+so they are not recorded, but failures reading them are counted under query_data.
+Requests whose reply is not read, like ``cmd_set_working_period``, are not recorded.
+``cmd_set_id`` is recorded under the new id, the one the reply comes from.
+"""
+
+import threading
+from bisect import bisect_left
+
+from pysds011.driver import CMD_DEVICE_ID
+from pysds011.driver import CMD_FIRMWARE
+from pysds011.driver import CMD_MODE
+from pysds011.driver import CMD_QUERY_DATA
+from pysds011.driver import CMD_SLEEP
+from pysds011.driver import CMD_WORKING_PERIOD
+
+# upper bounds in sec of the latency histogram buckets, the last one is +Inf
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COMMAND_NAMES = {
+    CMD_MODE: 'mode',
+    CMD_QUERY_DATA: 'query_data',
+    CMD_DEVICE_ID: 'device_id',
+    CMD_SLEEP: 'sleep',
+    CMD_FIRMWARE: 'firmware',
+    CMD_WORKING_PERIOD: 'working_period',
+}
+FAILURES = ('skipped', 'checksum', 'tail', 'timeout', 'resync')
+
+
+class CommandStats(object):
+    """Counters of a command sent to a sensor
+    """
+
+    __slots__ = ('requests', 'replies', 'failures', 'latency_sum', 'histogram') + FAILURES
+
+    def __init__(self, buckets):
+        self.requests = 0
+        self.replies = 0
+        self.failures = 0
+        self.latency_sum = 0.0
+        self.histogram = [0] * (len(buckets) + 1)
+        for kind in FAILURES:
+            setattr(self, kind, 0)
+
+    def as_dict(self, buckets):
+        """
+        :return: counters, latency histogram with cumulative counts by upper bound as Prometheus does
+        :rtype: dict
+        """
+        cumulative = 0
+        histogram = dict()
+        for le, n in zip([str(b) for b in buckets] + ['+Inf'], self.histogram):
+            cumulative += n
+            histogram[le] = cumulative
+        res = {'requests': self.requests, 'replies': self.replies, 'failures': self.failures,
+               'latency': {'count': cumulative, 'sum': self.latency_sum, 'buckets': histogram}}
+        res.update((kind, getattr(self, kind)) for kind in FAILURES)
+        return res
+
+
+class DriverMetrics(object):
+    """Counters and latency histograms of the driver, per command and sensor id
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        """Constructor
+
+        :param buckets: upper bounds in sec of the latency histogram buckets, defaults to BUCKETS
+        :type buckets: tuple of float, optional
+        """
+        self.buckets = tuple(buckets)
+        # CommandStats by (command, sensor id)
+        self.stats = dict()
+        # only held to add new keys and to take snapshots, counters are updated by the driver thread
+        self.__lock = threading.Lock()
+
+    def __get(self, cmd, id):
+        key = (cmd, None if id is None else bytes(id))
+        s = self.stats.get(key)
+        if s is None:
+            with self.__lock:
+                s = self.stats.setdefault(key, CommandStats(self.buckets))
+        return s
+
+    def request(self, cmd, id):
+        """Record a command sent to a sensor
+
+        :param cmd: Command ID
+        :type cmd: int
+        :param id: sensor id
+        :type id: 2 bytes
+        """
+        self.__get(cmd, id).requests += 1
+
+    def reply(self, cmd, id, latency, ok=True):
+        """Record the end of a request
+
+        :param cmd: Command ID
+        :type cmd: int
+        :param id: sensor id
+        :type id: 2 bytes
+        :param latency: time in sec from the request to the reply, or to the failure
+        :type latency: float
+        :param ok: False if no valid reply has been received, defaults to True
+        :type ok: bool, optional
+        """
+        s = self.__get(cmd, id)
+        if ok:
+            s.replies += 1
+            s.latency_sum += latency
+            s.histogram[bisect_left(self.buckets, latency)] += 1
+        else:
+            s.failures += 1
+
+    def count(self, kind, cmd, id, n=1):
+        """Record a failure reading a reply
+
+        :param kind: one of FAILURES
+        :type kind: str
+        :param cmd: Command ID, None if not known
+        :type cmd: int
+        :param id: sensor id, None if not known
+        :type id: 2 bytes
+        :param n: number of failures, or of bytes for 'skipped', defaults to 1
+        :type n: int, optional
+        """
+        s = self.__get(cmd, id)
+        setattr(s, kind, getattr(s, kind) + n)
+
+    def totals(self, id=None):
+        """Sum of the counters of all the commands
+
+        :param id: sensor id, defaults to None that is 'all the sensors'
+        :type id: 2 bytes, optional
+        :return: requests, replies, failures and FAILURES counts
+        :rtype: dict
+        """
+        with self.__lock:
+            stats = [s for (_, i), s in self.stats.items() if id is None or i == id]
+        fields = ('requests', 'replies', 'failures') + FAILURES
+        return {f: sum(getattr(s, f) for s in stats) for f in fields}
+
+    def snapshot(self):
+        """Copy of all the counters, JSON friendly
+
+        :return: CommandStats.as_dict by command name and sensor id (4 hex digits or 'any')
+        :rtype: dict
+        """
+        with self.__lock:
+            items = list(self.stats.items())
+        res = dict()
+        for (cmd, id), s in sorted(items, key=lambda item: (str(item[0][0]), item[0][1] or b'')):
+            name = COMMAND_NAMES.get(cmd, 'any' if cmd is None else str(cmd))
+            res.setdefault(name, dict())['any' if id is None else id.hex()] = s.as_dict(self.buckets)
+        return res
+
+    def reset(self):
+        with self.__lock:
+            self.stats.clear()
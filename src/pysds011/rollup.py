@@ -0,0 +1,440 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Module that keeps, in bounded memory, months of readings of many Nove SDS011 sensors.
+
+For each sensor id the store keeps a ring of the last raw readings and rings of per minute,
+per hour and per day buckets with count, min, max and mean of PM 2.5 and PM 10.
+All the rings are allocated when a sensor is first seen, so memory never grows past
+``max_bytes``: readings of sensors that do not fit are dropped::
+
+    store = RollupStore(max_bytes=8 * 1024 * 1024)
+    for pm in sd.stream():
+        store.push(pm)
+    last_week = store.query(b'\xab\xcd', time.time() - 7 * DAY)
+
+A query is answered from the coarsest buckets that fit in the time window,
+the edges from the finer ones that still hold them, or else from the whole enclosing buckets:
+the summarized window, in the result, is then wider than the requested one.
+"""
+
+import math
+import time
+from array import array
+
+from pysds011.series import to_tenths
+
+RAW = 0
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+# default ring sizes: an hour of 1 Hz readings, a day of minutes, 90 days of hours, 10 years of days
+RAW_SIZE = 3600
+MINUTE_SIZE = 24 * 60
+HOUR_SIZE = 90 * 24
+DAY_SIZE = 10 * 366
+MAX_BYTES = 16 * 1024 * 1024
+
+
+class Ring(object):
+    """Fixed size columns, the oldest row is overwritten when full.
+    Rows are in time order, the first column is their time.
+    """
+
+    # column typecodes
+    COLUMNS = ()
+
+    def __init__(self, size):
+        """Constructor
+
+        :param size: max number of rows
+        :type size: int
+        """
+        if size < 1:
+            raise ValueError('Ring size has to be at least 1')
+        self.size = size
+        self.columns = [array(c, [0]) * size for c in self.COLUMNS]
+        # position of the oldest row and number of rows
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def pos(self, i):
+        """
+        :param i: row index, 0 is the oldest, -1 the newest
+        :type i: int
+        :return: position of the row in the columns
+        :rtype: int
+        """
+        if i < 0:
+            i += self.count
+        return (self.head + i) % self.size
+
+    def time(self, i):
+        return self.columns[0][self.pos(i)]
+
+    def add_row(self):
+        """Make room for a new row, overwriting the oldest one if full
+
+        :return: position of the new row
+        :rtype: int
+        """
+        if self.count < self.size:
+            self.count += 1
+        else:
+            self.head = (self.head + 1) % self.size
+        return self.pos(-1)
+
+    def bisect(self, t):
+        """
+        :return: index of the first row not older than t
+        :rtype: int
+        """
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.time(mid) < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def rows(self, start, end):
+        """
+        :return: positions of the rows with time in [start, end)
+        :rtype: generator of int
+        """
+        for i in range(self.bisect(start), self.bisect(end)):
+            yield self.pos(i)
+
+    def nbytes(self):
+        return sum(c.itemsize * len(c) for c in self.columns)
+
+
+class RawRing(Ring):
+    """Last raw readings: time, PM 2.5 and PM 10 in tenths of μg/m^3
+    """
+
+    COLUMNS = ('d', 'H', 'H')
+
+    def push(self, timestamp, pm25, pm10):
+        p = self.add_row()
+        for c, v in zip(self.columns, (timestamp, pm25, pm10)):
+            c[p] = v
+
+    def summarize(self, start, end, acc):
+        t, pm25, pm10 = self.columns
+        for p in self.rows(start, end):
+            acc.add(1, pm25[p], pm25[p], pm25[p], pm10[p], pm10[p], pm10[p])
+
+
+class BucketRing(Ring):
+    """Buckets of a fixed time width: start time, count, then min, max and sum
+    of PM 2.5 and PM 10 in tenths of μg/m^3
+    """
+
+    COLUMNS = ('d', 'L', 'H', 'H', 'd', 'H', 'H', 'd')
+
+    def __init__(self, width, size):
+        """Constructor
+
+        :param width: time in sec of a bucket, buckets start at multiples of it
+        :type width: int
+        :param size: max number of buckets
+        :type size: int
+        """
+        super(BucketRing, self).__init__(size)
+        self.width = width
+
+    def push(self, timestamp, pm25, pm10):
+        start, count, min25, max25, sum25, min10, max10, sum10 = self.columns
+        t = timestamp - timestamp % self.width
+        if self.count and start[self.pos(-1)] == t:
+            p = self.pos(-1)
+            count[p] += 1
+            min25[p] = min(min25[p], pm25)
+            max25[p] = max(max25[p], pm25)
+            sum25[p] += pm25
+            min10[p] = min(min10[p], pm10)
+            max10[p] = max(max10[p], pm10)
+            sum10[p] += pm10
+            return
+        p = self.add_row()
+        for c, v in zip(self.columns, (t, 1, pm25, pm25, pm25, pm10, pm10, pm10)):
+            c[p] = v
+
+    def summarize(self, start, end, acc):
+        for p in self.rows(start, end):
+            acc.add(*(c[p] for c in self.columns[1:]))
+
+    def bucket(self, p):
+        """
+        :return: summary of the bucket at a position
+        :rtype: dict
+        """
+        acc = Summary()
+        acc.add(*(c[p] for c in self.columns[1:]))
+        return acc.result(self.columns[0][p], self.columns[0][p] + self.width, self.width)
+
+
+class Summary(object):
+    """Count, min, max and sum of PM 2.5 and PM 10 of many readings or buckets
+    """
+
+    __slots__ = ('count', 'min25', 'max25', 'sum25', 'min10', 'max10', 'sum10')
+
+    def __init__(self):
+        self.count = 0
+        self.min25 = self.max25 = self.min10 = self.max10 = None
+        self.sum25 = self.sum10 = 0.0
+
+    def add(self, count, min25, max25, sum25, min10, max10, sum10):
+        if self.count:
+            self.min25 = min(self.min25, min25)
+            self.max25 = max(self.max25, max25)
+            self.min10 = min(self.min10, min10)
+            self.max10 = max(self.max10, max10)
+        else:
+            self.min25, self.max25, self.min10, self.max10 = min25, max25, min10, max10
+        self.count += count
+        self.sum25 += sum25
+        self.sum10 += sum10
+
+    def result(self, start, end, resolution):
+        """
+        :return: summary in μg/m^3, with fields 'start', 'end', 'resolution', 'count',
+                 'pm25' and 'pm10' (dict with fields 'min', 'max' and 'mean', None without readings)
+        :rtype: dict
+        """
+        res = {'start': start, 'end': end, 'resolution': resolution, 'count': self.count,
+               'pm25': None, 'pm10': None}
+        if self.count:
+            res['pm25'] = {'min': self.min25 / 10.0, 'max': self.max25 / 10.0,
+                           'mean': round(self.sum25 / self.count / 10.0, 2)}
+            res['pm10'] = {'min': self.min10 / 10.0, 'max': self.max10 / 10.0,
+                           'mean': round(self.sum10 / self.count / 10.0, 2)}
+        return res
+
+
+class SensorRollup(object):
+    """Raw readings and buckets of a single sensor
+    """
+
+    def __init__(self, raw=RAW_SIZE, minutes=MINUTE_SIZE, hours=HOUR_SIZE, days=DAY_SIZE):
+        """Constructor
+
+        :param raw: number of raw readings to keep, defaults to RAW_SIZE
+        :type raw: int, optional
+        :param minutes: number of per minute buckets to keep, defaults to MINUTE_SIZE
+        :type minutes: int, optional
+        :param hours: number of per hour buckets to keep, defaults to HOUR_SIZE
+        :type hours: int, optional
+        :param days: number of per day buckets to keep, defaults to DAY_SIZE
+        :type days: int, optional
+        """
+        self.raw = RawRing(raw)
+        # from the finest to the coarsest
+        self.levels = [BucketRing(MINUTE, minutes), BucketRing(HOUR, hours), BucketRing(DAY, days)]
+
+    def push(self, timestamp, pm25, pm10):
+        """Add a reading
+
+        :param timestamp: time of the reading, as returned by time.time(), not older than the last one
+        :type timestamp: float
+        :param pm25: PM 2.5 in tenths of μg/m^3
+        :type pm25: int
+        :param pm10: PM 10 in tenths of μg/m^3
+        :type pm10: int
+        """
+        if self.raw.count and timestamp < self.raw.time(-1):
+            raise ValueError('Reading older than the last one')
+        self.raw.push(timestamp, pm25, pm10)
+        for level in self.levels:
+            level.push(timestamp, pm25, pm10)
+
+    def level(self, resolution):
+        """
+        :param resolution: RAW, MINUTE, HOUR or DAY
+        :rtype: Ring
+        """
+        if RAW == resolution:
+            return self.raw
+        for level in self.levels:
+            if level.width == resolution:
+                return level
+        raise ValueError('Unknown resolution %s' % resolution)
+
+    def span(self):
+        """
+        :return: time of the oldest and of the newest reading still summarized, None if empty
+        :rtype: tuple
+        """
+        if not self.raw.count:
+            return None
+        oldest = min(ring.time(0) for ring in [self.raw] + self.levels)
+        return oldest, self.raw.time(-1)
+
+    @staticmethod
+    def __holds(ring, t):
+        """
+        :return: True if ring still has all its rows from t on
+        :rtype: bool
+        """
+        return ring.count < ring.size or ring.time(0) <= t
+
+    def __summarize(self, n, start, end, acc, used):
+        """Summarize [start, end) with the whole buckets of level n, the edges with the finer levels.
+        An edge that the finer levels no longer hold is summarized with the whole enclosing bucket of level n.
+
+        :return: window actually summarized
+        :rtype: tuple
+        """
+        if start >= end:
+            return start, end
+        if n < 0:
+            self.raw.summarize(start, end, acc)
+            used.add(RAW)
+            return start, end
+        level = self.levels[n]
+        finer = self.levels[n - 1] if n else self.raw
+        if not self.__holds(finer, start):
+            start = math.floor(start / level.width) * level.width
+        if not self.__holds(finer, math.floor(end / level.width) * level.width):
+            end = math.ceil(end / level.width) * level.width
+        lo = math.ceil(start / level.width) * level.width
+        hi = math.floor(end / level.width) * level.width
+        if lo >= hi:
+            return self.__summarize(n - 1, start, end, acc, used)
+        level.summarize(lo, hi, acc)
+        used.add(level.width)
+        start, _ = self.__summarize(n - 1, start, lo, acc, used)
+        _, end = self.__summarize(n - 1, hi, end, acc, used)
+        return start, end
+
+    def query(self, start=None, end=None):
+        """Summarize the readings in a time window
+
+        :param start: first time included, defaults to None that is from the oldest reading
+        :type start: float, optional
+        :param end: first time excluded, defaults to None that is up to the newest reading
+        :type end: float, optional
+        :return: see Summary.result, 'resolution' is the coarsest one used. 'start' and 'end' are the window
+                 actually summarized: wider than the requested one if its edges are older than the finer levels
+        :rtype: dict
+        """
+        span = self.span()
+        acc = Summary()
+        used = set()
+        if span is not None:
+            start = span[0] if start is None else start
+            end = math.floor(span[1]) + 1 if end is None else end
+            start, end = self.__summarize(len(self.levels) - 1, start, end, acc, used)
+        return acc.result(start, end, max(used) if used else None)
+
+    def buckets(self, resolution, start=None, end=None):
+        """Get the buckets of a resolution in a time window, like for a plot
+
+        :param resolution: MINUTE, HOUR or DAY
+        :type resolution: int
+        :param start: first time included, defaults to None that is from the oldest bucket
+        :type start: float, optional
+        :param end: first time excluded, defaults to None that is up to the newest bucket
+        :type end: float, optional
+        :return: summary of each bucket, see Summary.result
+        :rtype: list of dict
+        """
+        level = self.level(resolution)
+        if RAW == resolution:
+            raise ValueError('Raw readings have no buckets')
+        start = -math.inf if start is None else start
+        end = math.inf if end is None else end
+        return [level.bucket(p) for p in level.rows(start, end)]
+
+    def nbytes(self):
+        """
+        :return: memory used by the rings, allocated at construction
+        :rtype: int
+        """
+        return sum(ring.nbytes() for ring in [self.raw] + self.levels)
+
+
+class RollupStore(object):
+    """Rollups of many sensors, by sensor id, within a memory ceiling
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES, raw=RAW_SIZE, minutes=MINUTE_SIZE, hours=HOUR_SIZE, days=DAY_SIZE):
+        """Constructor, see SensorRollup for the ring sizes
+
+        :param max_bytes: max memory used by the rings of all the sensors, defaults to MAX_BYTES
+        :type max_bytes: int, optional
+        :raises ValueError: if not even a sensor fits in max_bytes
+        """
+        self.max_bytes = max_bytes
+        self.sizes = (raw, minutes, hours, days)
+        self.sensors = dict()
+        # readings dropped because of the memory ceiling
+        self.dropped = 0
+        if self.sensor_bytes() > max_bytes:
+            raise ValueError('A sensor needs %d bytes, more than max_bytes' % self.sensor_bytes())
+
+    def sensor_bytes(self):
+        """
+        :return: memory used by the rings of each sensor
+        :rtype: int
+        """
+        raw, minutes, hours, days = self.sizes
+        return raw * RawRing(1).nbytes() + (minutes + hours + days) * BucketRing(1, 1).nbytes()
+
+    def nbytes(self):
+        return sum(s.nbytes() for s in self.sensors.values())
+
+    def push(self, pm):
+        """Add a reading, the rings of a new sensor are allocated if there is room for them
+
+        :param pm: dust data, with sensor id and timestamp, not older than the last one of the same sensor.
+                   A reading without timestamp is taken as 'now'
+        :type pm: Measurement
+        :return: False if the reading is dropped because of the memory ceiling
+        :rtype: bool
+        """
+        sensor = self.sensors.get(pm.id)
+        if sensor is None:
+            if self.nbytes() + self.sensor_bytes() > self.max_bytes:
+                self.dropped += 1
+                return False
+            sensor = self.sensors[pm.id] = SensorRollup(*self.sizes)
+        timestamp = pm.timestamp if pm.timestamp is not None else time.time()
+        sensor.push(timestamp, to_tenths(pm.pm25), to_tenths(pm.pm10))
+        return True
+
+    def extend(self, pms):
+        """Add many readings, like the ones of SDS011.stream or SDS011Bus.poll values
+
+        :type pms: iterable of Measurement
+        """
+        for pm in pms:
+            if pm is not None:
+                self.push(pm)
+
+    def ids(self):
+        return list(self.sensors)
+
+    def query(self, id, start=None, end=None):
+        """Summarize the readings of a sensor in a time window, see SensorRollup.query
+
+        :return: summary, None for unknown sensors
+        :rtype: dict
+        """
+        sensor = self.sensors.get(id)
+        return sensor.query(start, end) if sensor is not None else None
+
+    def buckets(self, id, resolution, start=None, end=None):
+        """Get the buckets of a sensor, see SensorRollup.buckets
+
+        :return: summary of each bucket, empty for unknown sensors
+        :rtype: list of dict
+        """
+        sensor = self.sensors.get(id)
+        return sensor.buckets(resolution, start, end) if sensor is not None else []
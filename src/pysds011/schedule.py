@@ -0,0 +1,261 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Module that chooses how to keep Nove SDS011 sensors between two samples and runs the sampling.
+
+For each sensor the cheapest, in fan on time, of three strategies is chosen:
+
+* AWAKE: sensor always on, queried each interval
+* SLEEP: sensor put to sleep between samples, woken up warm up sec before each one
+* PERIOD: on-sensor working period, the sensor wakes up and reports by itself
+
+Sensors sharing a bus (same driver) with the same interval and strategy are grouped:
+they are woken up, warmed up and read together::
+
+    sched = DutyCycleScheduler(log)
+    sched.add(bus, b'\\x48\\xe7', interval=300, warmup=measure_warmup(bus, b'\\x48\\xe7'))
+    sched.add(bus, b'\\x48\\xe8', interval=300, warmup=20)
+    for id, pm in sched.run():
+        print(id.hex(), pm.pretty)
+"""
+
+import collections
+import heapq
+import itertools
+import time
+
+from pysds011.bus import SDS011Bus
+from pysds011.driver import MODE_ACTIVE
+from pysds011.driver import RSP_DATA
+from pysds011.driver import process_data
+from pysds011.session import MIN_SLEEP
+
+AWAKE = 'awake'
+SLEEP = 'sleep'
+PERIOD = 'period'
+# time in sec the sensor works in each working period
+PERIOD_WORK = 30
+# max working period in minutes
+MAX_PERIOD = 30
+# time in sec of the commands to wake up, read and put to sleep a sensor
+OVERHEAD = 1.0
+# time in sec a PERIOD report is waited before and after the expected time, the sensor clock drifts
+PERIOD_SLACK = 10.0
+
+Plan = collections.namedtuple('Plan', ['strategy', 'fan_duty', 'period'])
+Group = collections.namedtuple('Group', ['sd', 'ids', 'interval', 'warmup', 'plan'])
+
+
+def measure_warmup(sd, id=b'\xff\xff', max_time=30, tolerance=1.0):
+    """Measure the time needed by a sleeping sensor to give stable readings, see SDS011.wait_warmup.
+    The sensor is left awake in query mode.
+
+    :param sd: driver
+    :type sd: SDS011
+    :param id: sensor id, defaults to b'\xff\xff'
+    :type id: 2 bytes, optional
+    :param max_time: max time in sec to wait, defaults to 30
+    :type max_time: float, optional
+    :param tolerance: max difference in μg/m^3 between stable readings, defaults to 1.0
+    :type tolerance: float, optional
+    :return: warm up time in sec, max_time if not converged, None in case of error
+    :rtype: float
+    """
+    if sd.cmd_set_sleep(0, id=id) is not True or sd.cmd_set_mode(sd.MODE_QUERY, id=id) is not True:
+        sd.log.error('Sensor %s not ready', id.hex())
+        return None
+    start = time.monotonic()
+    if sd.wait_warmup(max_time=max_time, tolerance=tolerance, id=id) is None:
+        return None
+    return min(time.monotonic() - start, max_time)
+
+
+def choose_strategy(interval, warmup, overhead=OVERHEAD, min_sleep=MIN_SLEEP, periodic=True):
+    """Choose the strategy with the lowest fan duty cycle, the one with fewer commands in case of tie
+
+    :param interval: time in sec between two samples
+    :type interval: float
+    :param warmup: time in sec needed by the sensor to give stable readings after a wake up
+    :type warmup: float
+    :param overhead: time in sec of the commands of each wake up, defaults to OVERHEAD
+    :type overhead: float, optional
+    :param min_sleep: min sleep time in sec, worth to stop the fan, defaults to MIN_SLEEP
+    :type min_sleep: float, optional
+    :param periodic: PERIOD can be chosen, defaults to True
+    :type periodic: bool, optional
+    :return: strategy, fraction of time with the fan on and working period in minutes (PERIOD only)
+    :rtype: Plan
+    """
+    plans = [Plan(AWAKE, 1.0, None)]
+    if interval - warmup - overhead >= min_sleep:
+        plans.append(Plan(SLEEP, (warmup + overhead) / interval, None))
+    minutes, rest = divmod(interval, 60)
+    if periodic and 0 == rest and 1 <= minutes <= MAX_PERIOD and warmup <= PERIOD_WORK:
+        plans.append(Plan(PERIOD, PERIOD_WORK / interval, int(minutes)))
+    # stable sort: on equal duty the last, with fewer commands, wins
+    return min(reversed(plans), key=lambda p: p.fan_duty)
+
+
+class DutyCycleScheduler(object):
+    """Sample many sensors, each one at its own interval, with the cheapest strategy
+    """
+
+    def __init__(self, log, overhead=OVERHEAD, min_sleep=MIN_SLEEP):
+        """Constructor
+
+        :param log: logging, configured, instance
+        :type log: logging
+        :param overhead: time in sec of the commands of each wake up, defaults to OVERHEAD
+        :type overhead: float, optional
+        :param min_sleep: min sleep time in sec, worth to stop the fan, defaults to MIN_SLEEP
+        :type min_sleep: float, optional
+        """
+        self.log = log
+        self.overhead = overhead
+        self.min_sleep = min_sleep
+        self.sensors = list()
+
+    def add(self, sd, id, interval, warmup):
+        """Add a sensor
+
+        :param sd: driver of the port the sensor is on, sensors on the same bus have to share it
+        :type sd: SDS011 or SDS011Bus
+        :param id: sensor id
+        :type id: 2 bytes
+        :param interval: time in sec between two samples
+        :type interval: float
+        :param warmup: time in sec needed by the sensor to give stable readings, see measure_warmup
+        :type warmup: float
+        """
+        self.sensors.append((sd, id, interval, warmup))
+
+    def plan(self):
+        """Choose the strategy of each sensor and group the ones that can be woken up and read together
+
+        :rtype: list of Group
+        """
+        groups = [Group(sd, [sensor], interval, warmup, choose_strategy(interval, warmup, self.overhead, self.min_sleep))
+                  for sd, sensor, interval, warmup in self.sensors]
+        while True:
+            # merged by the plan that is actually run, until no group changes
+            merged = collections.OrderedDict()
+            for g in groups:
+                key = (id(g.sd), g.interval, g.plan.strategy)
+                other = merged.get(key)
+                if other is not None:
+                    # a group is woken up as long as its slowest sensor needs
+                    warmup = max(other.warmup, g.warmup)
+                    g = other._replace(ids=other.ids + g.ids, warmup=warmup,
+                                       plan=choose_strategy(g.interval, warmup, self.overhead, self.min_sleep))
+                merged[key] = g
+            if len(merged) == len(groups):
+                return groups
+            groups = list(merged.values())
+
+    def configure(self, group):
+        """Apply the strategy of a group to its sensors
+
+        :return: True if all the sensors are configured
+        :rtype: bool
+        """
+        ok = True
+        for id in group.ids:
+            ok &= group.sd.cmd_set_sleep(0, id=id) is True
+            if PERIOD == group.plan.strategy:
+                ok &= group.sd.cmd_set_working_period(group.plan.period, id=id) is True
+                ok &= group.sd.cmd_set_mode(MODE_ACTIVE, id=id) is True
+            else:
+                ok &= group.sd.cmd_set_working_period(0, id=id) is True
+                ok &= group.sd.cmd_set_mode(group.sd.MODE_QUERY, id=id) is True
+                if SLEEP == group.plan.strategy:
+                    ok &= group.sd.cmd_set_sleep(1, id=id) is True
+        if not ok:
+            self.log.error('Configuration failure of %s', ', '.join(i.hex() for i in group.ids))
+        return ok
+
+    def read(self, group):
+        """Read all the sensors of a group
+
+        :return: dust data by sensor id, None for the sensors that do not reply
+        :rtype: dict
+        """
+        if PERIOD == group.plan.strategy:
+            res = dict()
+            reader = group.sd.reader
+            timeout = reader.timeout
+            # wait the reports around the expected time
+            reader.timeout = timeout + 2 * PERIOD_SLACK
+            try:
+                for id in group.ids:
+                    d = reader.read_frame(RSP_DATA, id=id)
+                    res[id] = process_data(d, self.log) if d is not None else None
+            finally:
+                reader.timeout = timeout
+            return res
+        if isinstance(group.sd, SDS011Bus):
+            return group.sd.poll(group.ids)
+        return {id: group.sd.cmd_query_data(id=id) for id in group.ids}
+
+    def run(self, count=None, stop=None):
+        """Configure the sensors and sample them
+
+        :param count: number of samples of each group, defaults to None that is 'forever'
+        :type count: int, optional
+        :param stop: event that ends the sampling as soon as it is set, defaults to None
+        :type stop: threading.Event, optional
+        :return: generator of (sensor id, dust data), None for failed readings
+        :rtype: generator of tuple
+        """
+        groups = self.plan()
+        # (time, sequence, action, group index, time of the reading, readings done)
+        events = list()
+        seq = itertools.count()
+        now = time.monotonic()
+        for i, g in enumerate(groups):
+            self.log.info('%s: %s, fan duty %.2f', ', '.join(id.hex() for id in g.ids), g.plan.strategy,
+                          g.plan.fan_duty)
+            if not self.configure(g) and PERIOD == g.plan.strategy:
+                # the sensors would not report by themselves: query them
+                g = groups[i] = g._replace(plan=choose_strategy(g.interval, g.warmup, self.overhead, self.min_sleep,
+                                                                periodic=False))
+                self.log.warning('%s: fallback to %s', ', '.join(id.hex() for id in g.ids), g.plan.strategy)
+                self.configure(g)
+            # in PERIOD the sensor reports by itself at the end of its working time
+            self.__push(events, seq, g, i, now + (PERIOD_WORK if PERIOD == g.plan.strategy else g.warmup), 0)
+        while events:
+            when, _, action, i, due, n = heapq.heappop(events)
+            g = groups[i]
+            delay = when - time.monotonic()
+            if stop is not None:
+                if stop.wait(max(delay, 0)):
+                    return
+            elif delay > 0:
+                time.sleep(delay)
+            if 'wake' == action:
+                for id in g.ids:
+                    g.sd.cmd_set_sleep(0, id=id)
+                heapq.heappush(events, (due, next(seq), 'read', i, due, n))
+                continue
+            res = self.read(g)
+            if PERIOD == g.plan.strategy and any(pm is not None for pm in res.values()):
+                # next reports are expected by the sensor clock, not by the host one
+                due = time.monotonic()
+            for id, pm in res.items():
+                yield id, pm
+            if SLEEP == g.plan.strategy:
+                for id in g.ids:
+                    g.sd.cmd_set_sleep(1, id=id)
+            n += 1
+            if count is None or n < count:
+                self.__push(events, seq, g, i, due + g.interval, n)
+
+    @staticmethod
+    def __push(events, seq, g, i, due, n):
+        """Plan the next reading of a group, and its wake up warmup sec before if it sleeps
+        """
+        if SLEEP == g.plan.strategy:
+            heapq.heappush(events, (due - g.warmup, next(seq), 'wake', i, due, n))
+        elif PERIOD == g.plan.strategy:
+            heapq.heappush(events, (due - PERIOD_SLACK, next(seq), 'read', i, due, n))
+        else:
+            heapq.heappush(events, (due, next(seq), 'read', i, due, n))
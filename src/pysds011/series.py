@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Module that keeps the history of the readings of a Nove SDS011 sensor in compact columns.
+
+Timestamps are stored as double and PM values as the raw unsigned 16 bits tenths of μg/m^3
+sent by the sensor, in contiguous ``array`` buffers: 12 bytes for each reading.
+A day of 1 Hz readings takes about 1 MB::
+
+    ts = TimeSeries(id=b'\xab\xcd')
+    for pm in sd.stream(count=60):
+        ts.append(pm)
+    last_minute = ts.between(time.time() - 60, time.time())
+
+With the optional NumPy package (``pip install pysds011[numpy]``) columns can be exported without copies.
+"""
+
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+
+from pysds011.driver import Measurement
+
+
+def to_tenths(value):
+    """Convert a PM value in μg/m^3 to the raw sensor representation
+
+    :param value: PM in μg/m^3
+    :type value: float
+    :return: PM in tenths of μg/m^3, as the sensor reports it
+    :rtype: int
+    """
+    return int(round(value * 10))
+
+
+class TimeSeries(object):
+    """Readings of a sensor, in time order, stored in columns
+    """
+
+    def __init__(self, id=None):
+        """Constructor
+
+        :param id: id of the sensor, reported by the returned Measurement, defaults to None
+        :type id: 2 bytes, optional
+        """
+        self.id = id
+        self.timestamps = array('d')
+        self.pm25 = array('H')
+        self.pm10 = array('H')
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, pm):
+        """Add a reading at the end
+
+        :param pm: dust data, its timestamp has not to be older than the last one in the series
+        :type pm: Measurement
+        """
+        self.append_raw(pm.timestamp, to_tenths(pm.pm25), to_tenths(pm.pm10))
+
+    def append_raw(self, timestamp, pm25, pm10):
+        """Add a reading at the end, without any conversion
+
+        :param timestamp: time of the reading, as returned by time.time(), not older than the last one
+        :type timestamp: float
+        :param pm25: PM 2.5 in tenths of μg/m^3
+        :type pm25: int
+        :param pm10: PM 10 in tenths of μg/m^3
+        :type pm10: int
+        """
+        if self.timestamps and timestamp < self.timestamps[-1]:
+            raise ValueError('Reading older than the last one in the series')
+        self.timestamps.append(timestamp)
+        self.pm25.append(pm25)
+        self.pm10.append(pm10)
+
+    def extend(self, pms):
+        """Add many readings at the end
+
+        :param pms: dust data, in time order
+        :type pms: iterable of Measurement
+        """
+        for pm in pms:
+            self.append(pm)
+
+    def __getitem__(self, index):
+        """Get a reading by position, or a copy of a part of the series
+
+        :type index: int or slice
+        :rtype: Measurement or TimeSeries
+        """
+        if isinstance(index, slice):
+            res = TimeSeries(self.id)
+            res.timestamps = self.timestamps[index]
+            res.pm25 = self.pm25[index]
+            res.pm10 = self.pm10[index]
+            return res
+        return Measurement(self.pm25[index] / 10.0, self.pm10[index] / 10.0, self.id, self.timestamps[index])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def index_range(self, start=None, end=None):
+        """Find the readings in a time range, with a binary search
+
+        :param start: first time included, defaults to None that is from the first reading
+        :type start: float, optional
+        :param end: last time included, defaults to None that is up to the last reading
+        :type end: float, optional
+        :return: positions of the readings in the range
+        :rtype: slice
+        """
+        lo = 0 if start is None else bisect_left(self.timestamps, start)
+        hi = len(self) if end is None else bisect_right(self.timestamps, end)
+        return slice(lo, max(lo, hi))
+
+    def between(self, start=None, end=None):
+        """Get the readings in a time range, see index_range
+
+        :return: copy of the readings in the range
+        :rtype: TimeSeries
+        """
+        return self[self.index_range(start, end)]
+
+    def nbytes(self):
+        """
+        :return: memory used by the stored values
+        :rtype: int
+        """
+        return sum(c.itemsize * len(c) for c in (self.timestamps, self.pm25, self.pm10))
+
+    def to_numpy(self, start=None, end=None):
+        """Export the columns as NumPy arrays that share the memory of the series.
+        PM values are the raw tenths of μg/m^3, divide them by 10.0 to get μg/m^3.
+        The series cannot grow while exported arrays are alive (BufferError).
+
+        :param start: first time included, defaults to None that is from the first reading
+        :type start: float, optional
+        :param end: last time included, defaults to None that is up to the last reading
+        :type end: float, optional
+        :return: timestamps (float64), pm25 (uint16) and pm10 (uint16) arrays
+        :rtype: tuple
+        """
+        import numpy
+
+        r = self.index_range(start, end)
+        return tuple(numpy.frombuffer(memoryview(c)[r], dtype=dtype)
+                     for c, dtype in ((self.timestamps, numpy.float64),
+                                      (self.pm25, numpy.uint16),
+                                      (self.pm10, numpy.uint16)))
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Module that keeps a Nove SDS011 sensor ready to be read across many requests.
+"""
+
+import time
+
+from pysds011.driver import SDS011
+
+# min time in sec the sensor has to sleep between two samples, to be worth to put it to sleep
+MIN_SLEEP = 30
+
+
+class SessionError(Exception):
+    """Sensor cannot be prepared at the session beginning"""
+
+
+class SDS011Session(object):
+    """Context manager that opens the port and wakes the sensor up once,
+    then let many readings to be taken before a single sleep and close at the end::
+
+        with SDS011Session(ser, log) as s:
+            for _ in range(10):
+                print(s.query_data()['pretty'])
+                time.sleep(10)
+    """
+
+    def __init__(self, ser, log, id=b'\xff\xff', mode=1, sleep_on_exit=True):
+        """Constructor
+
+        :param ser: serial, configured, instance. Opened by the session if it is not yet
+        :type ser: pyserial
+        :param log: logging, configured, instance
+        :type log: logging
+        :param id: sensor id, defaults to b'\xff\xff'
+        :type id: 2 bytes, optional
+        :param mode: reporting mode to apply, None to keep the actual one, defaults to 1 that is MODE_QUERY
+        :type mode: int, optional
+        :param sleep_on_exit: put the sensor to sleep at the end of the session, defaults to True
+        :type sleep_on_exit: bool, optional
+        """
+        self.ser = ser
+        self.log = log
+        self.id = id
+        self.mode = mode
+        self.sleep_on_exit = sleep_on_exit
+        self.sensor = None
+        self.__opened = False
+
+    def __enter__(self):
+        if not getattr(self.ser, 'is_open', True):
+            self.ser.open()
+            self.__opened = True
+        try:
+            self.ser.flushInput()
+            self.sensor = SDS011(self.ser, self.log)
+            if self.sensor.cmd_set_sleep(0, id=self.id) is not True:
+                raise SessionError('WakeUp failure')
+            if self.mode is not None and self.sensor.cmd_get_mode(id=self.id) != self.mode:
+                if self.sensor.cmd_set_mode(self.mode, id=self.id) is not True:
+                    raise SessionError('Set mode %d failure' % self.mode)
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self.sensor is not None and self.sleep_on_exit:
+                self.sensor.cmd_set_sleep(1, id=self.id)
+        finally:
+            self.sensor = None
+            if self.__opened:
+                self.ser.close()
+                self.__opened = False
+
+    def query_data(self):
+        """Read dust values from the sensor, see SDS011.cmd_query_data
+
+        :return: dust data
+        :rtype: Measurement
+        """
+        return self.sensor.cmd_query_data(id=self.id)
+
+    def firmware_ver(self):
+        """Get FW version, see SDS011.cmd_firmware_ver
+
+        :return: version description dictionary  or None if error
+        :rtype: dict
+        """
+        return self.sensor.cmd_firmware_ver(id=self.id)
+
+    def monitor(self, interval, count=None, warmup=3, min_sleep=MIN_SLEEP):
+        """Take readings at a fixed rate. Sensor is put to sleep between two readings
+        if it can sleep at least min_sleep, and woken up warmup sec before the next one.
+        Readings that cannot be taken in time are skipped.
+
+        :param interval: time in sec between two readings
+        :type interval: float
+        :param count: number of readings, defaults to None that is 'forever'
+        :type count: int, optional
+        :param warmup: time in sec to warm up the sensor before each reading, defaults to 3
+        :type warmup: float, optional
+        :param min_sleep: min sleep time in sec, defaults to MIN_SLEEP
+        :type min_sleep: float, optional
+        :return: generator of dust data, None for failed readings
+        :rtype: generator of Measurement
+        :raises ValueError: if interval is not greater than 0
+        """
+        if interval <= 0:
+            raise ValueError('Interval %s is not greater than 0' % interval)
+        sleep_between = interval - warmup >= min_sleep
+        start = time.monotonic() + warmup
+        asleep = False
+        n = 0
+        while count is None or n < count:
+            due = start + n * interval
+            if asleep:
+                self.__wait(due - warmup)
+                if self.sensor.cmd_set_sleep(0, id=self.id) is not True:
+                    self.log.error('WakeUp failure')
+                    yield None
+                    n += 1
+                    continue
+                asleep = False
+            self.__wait(due)
+            late = time.monotonic() - due
+            if late > interval:
+                self.log.warning('Skip %d readings', late // interval)
+                start += (late // interval) * interval
+            yield self.query_data()
+            n += 1
+            if sleep_between and (count is None or n < count):
+                asleep = self.sensor.cmd_set_sleep(1, id=self.id) is True
+
+    @staticmethod
+    def __wait(until):
+        delay = until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,341 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Module that implements a simulated Nove SDS011 sensor, to use the driver
+and the command line app without any hardware.
+
+:class:`SimulatedSDS011` has the same interface of a pyserial instance,
+so it can be directly injected in the driver::
+
+    sd = driver.SDS011(sim.SimulatedSDS011(), log)
+
+:class:`PtyBridge` exposes it on a pseudo terminal, to be used as ``--port`` of the command line app.
+"""
+
+import random
+import struct
+import time
+
+from pysds011.driver import CMD_DEVICE_ID
+from pysds011.driver import CMD_FIRMWARE
+from pysds011.driver import CMD_MODE
+from pysds011.driver import CMD_QUERY_DATA
+from pysds011.driver import CMD_SLEEP
+from pysds011.driver import CMD_WORKING_PERIOD
+from pysds011.driver import MODE_ACTIVE
+from pysds011.driver import RSP_CMD
+from pysds011.driver import RSP_DATA
+
+# all PC->Sensor commands are 19bytes long
+COMMAND_LEN = 19
+# max number of active mode reports waiting to be read
+MAX_BACKLOG = 100
+
+
+class SimulatedSDS011(object):
+    """Virtual sensor, with the pyserial interface used by the driver
+    """
+
+    def __init__(self, id=b'\x12\x34', firmware=(18, 11, 16), series=None, mode=MODE_ACTIVE, latency=0.0,
+                 active_interval=1.0, drop_rate=0.0, bad_checksum_rate=0.0, garbage_rate=0.0,
+                 garbage_len=8, seed=None):
+        """Constructor
+
+        :param id: sensor id, defaults to b'\x12\x34'
+        :type id: 2 bytes, optional
+        :param firmware: FW version as (year, month, day), defaults to (18, 11, 16)
+        :type firmware: tuple, optional
+        :param series: measurements as iterable of (pm25, pm10) in μg/m^3, each reading takes the next one
+                       and the last one is kept forever. It can also be a function of the time in sec
+                       since the sensor creation. Defaults to None that is always (10.0, 20.0)
+        :type series: iterable or callable, optional
+        :param mode: initial reporting mode, defaults to MODE_ACTIVE as the factory setting
+        :type mode: int, optional
+        :param latency: time in sec between command and reply, defaults to 0.0
+        :type latency: float, optional
+        :param active_interval: time in sec between measurements in active mode, defaults to 1.0
+        :type active_interval: float, optional
+        :param drop_rate: probability to lose a byte in a sent frame, defaults to 0.0
+        :type drop_rate: float, optional
+        :param bad_checksum_rate: probability to send a frame with wrong checksum, defaults to 0.0
+        :type bad_checksum_rate: float, optional
+        :param garbage_rate: probability to send random bytes before a frame, defaults to 0.0
+        :type garbage_rate: float, optional
+        :param garbage_len: max number of random bytes sent each time, defaults to 8
+        :type garbage_len: int, optional
+        :param seed: seed of the fault injection random generator, defaults to None
+        :type seed: int, optional
+        """
+        self.id = bytes(id)
+        self.firmware = firmware
+        self.latency = latency
+        self.active_interval = active_interval
+        self.drop_rate = drop_rate
+        self.bad_checksum_rate = bad_checksum_rate
+        self.garbage_rate = garbage_rate
+        self.garbage_len = garbage_len
+        self.random = random.Random(seed)
+        if series is None:
+            series = [(10.0, 20.0)]
+        self.__series = series if callable(series) else iter(series)
+        self.__last = (0.0, 0.0)
+        self.__start = time.monotonic()
+        # sensor state
+        self.sleeping = False
+        self.mode = mode
+        self.period = 0
+        self.__next_report = self.__start
+        # serial state
+        self.port = None
+        self.baudrate = 9600
+        self.timeout = None
+        self.is_open = True
+        self.__rx = bytearray()
+        self.__tx = bytearray()
+        # (time, bytes) scheduled to be received by the driver
+        self.__scheduled = list()
+        # counters
+        self.stats = {'commands': 0, 'frames': 0, 'ignored': 0}
+
+    # ------------------------------------------------------------------
+    # pyserial interface
+    # ------------------------------------------------------------------
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def flushInput(self):
+        self.__pump()
+        del self.__tx[:]
+
+    reset_input_buffer = flushInput
+
+    @property
+    def in_waiting(self):
+        self.__pump()
+        return len(self.__tx)
+
+    def write(self, data):
+        """Receive bytes from the driver, complete commands are executed
+        """
+        self.__rx += data
+        while True:
+            head = self.__rx.find(b'\xaa\xb4')
+            if head < 0:
+                del self.__rx[:-1]
+                break
+            del self.__rx[:head]
+            if len(self.__rx) < COMMAND_LEN:
+                break
+            packet = bytes(self.__rx[:COMMAND_LEN])
+            del self.__rx[:COMMAND_LEN]
+            self.__execute(packet)
+        return len(data)
+
+    def read(self, size=1):
+        """Get bytes sent by the sensor, wait for them up to timeout
+        """
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            self.__pump()
+            if len(self.__tx) >= size:
+                break
+            wake = self.__next_event()
+            if deadline is not None and (wake is None or wake > deadline):
+                wake = deadline
+            if wake is None:
+                # nothing will ever come, also without timeout
+                break
+            delay = wake - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif deadline is not None and wake == deadline:
+                break
+        ret = bytes(self.__tx[:size])
+        del self.__tx[:size]
+        return ret
+
+    # ------------------------------------------------------------------
+    # sensor behavior
+    # ------------------------------------------------------------------
+    def measurement(self):
+        """Next measurement of the configured series
+
+        :return: pm25 and pm10 in μg/m^3
+        :rtype: tuple
+        """
+        if callable(self.__series):
+            self.__last = self.__series(time.monotonic() - self.__start)
+        else:
+            self.__last = next(self.__series, self.__last)
+        return self.__last
+
+    def __report_interval(self):
+        return self.period * 60 if self.period else self.active_interval
+
+    def __next_event(self):
+        events = [t for t, _ in self.__scheduled]
+        if MODE_ACTIVE == self.mode and not self.sleeping:
+            events.append(self.__next_report)
+        return min(events) if events else None
+
+    def __pump(self):
+        """Move to the driver buffer all the bytes due by now
+        """
+        now = time.monotonic()
+        if now - self.__next_report > MAX_BACKLOG * self.__report_interval():
+            # nobody is reading: like a serial buffer, keep only the last reports
+            self.__next_report = now - MAX_BACKLOG * self.__report_interval()
+        while MODE_ACTIVE == self.mode and not self.sleeping and self.__next_report <= now:
+            self.__schedule(self.__data_frame(), self.__next_report)
+            self.__next_report += self.__report_interval()
+        due = [d for d in self.__scheduled if d[0] <= now]
+        if due:
+            self.__scheduled = [d for d in self.__scheduled if d[0] > now]
+            for _, data in sorted(due, key=lambda d: d[0]):
+                self.__tx += data
+
+    def __frame(self, rsp, data):
+        frame = bytearray(b'\xaa' + bytes([rsp]) + bytes(data) + self.id)
+        frame += bytes([sum(frame[2:8]) % 256, 0xab])
+        return frame
+
+    def __data_frame(self):
+        pm25, pm10 = self.measurement()
+        return self.__frame(RSP_DATA, struct.pack('<HH', int(round(pm25 * 10)), int(round(pm10 * 10))))
+
+    def __schedule(self, frame, when):
+        """Apply fault injection and plan a frame transmission
+        """
+        self.stats['frames'] += 1
+        if self.random.random() < self.bad_checksum_rate:
+            frame[8] = (frame[8] + 1) % 256
+        if self.random.random() < self.drop_rate:
+            del frame[self.random.randrange(len(frame))]
+        if self.random.random() < self.garbage_rate:
+            garbage = bytes(self.random.randrange(256) for _ in range(self.random.randint(1, self.garbage_len)))
+            frame = garbage + frame
+        self.__scheduled.append((when, bytes(frame)))
+
+    def __execute(self, packet):
+        """Execute a PC->Sensor command and plan the reply
+        """
+        cmd = packet[2]
+        data = packet[3:15]
+        dest = packet[15:17]
+        if packet[17] != (sum(packet[2:17]) % 256) or packet[18] != 0xab:
+            self.stats['ignored'] += 1
+            return
+        if dest != b'\xff\xff' and dest != self.id:
+            self.stats['ignored'] += 1
+            return
+        # a sleeping sensor only accepts the wake up command
+        if self.sleeping and not (CMD_SLEEP == cmd and 1 == data[0] and 1 == data[1]):
+            self.stats['ignored'] += 1
+            return
+        self.stats['commands'] += 1
+        write = 1 == data[0]
+        if CMD_QUERY_DATA == cmd:
+            reply = self.__data_frame()
+        elif CMD_MODE == cmd:
+            if write:
+                self.mode = data[1]
+                self.__next_report = time.monotonic() + self.__report_interval()
+            reply = self.__frame(RSP_CMD, [cmd, data[0], self.mode, 0])
+        elif CMD_SLEEP == cmd:
+            if write:
+                self.sleeping = 0 == data[1]
+                self.__next_report = time.monotonic() + self.__report_interval()
+            reply = self.__frame(RSP_CMD, [cmd, data[0], 0 if self.sleeping else 1, 0])
+        elif CMD_WORKING_PERIOD == cmd:
+            if write:
+                self.period = data[1]
+            reply = self.__frame(RSP_CMD, [cmd, data[0], self.period, 0])
+        elif CMD_FIRMWARE == cmd:
+            reply = self.__frame(RSP_CMD, [cmd, self.firmware[0], self.firmware[1], self.firmware[2]])
+        elif CMD_DEVICE_ID == cmd:
+            self.id = bytes(data[10:12])
+            reply = self.__frame(RSP_CMD, [cmd, 0, 0, 0])
+        else:
+            self.stats['ignored'] += 1
+            return
+        self.__schedule(reply, time.monotonic() + self.latency)
+
+
+class PtyBridge(object):
+    """Expose a simulated sensor on a pseudo terminal (Unix only)::
+
+        with PtyBridge(SimulatedSDS011()) as bridge:
+            subprocess.run(['pysds011', '--port', bridge.port, 'dust'])
+    """
+
+    def __init__(self, sim):
+        """Constructor
+
+        :param sim: simulated sensor
+        :type sim: SimulatedSDS011
+        """
+        self.sim = sim
+        self.port = None
+        self.__master = None
+        self.__slave = None
+        self.__thread = None
+        self.__running = False
+
+    def start(self):
+        """Create the pseudo terminal and serve the sensor in a background thread
+
+        :return: path of the pseudo terminal to use as serial port
+        :rtype: str
+        """
+        import os
+        import pty
+        import threading
+        import tty
+
+        self.__master, self.__slave = pty.openpty()
+        tty.setraw(self.__slave)
+        self.port = os.ttyname(self.__slave)
+        self.sim.timeout = 0
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__serve, daemon=True)
+        self.__thread.start()
+        return self.port
+
+    def stop(self):
+        """Stop the background thread and close the pseudo terminal
+        """
+        import os
+
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        for fd in (self.__master, self.__slave):
+            if fd is not None:
+                os.close(fd)
+        self.__master = self.__slave = None
+
+    def __serve(self):
+        import os
+        import select
+
+        while self.__running:
+            readable, _, _ = select.select([self.__master], [], [], 0.01)
+            if readable:
+                try:
+                    self.sim.write(os.read(self.__master, 1024))
+                except OSError:
+                    break
+            pending = self.sim.in_waiting
+            if pending:
+                os.write(self.__master, self.sim.read(pending))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -0,0 +1,136 @@
+from pysds011.aggregate import Aggregator
+from pysds011.aggregate import P2Quantile
+from pysds011.aggregate import RunningStats
+from pysds011.aggregate import sample
+from pysds011.driver import Measurement
+import random
+import statistics
+import pytest
+
+
+def test_running_stats():
+    '''
+    Welford mean and variance match the ones of all the samples
+    '''
+    xs = [4.0, 7.0, 13.0, 16.0, 1e3]
+    rs = RunningStats()
+    for x in xs:
+        rs.push(x)
+
+    assert 5 == rs.count
+    assert statistics.mean(xs) == pytest.approx(rs.mean)
+    assert statistics.variance(xs) == pytest.approx(rs.variance)
+    assert 4.0 == rs.min
+    assert 1e3 == rs.max
+
+
+def test_running_stats_empty():
+    rs = RunningStats()
+    assert 0.0 == rs.variance
+    rs.push(1.0)
+    assert 0.0 == rs.std
+
+
+@pytest.mark.parametrize('p', [0.1, 0.5, 0.9])
+def test_p2_quantile(p):
+    '''
+    Streaming estimate is close to the exact quantile
+    '''
+    rnd = random.Random(1)
+    xs = [rnd.gauss(20, 3) for _ in range(5000)]
+    q = P2Quantile(p)
+    for x in xs:
+        q.push(x)
+
+    assert sorted(xs)[int(p * len(xs))] == pytest.approx(q.value, abs=0.1)
+
+
+def test_p2_quantile_few_values():
+    '''
+    Up to five values the quantile is exact
+    '''
+    q = P2Quantile(0.5)
+    assert q.value is None
+    for x in (5.0, 1.0, 3.0, 2.0):
+        q.push(x)
+    assert 2.5 == q.value
+
+
+def test_p2_quantile_exact_window():
+    '''
+    Up to exact values the quantile is exact, estimated beyond
+    '''
+    rnd = random.Random(2)
+    xs = [rnd.gauss(20, 3) for _ in range(30)]
+    q = P2Quantile(0.5, exact=30)
+    for x in xs:
+        q.push(x)
+    assert statistics.median(xs) == pytest.approx(q.value)
+
+    for x in xs:
+        q.push(x)
+    assert 60 == q.count
+    assert statistics.median(xs) == pytest.approx(q.value, abs=1.0)
+
+
+def test_p2_quantile_invalid():
+    with pytest.raises(ValueError):
+        P2Quantile(1.5)
+
+
+def test_aggregator_mean_median():
+    agg = Aggregator()
+    for pm25 in (1.0, 2.0, 3.0, 10.0):
+        assert agg.push(Measurement(pm25, pm25 * 2, b'\xab\xcd', pm25))
+    agg.push(None)
+
+    assert 4 == agg.count
+    assert Measurement(4.0, 8.0, b'\xab\xcd', 10.0) == agg.result()
+    assert {'pm25': 2.5, 'pm10': 5.0, 'pretty': agg.result('median')['pretty']} == dict(agg.result('median'))
+    with pytest.raises(ValueError):
+        agg.result('max')
+
+
+def test_aggregator_empty():
+    assert Aggregator().result() is None
+
+
+def test_aggregator_reject_spikes():
+    '''
+    Spikes are rejected, a persistent level change is followed
+    '''
+    agg = Aggregator(reject=3.0, quantiles=(0.9,))
+    for pm25 in [10.0, 10.1, 10.0, 10.2, 10.1, 10.0, 80.0, 10.1]:
+        agg.push(Measurement(pm25, 20.0))
+
+    assert 1 == agg.rejected
+    assert 7 == agg.count
+    assert 80.0 != agg.summary()['pm25']['max']
+    assert 'p90' in agg.summary()['pm25']
+
+    for _ in range(20):
+        agg.push(Measurement(50.0, 20.0))
+    assert 50.0 == agg.summary()['pm25']['max']
+
+
+def test_aggregator_reject_not_tracked():
+    '''
+    A rejected spike does not move the median, so the readings after it are accepted
+    '''
+    agg = Aggregator(reject=3.0)
+    for pm25 in [10.0] * 15 + [50.0] + [10.0] * 3:
+        agg.push(Measurement(pm25, 20.0))
+
+    assert 1 == agg.rejected
+    assert 18 == agg.count
+    assert 10.0 == agg.result('median')['pm25']
+
+
+def test_sample(mocker):
+    sleep = mocker.patch('time.sleep')
+    sd = mocker.MagicMock()
+    sd.cmd_query_data.return_value = Measurement(1.0, 2.0)
+
+    assert 3 == len(list(sample(sd, 3, interval=0.5, id=b'\xab\xcd')))
+    assert 2 == sleep.call_count
+    sd.cmd_query_data.assert_called_with(id=b'\xab\xcd')
@@ -0,0 +1,142 @@
+from pysds011.aio import AsyncSDS011
+from pysds011.aio import FakeTransport
+import asyncio
+import logging
+
+
+HEAD = b'\xaa'
+TAIL = b'\xab'
+SENSOR_ID = b'\xab\xcd'
+
+
+def compose_response(data, rsp=b'\xc5'):
+    CHECKSUM_RSP = bytes([sum(data) % 256])
+    return HEAD+rsp+data+CHECKSUM_RSP+TAIL
+
+
+def sensor(packet):
+    """
+    Minimal sensor: reply to each command echoing
+    command and data, query data get fixed PM values
+    """
+    cmd = packet[2]
+    if 4 == cmd:
+        return compose_response(b'\xd4\x04\x3a\x0a' + SENSOR_ID, rsp=b'\xc0')
+    if 5 == cmd:
+        return compose_response(b'\x05\x00\x00\x00' + packet[13:15])
+    if 7 == cmd:
+        return compose_response(b'\x07\x0f\x07\x0a' + SENSOR_ID)
+    return compose_response(bytes([cmd, packet[3], packet[4], 0]) + SENSOR_ID)
+
+
+def test_cmd_query_data():
+    async def scenario():
+        t = FakeTransport(sensor)
+        d = AsyncSDS011(t.reader, t, logging.getLogger("SDS011"))
+        return t, await d.cmd_query_data()
+
+    t, resp = asyncio.run(scenario())
+    assert 1 == len(t.written)
+    assert b'\xaa\xb4\x04' + bytes(12) + b'\xff\xff\x02\xab' == t.written[0]
+    assert 123.6 == resp['pm25']
+    assert 261.8 == resp['pm10']
+
+
+def test_created_out_of_loop():
+    '''
+    Driver created before the event loop runs
+    '''
+    t = FakeTransport(sensor)
+    d = AsyncSDS011(t.reader, t, logging.getLogger("SDS011"))
+
+    async def scenario():
+        return await asyncio.gather(d.cmd_query_data(), d.cmd_get_mode())
+
+    resp, mode = asyncio.run(scenario())
+    assert 123.6 == resp['pm25']
+    assert mode is not None
+
+
+def test_cmd_set_get():
+    async def scenario():
+        t = FakeTransport(sensor)
+        d = AsyncSDS011(t.reader, t, logging.getLogger("SDS011"))
+        return (await d.cmd_set_sleep(0),
+                await d.cmd_get_sleep(),
+                await d.cmd_set_mode(1),
+                await d.cmd_get_mode(),
+                await d.cmd_firmware_ver(),
+                await d.cmd_set_id(SENSOR_ID, b'\x12\x34'),
+                await d.cmd_get_working_period())
+
+    set_sleep, get_sleep, set_mode, get_mode, fw, set_id, period = asyncio.run(scenario())
+    assert set_sleep
+    assert get_sleep is True
+    assert set_mode
+    assert 0 == get_mode
+    assert 15 == fw['year']
+    assert set_id
+    assert 0 == period
+
+
+def test_cmd_query_data_timeout():
+    async def scenario():
+        t = FakeTransport()
+        d = AsyncSDS011(t.reader, t, logging.getLogger("SDS011"), timeout=0.01)
+        return await d.cmd_query_data()
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_cmd_query_data_corrupted_recover():
+    '''
+    A reply following a corrupted one is recovered
+    '''
+    def noisy(packet):
+        good = sensor(packet)
+        return good[:-1] + b'\x00' + good
+
+    async def scenario():
+        t = FakeTransport(noisy)
+        d = AsyncSDS011(t.reader, t, logging.getLogger("SDS011"), timeout=0.5)
+        return await d.cmd_query_data(), d.frames.corrupted
+
+    resp, corrupted = asyncio.run(scenario())
+    assert 123.6 == resp['pm25']
+    assert 1 == corrupted
+
+
+def test_many_sensors():
+    '''
+    Many sensors are driven concurrently by the same event loop:
+    a dead one does not delay the others
+    '''
+    async def scenario():
+        log = logging.getLogger("SDS011")
+        drivers = []
+        for i in range(20):
+            t = FakeTransport(sensor if i else None)
+            drivers.append(AsyncSDS011(t.reader, t, log, timeout=0.2))
+        return await asyncio.gather(*[d.cmd_query_data() for d in drivers])
+
+    res = asyncio.run(scenario())
+    assert res[0] is None
+    assert all(123.6 == r['pm25'] for r in res[1:])
+
+
+def test_stream():
+    def active_sensor(packet):
+        # a data pushed before the reply and two after it
+        return (compose_response(b'\x09\x00\x09\x00' + SENSOR_ID, rsp=b'\xc0') +
+                sensor(packet) +
+                compose_response(b'\x01\x00\x02\x00' + SENSOR_ID, rsp=b'\xc0') +
+                compose_response(b'\x02\x00\x04\x00' + SENSOR_ID, rsp=b'\xc0'))
+
+    async def scenario():
+        t = FakeTransport(active_sensor)
+        d = AsyncSDS011(t.reader, t, logging.getLogger("SDS011"))
+        return [r async for r in d.stream(count=2, period=0)]
+
+    res = asyncio.run(scenario())
+    assert [0.1, 0.2] == [r['pm25'] for r in res]
+    assert [0.2, 0.4] == [r['pm10'] for r in res]
@@ -0,0 +1,62 @@
+from pysds011.batch import parse_script
+from pysds011.batch import run_script
+from pysds011.driver import SDS011
+from pysds011.sim import SimulatedSDS011
+import logging
+import pytest
+
+
+def test_parse_script():
+    script = parse_script(['# configure', '', 'MODE 1', 'period', 'id 4321  # new id', 'wait 0.5', 'dust'])
+    assert [(3, 'mode', [1]), (4, 'period', []), (5, 'id', [b'\x43\x21']),
+            (6, 'wait', [0.5]), (7, 'dust', [])] == script
+
+
+@pytest.mark.parametrize('line', ['reboot', 'dust 1', 'mode a', 'id 12', 'wait', 'sleep 1 2'])
+def test_parse_script_invalid(line):
+    with pytest.raises(ValueError) as e:
+        parse_script(['dust', line])
+    assert 'line 2' in str(e.value)
+
+
+def test_run_script(mocker):
+    mocker.patch('time.sleep')
+    sim = SimulatedSDS011(series=[(1.0, 2.0), (3.0, 4.0)], mode=1)
+    d = SDS011(sim, logging.getLogger("SDS011"))
+    ids = [b'\x12\x34']
+    script = parse_script(['mode', 'period 2', 'dust', 'id abcd', 'fw_version', 'wait 1', 'dust'])
+
+    res = list(run_script(d, script, ids))
+
+    assert [True] * 7 == [r['ok'] for r in res]
+    assert 1 == res[0]['result']
+    assert 2 == sim.period
+    assert 1.0 == res[2]['result']['pm25']
+    assert [b'\xab\xcd'] == ids
+    assert 'abcd' == res[4]['id']
+    assert 'abcd' == res[4]['result']['id']
+    assert 3.0 == res[6]['result']['pm25']
+
+
+def test_run_script_error():
+    sim = SimulatedSDS011(mode=1)
+    d = SDS011(sim, logging.getLogger("SDS011"))
+    d.reader.timeout = 0.01
+
+    res = list(run_script(d, parse_script(['dust']), [b'\x12\x34', b'\x99\x99']))
+
+    assert [True, False] == [r['ok'] for r in res]
+    assert ['1234', '9999'] == [r['id'] for r in res]
+
+
+def test_run_script_awake():
+    '''
+    Getting the sleep state of an awake sensor succeeds, even if the result is False
+    '''
+    sim = SimulatedSDS011(mode=1)
+    d = SDS011(sim, logging.getLogger("SDS011"))
+
+    res = list(run_script(d, parse_script(['sleep']), [b'\x12\x34']))
+
+    assert [True] == [r['ok'] for r in res]
+    assert res[0]['result'] is False
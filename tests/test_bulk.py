@@ -0,0 +1,53 @@
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from pysds011.bulk import decode_frames  # noqa: E402
+from pysds011.driver import FRAME_LEN  # noqa: E402
+
+
+def frame(rsp, data, id=b'\xab\xcd'):
+    body = bytes([rsp]) + bytes(data) + id
+    return b'\xaa' + body + bytes([sum(body[1:]) % 256, 0xab])
+
+
+DATA1 = frame(0xc0, b'\xd4\x04\x3a\x0a')
+DATA2 = frame(0xc0, b'\x01\x00\x02\x00', id=b'\x12\x34')
+REPLY = frame(0xc5, b'\x07\x12\x0b\x10')
+
+
+def test_decode():
+    res = decode_frames(DATA1 + DATA2 + REPLY)
+    assert [0, 10] == list(res.data['offset'])
+    assert [1236, 1] == list(res.data['pm25'])
+    assert [2618, 2] == list(res.data['pm10'])
+    assert ['abcd', '1234'] == ['%04x' % i for i in res.data['id']]
+    assert 1 == len(res.replies)
+    assert 7 == res.replies['cmd'][0]
+    assert [18, 11, 16] == list(res.replies['data'][0])
+    assert 0 == res.rejected
+
+
+def test_decode_garbage_and_bad_checksum():
+    bad = bytearray(DATA2)
+    bad[8] += 1
+    raw = b'\x00\xaa\x13' + DATA1 + bytes(bad) + DATA1[:5] + DATA2 + b'\xab'
+    res = decode_frames(memoryview(raw))
+    assert [3, 28] == list(res.data['offset'])
+    assert 1 == res.rejected
+
+
+def test_decode_chunks():
+    raw = (DATA1 + b'\x00' * 3 + DATA2) * 50
+    expected = decode_frames(raw)
+    for chunk_size in (1, 7, FRAME_LEN, 64):
+        res = decode_frames(raw, chunk_size=chunk_size)
+        assert 100 == len(res.data)
+        assert (expected.data == res.data).all()
+
+
+def test_decode_empty():
+    res = decode_frames(b'')
+    assert 0 == len(res.data)
+    assert 0 == len(res.replies)
+    assert 0 == res.rejected
@@ -0,0 +1,112 @@
+from pysds011.bus import SDS011Bus
+from test_driver import SerialMock
+from test_driver import HEAD
+from test_driver import compose_response
+from test_driver import compose_write
+import logging
+
+
+ID1 = b'\x00\x01'
+ID2 = b'\x00\x02'
+ID3 = b'\x00\x03'
+
+
+def data_frame(pm, id):
+    return HEAD + compose_response(bytes([pm, 0, pm, 0]) + id, rsp=b'\xc0')
+
+
+def test_poll():
+    """
+    Test a sweep over the bus: all queries are written at once
+    and replies, coming in any order, are routed by sensor ID
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    sm.test_expect_read(data_frame(2, ID2) + data_frame(3, ID3))
+    sm.test_expect_read(data_frame(1, ID1))
+
+    bus = SDS011Bus(sm, log, ids=[ID1, ID2, ID3])
+    res = bus.poll()
+
+    production_code_write_to_sensor = sm.test_get_write()
+    assert 1 == len(production_code_write_to_sensor)
+    QUERY = b'\x04' + bytes(12)
+    assert compose_write(QUERY, ID1) + compose_write(QUERY, ID2) + compose_write(QUERY, ID3) == \
+        production_code_write_to_sensor[0]
+    assert 0.1 == res[ID1]['pm25']
+    assert 0.2 == res[ID2]['pm25']
+    assert 0.3 == res[ID3]['pm25']
+
+
+def test_poll_dead_sensor():
+    """
+    Test a sweep over the bus with a sensor that does not reply
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    sm.test_expect_read(data_frame(3, ID3))
+
+    bus = SDS011Bus(sm, log, ids=[ID1, ID3])
+    res = bus.poll()
+
+    assert res[ID1] is None
+    assert 0.3 == res[ID3]['pm25']
+
+
+def test_reply_routed_to_its_request():
+    """
+    Test that a reply for another sensor is not mistaken for
+    the requested one, and that it is dropped as stale
+    when a new request is sent to its sensor
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    sm.test_expect_read(HEAD + compose_response(b'\x02\x00\x00\x00' + ID2))
+    sm.test_expect_read(HEAD + compose_response(b'\x02\x00\x01\x00' + ID1))
+    sm.test_expect_read(HEAD + compose_response(b'\x02\x00\x01\x00' + ID2))
+
+    bus = SDS011Bus(sm, log, ids=[ID1, ID2])
+    assert 1 == bus.cmd_get_mode(id=ID1)
+    assert 1 == len(bus.reader.pending)
+    assert 1 == bus.cmd_get_mode(id=ID2)
+    assert 0 == len(bus.reader.pending)
+
+
+def test_get_not_matching_set_reply():
+    """
+    Test that the reply to a set command is not taken as the reply to a get
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    sm.test_expect_read(HEAD + compose_response(b'\x06\x01\x00\x00' + ID1))
+    sm.test_expect_read(HEAD + compose_response(b'\x06\x00\x01\x00' + ID1))
+
+    bus = SDS011Bus(sm, log, ids=[ID1])
+    assert bus.cmd_get_sleep(id=ID1) is False
+
+
+def test_poll_drop_stale():
+    """
+    Test that data kept from a previous request is not taken as the reply to a new query
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    sm.test_expect_read(data_frame(9, ID2) + HEAD + compose_response(b'\x06\x01\x01\x00' + ID1))
+    sm.test_expect_read(data_frame(2, ID2))
+
+    bus = SDS011Bus(sm, log, ids=[ID1, ID2])
+    assert bus.cmd_set_sleep(0, id=ID1)
+    assert 0.2 == bus.poll([ID2])[ID2]['pm25']
+
+
+def test_for_each():
+    """
+    Test a command applied to all the sensors of the bus
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    sm.test_expect_read(HEAD + compose_response(b'\x06\x01\x01\x00' + ID1))
+    sm.test_expect_read(HEAD + compose_response(b'\x06\x01\x01\x00' + ID2))
+
+    bus = SDS011Bus(sm, log, ids=[ID1, ID2])
+    assert {ID1: True, ID2: True} == bus.for_each('cmd_set_sleep', sleep=0)
@@ -0,0 +1,148 @@
+from pysds011.capture import CaptureError
+from pysds011.capture import CaptureReader
+from pysds011.capture import CaptureWriter
+from pysds011.capture import ReplaySerial
+from pysds011.driver import RSP_DATA
+from pysds011.driver import SDS011
+from pysds011.sim import SimulatedSDS011
+import logging
+import pytest
+import time
+
+DATA = bytes.fromhex('aac0d4043a0aabcd94ab')
+BAD = bytes.fromhex('aac0d4043a0aabcd95ab')
+LONG_PORT = '/dev/serial/by-id/usb-1a86_USB2.0-Serial-if00-port0'
+
+
+def test_write_read(tmp_path):
+    path = str(tmp_path / 'test.cap')
+    with CaptureWriter(path) as cap:
+        cap.write(DATA, 'COM1')
+        cap.write(BAD, LONG_PORT)
+        cap.write(DATA, 'COM1')
+    with CaptureReader(path) as cap:
+        assert ['COM1', LONG_PORT] == cap.ports
+        assert [('COM1', DATA), (LONG_PORT, BAD), ('COM1', DATA)] == [(p, d) for _, p, d in cap]
+        assert [BAD] == list(cap.chunks(LONG_PORT))
+
+
+def test_raw_chunks(tmp_path):
+    '''
+    Bytes are recorded as read: noise, partial and more frames at once
+    '''
+    path = str(tmp_path / 'test.cap')
+    with CaptureWriter(path) as cap:
+        cap.write(b'\x00\xaa', 'COM1')
+        cap.write(BAD[:4], 'COM1')
+        cap.write(BAD[4:] + DATA * 2, 'COM1')
+    with CaptureReader(path) as cap:
+        assert [b'\x00\xaa', BAD[:4], BAD[4:] + DATA * 2] == list(cap.chunks())
+        replay = SDS011(cap.serial('COM1'), logging.getLogger("SDS011"))
+        assert DATA == replay.reader.read_frame(RSP_DATA)
+        assert DATA == replay.reader.read_frame(RSP_DATA)
+
+
+def test_wall_clock(tmp_path):
+    '''
+    Sessions appended to the same file share the wall clock timeline
+    '''
+    path = str(tmp_path / 'test.cap')
+    before = time.time()
+    with CaptureWriter(path) as cap:
+        cap.write(DATA, 'COM1', timestamp=time.monotonic() - 1.0)
+    with CaptureWriter(path) as cap:
+        cap.write(DATA, 'COM1', timestamp=time.monotonic() + 1.0)
+    after = time.time()
+    with CaptureReader(path) as cap:
+        assert 2 == len(cap.sessions)
+        first, second = [t for t, _, _ in cap]
+        assert before - 1.0 <= first <= after - 1.0
+        assert before + 1.0 <= second <= after + 1.0
+
+
+def test_autoflush(tmp_path):
+    path = str(tmp_path / 'test.cap')
+    cap = CaptureWriter(path)
+    cap.write(DATA, 'COM1')
+    # readable while the writer is still open
+    with CaptureReader(path) as reader:
+        assert [DATA] == list(reader.chunks())
+    cap.close()
+
+
+def test_append(tmp_path):
+    path = str(tmp_path / 'test.cap')
+    with CaptureWriter(path) as cap:
+        cap.write(DATA, 'COM1')
+    with CaptureWriter(path) as cap:
+        cap.write(DATA, 'COM2')
+        cap.write(DATA, 'COM1')
+    with CaptureReader(path) as cap:
+        assert ['COM1', 'COM2'] == cap.ports
+        assert ['COM1', 'COM2', 'COM1'] == [p for _, p, _ in cap]
+
+
+def test_truncated_record_ignored(tmp_path):
+    path = str(tmp_path / 'test.cap')
+    with CaptureWriter(path) as cap:
+        cap.write(DATA, 'COM1')
+    with open(path, 'ab') as f:
+        f.write(b'\x00' * 7)
+    with CaptureReader(path) as cap:
+        assert 1 == len(list(cap))
+
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / 'test.cap'
+    path.write_bytes(b'hello world')
+    with pytest.raises(CaptureError):
+        CaptureReader(str(path))
+
+
+def test_driver_hook_and_replay(tmp_path):
+    path = str(tmp_path / 'test.cap')
+    log = logging.getLogger("SDS011")
+    with CaptureWriter(path) as cap:
+        d = SDS011(SimulatedSDS011(series=[(1.0, 2.0), (3.0, 4.0)], active_interval=0.01), log,
+                   capture=cap.hook('sim'))
+        assert [1.0, 3.0] == [pm.pm25 for pm in d.stream(count=2, period=0)]
+    with CaptureReader(path) as cap:
+        replay = SDS011(cap.serial('sim'), log)
+        # set mode reply, then data
+        assert replay.reader.read_frame(RSP_DATA) is not None
+        assert 3.0 == replay.cmd_query_data().pm25
+        assert replay.reader.read_frame(RSP_DATA) is None
+
+
+def test_driver_hook_corrupted(tmp_path):
+    '''
+    Corrupted frames received by the driver are captured too
+    '''
+    path = str(tmp_path / 'test.cap')
+    log = logging.getLogger("SDS011")
+    with CaptureWriter(path) as cap:
+        d = SDS011(ReplaySerial([b'\x00' + BAD, DATA]), log, capture=cap.hook('COM1'))
+        assert DATA == d.reader.read_frame(RSP_DATA)
+    with CaptureReader(path) as cap:
+        assert b'\x00' + BAD + DATA == b''.join(cap.chunks())
+
+
+def test_decode(tmp_path):
+    pytest.importorskip('numpy')
+    path = str(tmp_path / 'test.cap')
+    now = time.monotonic()
+    with CaptureWriter(path) as cap:
+        cap.write(DATA, 'COM1', timestamp=now + 1.0)
+        cap.write(BAD + DATA[:3], LONG_PORT, timestamp=now + 2.0)
+        cap.write(DATA[3:], LONG_PORT, timestamp=now + 3.0)
+    cap = CaptureReader(path)
+    times, tags, res = cap.decode()
+    assert [1236, 1236] == list(res.data['pm25'])
+    start = times[res.data['offset']]
+    # frame split across two reads takes the time of its first byte
+    assert [0.0, 1.0] == [round(t - start[0], 6) for t in start]
+    assert ['COM1', LONG_PORT] == [cap.ports[t] for t in tags[res.data['offset']]]
+    assert 1 == res.rejected
+    assert 30 == len(times)
+    del times, tags, res
+    cap.close()
@@ -0,0 +1,125 @@
+from pysds011.daemon import DaemonClient
+from pysds011.daemon import DaemonError
+from pysds011.daemon import SDS011Daemon
+from pysds011.daemon import SensorPort
+from pysds011.sim import SimulatedSDS011
+import logging
+import os
+import pytest
+import stat
+import time
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    sim = SimulatedSDS011(series=[(1.0, 2.0), (3.0, 4.0)], mode=1)
+    sim.port = '/dev/ttySIM'
+    d = SDS011Daemon([(sim, [b'\xff\xff'])], logging.getLogger("SDS011"), path=str(tmp_path / 's.sock'),
+                     refresh=60.0, warmup=0)
+    d.start()
+    yield d
+    d.stop()
+
+
+def test_not_running(tmp_path):
+    assert not DaemonClient.running(str(tmp_path / 's.sock'))
+
+
+def test_dust_cached(daemon):
+    c = DaemonClient(daemon.path)
+    assert DaemonClient.running(daemon.path)
+    assert ['/dev/ttySIM'] == c.request('ports')
+    first = c.request('dust', port='/dev/ttySIM')
+    assert 1.0 == first['pm25']
+    assert '1234' == first['id']
+    # same reading, from cache
+    assert first == c.request('dust', port='/dev/ttySIM')
+
+
+def test_commands(daemon):
+    c = DaemonClient(daemon.path)
+    assert 1 == c.request('mode', port='/dev/ttySIM')
+    assert c.request('fw_version', port='/dev/ttySIM')['pretty'].startswith('Y: 18, M: 11, D: 16')
+    assert '1234' == c.request('id', port='/dev/ttySIM')
+    assert c.request('sleep', port='/dev/ttySIM', value=1) is True
+    assert daemon.ports['/dev/ttySIM'].sd.ser.sleeping
+    # a sleeping sensor is woken up for a fresh reading
+    assert 3.0 == c.request('dust', port='/dev/ttySIM')['pm25']
+    assert 0 == c.request('sleep', port='/dev/ttySIM')
+
+
+def test_errors(daemon):
+    c = DaemonClient(daemon.path)
+    with pytest.raises(DaemonError):
+        c.request('dust', port='/dev/ttyOTHER')
+    with pytest.raises(DaemonError):
+        c.request('reboot', port='/dev/ttySIM')
+
+
+def test_already_running(daemon):
+    other = SDS011Daemon([], logging.getLogger("SDS011"), path=daemon.path)
+    with pytest.raises(DaemonError):
+        other.start()
+
+
+def test_socket_private(daemon):
+    assert 0o600 == stat.S_IMODE(os.stat(daemon.path).st_mode)
+
+
+def test_fallback_socket_dir(tmp_path, monkeypatch):
+    '''
+    Without XDG_RUNTIME_DIR the socket is in a directory private to the user
+    '''
+    monkeypatch.delenv('XDG_RUNTIME_DIR', raising=False)
+    monkeypatch.setattr('pysds011.daemon.FALLBACK_DIR', str(tmp_path / 'run-%d'))
+    d = SDS011Daemon([], logging.getLogger("SDS011"))
+    assert os.path.dirname(d.path) == str(tmp_path / ('run-%d' % os.getuid()))
+    d.start()
+    d.stop()
+    assert 0o700 == stat.S_IMODE(os.stat(os.path.dirname(d.path)).st_mode)
+
+    os.chmod(os.path.dirname(d.path), 0o755)
+    with pytest.raises(DaemonError):
+        d.start()
+
+
+def test_warmup_after_wake(mocker):
+    '''
+    A sensor is warmed up each time it is woken up, readings of an awake one are not delayed
+    '''
+    sim = SimulatedSDS011(series=[(1.0, 2.0), (3.0, 4.0)], mode=1)
+    p = SensorPort(sim, logging.getLogger("SDS011"), [b'\x12\x34'], warmup=20)
+    warmup = mocker.patch.object(p.sd, 'wait_warmup', side_effect=lambda max_time, id: p.sd.cmd_query_data(id=id))
+
+    p.open()
+    warmup.assert_called_once_with(max_time=20, id=b'\x12\x34')
+    assert 1.0 == p.readings[b'\x12\x34']['pm25']
+
+    assert 3.0 == p.dust(b'\x12\x34', max_age=-1)['pm25']
+    assert 1 == warmup.call_count
+
+    assert p.sd.cmd_set_sleep(1, id=b'\x12\x34')
+    p.dust(b'\x12\x34', max_age=60)
+    assert 2 == warmup.call_count
+    p.close()
+
+
+def test_dust_sleeping_sensor(tmp_path, mocker):
+    '''
+    A client waits the warm up of a sleeping sensor, longer than its own timeout
+    '''
+    sim = SimulatedSDS011(series=[(1.0, 2.0), (3.0, 4.0)], mode=1)
+    sim.port = '/dev/ttySIM'
+    d = SDS011Daemon([(sim, [b'\xff\xff'])], logging.getLogger("SDS011"), path=str(tmp_path / 's.sock'),
+                     refresh=60.0, warmup=1.0)
+    d.start()
+    try:
+        p = d.ports['/dev/ttySIM']
+        mocker.patch.object(p.sd, 'wait_warmup',
+                            side_effect=lambda max_time, id: time.sleep(max_time) or p.sd.cmd_query_data(id=id))
+        c = DaemonClient(d.path, timeout=0.5)
+        assert c.request('sleep', port='/dev/ttySIM', value=1) is True
+        assert 1.0 == c.warmup('/dev/ttySIM')
+        assert c.request('dust', port='/dev/ttySIM') is not None
+    finally:
+        d.stop()
@@ -1,26 +1,51 @@
 from pysds011.driver import SDS011
+from pysds011.driver import FrameReader
+from pysds011.driver import build_command
+from pysds011.driver import get_command
+from pysds011.driver import Measurement
+from pysds011.driver import process_data
+from pysds011.metrics import DriverMetrics
+from pysds011.sim import SimulatedSDS011
 import logging
+import json
+import pytest
 
 
 class SerialMock(object):
     def __init__(self):
         self.__write_reg = list()
         self.__read_reg = list()
+        self.read_sizes = list()
+        self.timeouts = list()
         self.timeout = 0
 
     def write(self, data):
         self.__write_reg.append(data)
 
     def read(self, size):
+        # each programmed chunk simulates bytes arrived before the timeout:
+        # a read never returns more than one chunk and
+        # never more than the requested size
+        self.timeouts.append(self.timeout)
         if self.__read_reg:
-            frame = self.__read_reg.pop(0)
-            assert size == frame['size']
-            return frame['data']
+            chunk = self.__read_reg.pop(0)
+            self.read_sizes.append(size)
+            if chunk['size'] is not None:
+                assert size == chunk['size']
+            data = chunk['data']
+            if len(data) > size:
+                self.__read_reg.insert(0, {'size': None, 'data': data[size:]})
+            return data[:size]
         else:
             return None
 
-    def test_expect_read(self, data):
-        self.__read_reg.append({'size': len(data), 'data': data})
+    def test_expect_read(self, data, size=None):
+        """
+        Program the bytes returned by the next read
+
+        :param size: size that the read has to request, defaults to None that is 'any'
+        """
+        self.__read_reg.append({'size': size, 'data': data})
 
     def test_get_write(self):
         return self.__write_reg
@@ -70,10 +95,10 @@ def test_cmd_set_mode():
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
     # this is to simulate sensor response
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x02\x01\x00\x00'
     SENSOR_ID_RSP = b'\xab\xcd'  # simulate that sensor response come from sensor with ABCD id
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -108,11 +133,11 @@ def test_cmd_set_mode_sensornotapplied():
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
     # this is to simulate sensor response
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     # driver set 0 but sensor replay 1 (3rd byte)
     DATA_RSP = b'\x02\x01\x01\x00'
     SENSOR_ID_RSP = b'\xab\xcd'  # simulate that sensor response come from sensor with ABCD id
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -147,11 +172,11 @@ def test_cmd_set_mode_docexample():
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
     # this is to simulate sensor response
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     # driver set 0 but sensor replay 1 (3rd byte)
     DATA_RSP = b'\x02\x01\x01\x00'
     SENSOR_ID_RSP = SENSOR_ID
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -183,10 +208,10 @@ def test_cmd_get_mode_active():
     SENSOR_ID = b'\xff\xff'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x02\x00\x00\x00'
     SENSOR_ID_RSP = b'\xab\xcd'  # simulate that sensor response come from sensor with ABCD id
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -217,10 +242,10 @@ def test_cmd_get_mode_specific_id():
     SENSOR_ID = b'\xab\xcd'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x02\x00\x00\x00'
     SENSOR_ID_RSP = b'\xab\xcd'  # simulate that sensor response come from sensor with ABCD id
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -251,10 +276,10 @@ def test_cmd_get_mode_query():
     SENSOR_ID = b'\xff\xff'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x02\x00\x01\x00'
     SENSOR_ID_RSP = b'\xab\xcd'  # simulate that sensor response come from sensor with ABCD id
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -288,10 +313,10 @@ def test_cmd_set_sleep():
     SENSOR_ID = b'\xff\xff'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x06\x01\x00\x00'
     SENSOR_ID_RSP = b'\xab\xcd'
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -326,11 +351,11 @@ def test_cmd_set_sleep_docexample1():
     SENSOR_ID = b'\xa1\x60'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
 
     DATA_RSP = b'\x06\x01\x00\x00'
     SENSOR_ID_RSP = SENSOR_ID
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -364,11 +389,11 @@ def test_cmd_set_sleep_docexample2():
     SENSOR_ID = b'\xa1\x60'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
 
     DATA_RSP = b'\x06\x01\x01\x00'
     SENSOR_ID_RSP = SENSOR_ID
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -399,10 +424,10 @@ def test_cmd_set_sleep_wakeup():
     SENSOR_ID = b'\xff\xff'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x06\x01\x01\x00'
     SENSOR_ID_RSP = b'\xab\xcd'
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -440,10 +465,10 @@ def test_cmd_set_sleep_read_delayed():
     sm.test_expect_read(b'\xff')
     sm.test_expect_read(b'\xff')
     sm.test_expect_read(b'\xff')
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x06\x01\x00\x00'
     SENSOR_ID_RSP = b'\xab\xcd'
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     d = SDS011(sm, log)
     assert d.cmd_set_sleep()
@@ -480,7 +505,7 @@ def test_cmd_set_sleep_get_only_head():
     SENSOR_ID = b'\xff\xff'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
 
     d = SDS011(sm, log)
     assert d.cmd_set_sleep() is False
@@ -497,11 +522,11 @@ def test_cmd_set_sleep_wrong_checksum():
     """
     log = logging.getLogger("SDS011")
     sm = SerialMock()
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x06\x01\x00\x00'
     SENSOR_ID_RSP = b'\xab\xcd'
     CHECKSUM_RSP = bytes([sum(DATA_RSP) % 256 + 1])
-    sm.test_expect_read(RSP_ID+DATA_RSP+SENSOR_ID_RSP+CHECKSUM_RSP+TAIL)
+    sm.test_expect_read(RSP_ID+DATA_RSP+SENSOR_ID_RSP+CHECKSUM_RSP+TAIL, size=9)
     d = SDS011(sm, log)
     assert d.cmd_set_sleep() is False
 
@@ -519,11 +544,11 @@ def test_cmd_get_sleep_sleepingsensor():
     DATA = b'\x06\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
     SENSOR_ID = b'\xff\xff'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
 
     DATA_RSP = b'\x06\x00\x00\x00'
     SENSOR_ID_RSP = b'\xab\xcd'
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
     d = SDS011(sm, log)
     assert d.cmd_get_sleep()
 
@@ -546,11 +571,11 @@ def test_cmd_get_sleep_specific_id():
     DATA = b'\x06\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
     SENSOR_ID = b'\xab\xcd'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
 
     DATA_RSP = b'\x06\x00\x00\x00'
     SENSOR_ID_RSP = b'\xab\xcd'
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
     d = SDS011(sm, log)
     assert d.cmd_get_sleep(id=SENSOR_ID)
 
@@ -573,10 +598,10 @@ def test_cmd_get_sleep_awakesensor():
     SENSOR_ID = b'\xff\xff'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x06\x00\x01\x00'
     SENSOR_ID_RSP = b'\xab\xcd'
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
     d = SDS011(sm, log)
     assert d.cmd_get_sleep() is False
 
@@ -609,10 +634,10 @@ def test_cmd_get_sleep_invalid():
     log = logging.getLogger("SDS011")
     sm = SerialMock()
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x06\x00\x02\x00'  # 2 is not valid status
     SENSOR_ID_RSP = b'\xab\xcd'
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
     d = SDS011(sm, log)
     assert d.cmd_get_sleep() is None
 
@@ -631,10 +656,10 @@ def test_cmd_query_data():
     SENSOR_ID = b'\xff\xff'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\xd4\x04\x3a\x0a'
     SENSOR_ID_RSP = b'\xab\xcd'  # simulate that sensor response come from sensor with ABCD id
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP, rsp=b'\xc0'))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP, rsp=b'\xc0'), size=9)
 
     ##################
     #   TEST EXEC
@@ -669,10 +694,10 @@ def test_cmd_query_data_fromaspecificsensor():
     SENSOR_ID = b'\xAB\xCD'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\xd4\x04\x3a\x0a'
     SENSOR_ID_RSP = SENSOR_ID
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP, rsp=b'\xc0'))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP, rsp=b'\xc0'), size=9)
 
     ##################
     #   TEST EXEC
@@ -709,10 +734,10 @@ def test_cmd_set_device_id():
     SENSOR_ID = b'\xab\xcd'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x05\x00\x00\x00'
     SENSOR_ID_RSP = NEW_ID
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -746,10 +771,10 @@ def test_cmd_set_device_id_wrongidinreplay():
     SENSOR_ID = b'\xab\xcd'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x05\x00\x00\x00'
     SENSOR_ID_RSP = b'\xdd\xdd'
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -783,10 +808,10 @@ def test_cmd_set_device_id_wrongchecksum():
     SENSOR_ID = b'\xab\xcd'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x05\x00\x00\x00' + NEW_ID
     CHECKSUM_RSP = bytes([sum(DATA_RSP) % 256 + 1])
-    sm.test_expect_read(RSP_ID+DATA_RSP+CHECKSUM_RSP+TAIL)
+    sm.test_expect_read(RSP_ID+DATA_RSP+CHECKSUM_RSP+TAIL, size=9)
 
     ##################
     #   TEST EXEC
@@ -819,10 +844,10 @@ def test_cmd_set_device_id_docexample():
     SENSOR_ID = b'\xa1\x60'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x05\x00\x00\x00'
     SENSOR_ID_RSP = NEW_ID
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -853,10 +878,10 @@ def test_cmd_set_working_period_continuous():
     SENSOR_ID = b'\xff\xff'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x08\x01\x00\x00'
     SENSOR_ID_RSP = b'\xAB\xCD'
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -888,10 +913,10 @@ def test_cmd_set_working_period_maxnallowed():
     SENSOR_ID = b'\xff\xff'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x08\x01\x1e\x00'
     SENSOR_ID_RSP = b'\xAB\xCD'
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -946,10 +971,10 @@ def test_cmd_set_working_period_docexample():
     SENSOR_ID = b'\xa1\x60'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x08\x01\x01\x00'
     SENSOR_ID_RSP = SENSOR_ID
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -980,10 +1005,10 @@ def test_cmd_get_working_period():
     SENSOR_ID = b'\xff\xff'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x08\x00\x00\x00'
     SENSOR_ID_RSP = b'\xAB\xCD'
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -1015,10 +1040,10 @@ def test_cmd_get_working_period_docexample():
     SENSOR_ID = b'\xa1\x60'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x08\x00\x02\x00'
     SENSOR_ID_RSP = SENSOR_ID
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -1049,10 +1074,10 @@ def test_cmd_get_firmware_version():
     SENSOR_ID = b'\xff\xff'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x07\x01\x02\x03'
     SENSOR_ID_RSP = b'\xAB\xCD'
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -1091,10 +1116,10 @@ def test_cmd_get_firmware_version_docexample():
     SENSOR_ID = b'\xA1\x60'
     EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
 
-    sm.test_expect_read(HEAD)
+    sm.test_expect_read(HEAD, size=10)
     DATA_RSP = b'\x07\x0f\x07\x0a'
     SENSOR_ID_RSP = SENSOR_ID
-    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP))
+    sm.test_expect_read(compose_response(DATA_RSP + SENSOR_ID_RSP), size=9)
 
     ##################
     #   TEST EXEC
@@ -1116,3 +1141,450 @@ def test_cmd_get_firmware_version_docexample():
     assert 'day' in res.keys()
     assert 10 == res['day']
     assert 'pretty' in res.keys()
+
+
+def test_frame_reader_one_read_per_frame():
+    """
+    A frame that is already complete in the serial buffer
+    is read with a single call
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    FRAME = HEAD + compose_response(b'\x06\x01\x00\x00\xab\xcd')
+    sm.test_expect_read(FRAME)
+
+    r = FrameReader(sm, log)
+    assert FRAME == r.read_frame()
+    assert [10] == sm.read_sizes
+
+
+def test_frame_reader_keep_leftover():
+    """
+    Bytes received after a complete frame
+    are kept for the next call
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    FRAME1 = HEAD + compose_response(b'\x06\x01\x00\x00\xab\xcd')
+    FRAME2 = HEAD + compose_response(b'\x02\x01\x01\x00\xab\xcd')
+    sm.test_expect_read(b'\xff\xff' + FRAME1 + FRAME2)
+    sm.in_waiting = 22
+
+    r = FrameReader(sm, log)
+    assert FRAME1 == r.read_frame()
+    assert FRAME2 == r.read_frame()
+    assert [22] == sm.read_sizes
+
+
+def test_frame_reader_garbage_before_head():
+    """
+    Not HEAD bytes in front of the frame are discarded
+    and only the missing part of the frame is read
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    FRAME = HEAD + compose_response(b'\x06\x01\x00\x00\xab\xcd')
+    sm.test_expect_read(b'\x01\x02\x03' + FRAME)
+
+    r = FrameReader(sm, log)
+    assert FRAME == r.read_frame()
+    assert [10, 3] == sm.read_sizes
+
+
+def test_frame_reader_false_head():
+    """
+    A noise HEAD in front of a frame is dropped alone, the frame is recovered
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    FRAME = HEAD + compose_response(b'\x06\x01\x00\x00\xab\xcd')
+    sm.test_expect_read(b'\xaa' + FRAME[:5])
+    sm.test_expect_read(FRAME[5:])
+
+    metrics = DriverMetrics()
+    r = FrameReader(sm, log)
+    r.metrics = metrics
+    assert FRAME == r.read_frame()
+    assert 1 == r.skipped
+    assert 1 == r.corrupted
+    assert 1 == metrics.totals()['skipped']
+
+
+def test_frame_reader_resync_after_checksum():
+    """
+    Bytes after a corrupted frame are scanned again for a valid one
+    """
+    log = logging.getLogger("SDS011")
+    FRAME = HEAD + compose_response(b'\x06\x01\x00\x00\xab\xcd')
+    BAD = HEAD + RSP_ID + b'\x06\xaa' + FRAME[:6]
+
+    r = FrameReader(SerialMock(), log)
+    r.metrics = DriverMetrics()
+    r.feed(BAD + FRAME)
+    assert FRAME == r.pop_frame()
+    assert b'' == r.buffer
+    assert 1 <= r.metrics.totals()['checksum']
+
+
+def test_frame_reader_corrupted_recover():
+    """
+    A valid frame arriving right after a corrupted one is recovered
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    FRAME = HEAD + compose_response(b'\x06\x01\x00\x00\xab\xcd')
+    sm.test_expect_read(FRAME[:-1] + b'\x00')
+    sm.test_expect_read(FRAME)
+
+    r = FrameReader(sm, log)
+    assert FRAME == r.read_frame()
+    assert 1 == r.corrupted
+    assert [5.0, r.resync_wait] == sm.timeouts
+
+
+def test_frame_reader_corrupted_no_wait():
+    """
+    Reading stops after resync_wait, not after the timeout, if the only reply is corrupted
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    FRAME = HEAD + compose_response(b'\x06\x01\x00\x00\xab\xcd')
+    sm.test_expect_read(FRAME[:-1] + b'\x00')
+
+    r = FrameReader(sm, log)
+    assert r.read_frame() is None
+    assert [5.0, r.resync_wait] == sm.timeouts
+
+
+def test_frame_reader_restore_timeout():
+    """
+    Serial timeout is changed only while reading
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    sm.timeout = 1.0
+
+    r = FrameReader(sm, log)
+    assert r.read_frame() is None
+    assert 1.0 == sm.timeout
+
+
+def test_cmd_set_mode_skip_active_data():
+    """
+    Test set data reporting mode when the sensor, in active mode,
+    push a measurement before the reply
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    sm.test_expect_read(HEAD + compose_response(b'\xd4\x04\x3a\x0a\xab\xcd', rsp=b'\xc0'))
+    sm.test_expect_read(HEAD + compose_response(b'\x02\x01\x01\x00\xab\xcd'))
+
+    d = SDS011(sm, log)
+    assert d.cmd_set_mode(1)
+
+
+def test_stream():
+    """
+    Test active mode stream: the driver only sends
+    the set mode command and then get all the pushed data
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+
+    DATA = b'\x02\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    SENSOR_ID = b'\xff\xff'
+    EXPECTED_DRIVER_WRITE = compose_write(DATA, SENSOR_ID)
+
+    sm.test_expect_read(HEAD + compose_response(b'\x02\x01\x00\x00\xab\xcd'))
+    for pm in range(3):
+        sm.test_expect_read(HEAD + compose_response(bytes([pm, 0, 2*pm, 0]) + b'\xab\xcd', rsp=b'\xc0'))
+
+    d = SDS011(sm, log)
+    res = list(d.stream(count=3, period=0))
+
+    production_code_write_to_sensor = sm.test_get_write()
+    assert 1 == len(production_code_write_to_sensor)
+    assert EXPECTED_DRIVER_WRITE == production_code_write_to_sensor[0]
+    assert [0.0, 0.1, 0.2] == [r['pm25'] for r in res]
+    assert [0.0, 0.2, 0.4] == [r['pm10'] for r in res]
+
+
+def test_stream_specific_id():
+    """
+    Test active mode stream, data from other sensors are discarded
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    SENSOR_ID = b'\xab\xcd'
+
+    sm.test_expect_read(HEAD + compose_response(b'\x02\x01\x00\x00' + SENSOR_ID))
+    sm.test_expect_read(HEAD + compose_response(b'\x01\x00\x01\x00\x12\x34', rsp=b'\xc0'))
+    sm.test_expect_read(HEAD + compose_response(b'\x02\x00\x02\x00' + SENSOR_ID, rsp=b'\xc0'))
+
+    d = SDS011(sm, log)
+    res = list(d.stream(id=SENSOR_ID, count=1, period=0))
+
+    assert 1 == len(res)
+    assert 0.2 == res[0]['pm25']
+
+
+def test_stream_stop_on_errors():
+    """
+    Test active mode stream, the stream ends if the sensor stops to reply
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    sm.test_expect_read(HEAD + compose_response(b'\x02\x01\x00\x00\xab\xcd'))
+    sm.test_expect_read(HEAD + compose_response(b'\x01\x00\x01\x00\xab\xcd', rsp=b'\xc0'))
+
+    d = SDS011(sm, log)
+    res = list(d.stream(period=0))
+
+    assert 1 == len(res)
+
+
+def test_stream_working_period():
+    """
+    Test active mode stream with a working period: the period is asked to the sensor
+    and a report is waited for up to the period plus the read timeout
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    sm.test_expect_read(HEAD + compose_response(b'\x08\x00\x02\x00\xab\xcd'))
+    sm.test_expect_read(HEAD + compose_response(b'\x02\x01\x00\x00\xab\xcd'))
+    sm.test_expect_read(HEAD + compose_response(b'\x01\x00\x01\x00\xab\xcd', rsp=b'\xc0'))
+
+    d = SDS011(sm, log)
+    res = list(d.stream(count=1))
+
+    assert 1 == len(res)
+    assert [5.0, 5.0, 125.0] == sm.timeouts
+    assert 5.0 == d.reader.timeout
+
+
+def test_stream_set_mode_failure():
+    """
+    Test active mode stream when the sensor does not reply to set mode
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+
+    d = SDS011(sm, log)
+    assert [] == list(d.stream())
+
+
+def test_build_command():
+    """
+    Test packet assembly, data not provided are filled with zero
+    """
+    DATA = b'\x02\x01\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    SENSOR_ID = b'\xa1\x60'
+    assert compose_write(DATA, SENSOR_ID) == build_command(2, [1, 1], SENSOR_ID)
+
+
+def test_get_command_cache():
+    """
+    Test that packets are built once and then reused
+    """
+    first = get_command(6, [1, 0], b'\x12\x34')
+    assert compose_write(b'\x06\x01' + bytes(11), b'\x12\x34') == first
+    assert first is get_command(6, (1, 0), b'\x12\x34')
+
+
+def test_state_cache_skip_set():
+    """
+    Set commands are not sent if the sensor is already known
+    to be in the requested state
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    sm.test_expect_read(HEAD + compose_response(b'\x06\x01\x01\x00\xab\xcd'))
+    sm.test_expect_read(HEAD + compose_response(b'\x02\x00\x01\x00\xab\xcd'))
+
+    d = SDS011(sm, log, cache=True)
+    assert d.cmd_set_sleep(0)
+    assert d.cmd_set_sleep(0)
+    assert 1 == d.cmd_get_mode()
+    assert d.cmd_set_mode(1)
+    assert 2 == len(sm.test_get_write())
+
+
+def test_state_cache_invalidated_on_error():
+    """
+    Known state is forgotten when the sensor does not reply
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    sm.test_expect_read(HEAD + compose_response(b'\x06\x01\x01\x00\xab\xcd'))
+
+    d = SDS011(sm, log, cache=True)
+    assert d.cmd_set_sleep(0)
+    assert d.cmd_query_data() is None
+    assert d.cmd_set_sleep(0) is False
+    assert 3 == len(sm.test_get_write())
+
+
+def test_state_cache_firmware():
+    """
+    FW version is asked to the sensor only once
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    sm.test_expect_read(HEAD + compose_response(b'\x07\x0f\x07\x0a\xab\xcd'))
+
+    d = SDS011(sm, log, cache=True)
+    assert 15 == d.cmd_firmware_ver()['year']
+    assert 15 == d.cmd_firmware_ver()['year']
+    assert 1 == len(sm.test_get_write())
+
+
+def test_state_cache_broadcast():
+    """
+    Broadcast and addressed commands invalidate each other
+    """
+    sim = SimulatedSDS011(mode=1)
+    d = SDS011(sim, logging.getLogger("SDS011"), cache=True)
+    assert d.cmd_set_sleep(1)
+    assert d.cmd_set_sleep(0, id=b'\x12\x34')
+    assert not sim.sleeping
+    assert d.cmd_set_sleep(1)
+    assert sim.sleeping
+    assert d.cmd_set_sleep(0)
+    assert d.cmd_set_mode(0, id=b'\x12\x34')
+    assert d.cmd_set_mode(1)
+    assert 1 == sim.mode
+    assert d.cmd_set_mode(0, id=b'\x12\x34')
+    assert 0 == sim.mode
+
+
+def test_state_cache_working_period(mocker):
+    """
+    A sensor with a working period sleeps on its own: its sleep state is not cached
+    """
+    sim = SimulatedSDS011(mode=1)
+    write = mocker.spy(sim, 'write')
+    d = SDS011(sim, logging.getLogger("SDS011"), cache=True)
+    assert d.cmd_set_sleep(0)
+    assert d.cmd_set_working_period(1)
+    assert 'sleep' not in d.state[b'\xff\xff']
+    assert 1 == d.cmd_get_working_period()
+    assert d.cmd_set_sleep(0)
+    writes = write.call_count
+    assert d.cmd_set_sleep(0)
+    assert writes + 1 == write.call_count
+
+
+def test_state_cache_default_disabled():
+    """
+    Cache is disabled by default
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    sm.test_expect_read(HEAD + compose_response(b'\x06\x01\x01\x00\xab\xcd'))
+    sm.test_expect_read(HEAD + compose_response(b'\x06\x01\x01\x00\xab\xcd'))
+
+    d = SDS011(sm, log)
+    assert d.cmd_set_sleep(0)
+    assert d.cmd_set_sleep(0)
+    assert 2 == len(sm.test_get_write())
+
+
+def test_state_cache_disabled():
+    """
+    Without cache all commands are sent
+    """
+    log = logging.getLogger("SDS011")
+    sm = SerialMock()
+    sm.test_expect_read(HEAD + compose_response(b'\x06\x01\x01\x00\xab\xcd'))
+    sm.test_expect_read(HEAD + compose_response(b'\x06\x01\x01\x00\xab\xcd'))
+
+    d = SDS011(sm, log, cache=False)
+    assert d.cmd_set_sleep(0)
+    assert d.cmd_set_sleep(0)
+    assert 2 == len(sm.test_get_write())
+
+
+def test_wait_warmup_converged(mocker):
+    """
+    Warm up ends as soon as readings are stable
+    """
+    mocker.patch('time.monotonic', side_effect=range(100))
+    sleep = mocker.patch('time.sleep')
+    cqd = mocker.patch('pysds011.driver.SDS011.cmd_query_data')
+    cqd.side_effect = [{'pm25': v, 'pm10': 2*v} for v in (20.0, 12.0, 10.5, 10.0, 10.2, 30.0)]
+
+    d = SDS011(None, logging.getLogger("SDS011"))
+    res = d.wait_warmup(max_time=30, tolerance=1.0)
+
+    assert 10.2 == res['pm25']
+    assert 5 == cqd.call_count
+    assert 4 == sleep.call_count
+
+
+def test_wait_warmup_max_time(mocker):
+    """
+    Warm up does not last more than max_time,
+    the last reading is returned also if not stable
+    """
+    mocker.patch('time.monotonic', side_effect=range(100))
+    mocker.patch('time.sleep')
+    cqd = mocker.patch('pysds011.driver.SDS011.cmd_query_data')
+    cqd.side_effect = [{'pm25': v, 'pm10': v} for v in (20.0, 15.0, 10.0, 5.0, 1.0)]
+
+    d = SDS011(None, logging.getLogger("SDS011"))
+    res = d.wait_warmup(max_time=3)
+
+    # fake clock moves 1sec each reading
+    assert 10.0 == res['pm25']
+    assert 3 == cqd.call_count
+
+
+def test_process_data_measurement():
+    """
+    Decoded data is a Measurement with sensor id and timestamp
+    """
+    pm = process_data(HEAD + compose_response(b'\xd4\x04\x3a\x0a\xab\xcd', rsp=b'\xc0'), logging.getLogger("SDS011"))
+    assert isinstance(pm, Measurement)
+    assert 123.6 == pm.pm25
+    assert 261.8 == pm.pm10
+    assert b'\xab\xcd' == pm.id
+    assert pm.timestamp is not None
+
+
+def test_measurement_dict_compatibility():
+    """
+    Measurement keeps working as the old dust data dictionary
+    """
+    pm = Measurement(1.5, 2.5, b'\xab\xcd', 100.0)
+    assert 1.5 == pm['pm25']
+    assert 2.5 == pm['pm10']
+    assert 'PM 2.5: 1.5 μg/m^3  PM 10: 2.5 μg/m^3' == pm['pretty']
+    assert ['pm25', 'pm10', 'pretty'] == list(pm.keys())
+    assert dict(pm) == pm
+    assert {'pm25': 1.5, 'pm10': 2.5, 'pretty': pm.pretty} == json.loads(json.dumps(pm._asdict()))
+    with pytest.raises(KeyError):
+        pm['id']
+
+
+def test_measurement_eq_hash():
+    """
+    Readings are equal only if taken by the same sensor at the same time
+    """
+    pm = Measurement(1.5, 2.5, b'\xab\xcd', 100.0)
+    assert Measurement(1.5, 2.5, b'\xab\xcd', 100.0) == pm
+    assert Measurement(1.5, 2.5, b'\xab\xce', 100.0) != pm
+    assert Measurement(1.5, 2.5, b'\xab\xcd', 101.0) != pm
+    assert 1 == len({pm, Measurement(1.5, 2.5, b'\xab\xcd', 100.0)})
+    assert {'pm25': 1.5, 'pm10': 2.5, 'pretty': pm.pretty} == pm
+
+
+def test_measurement_immutable():
+    """
+    Measurement fields cannot be changed or added
+    """
+    pm = Measurement(1.5, 2.5)
+    with pytest.raises(AttributeError):
+        pm.pm25 = 3.0
+    with pytest.raises(AttributeError):
+        pm.other = 3.0
+    assert not hasattr(pm, '__dict__')
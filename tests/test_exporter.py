@@ -0,0 +1,71 @@
+from pysds011.driver import Measurement
+from pysds011.exporter import MetricsCache
+from pysds011.exporter import SDS011Exporter
+from pysds011.sim import SimulatedSDS011
+import logging
+import time
+import urllib.error
+import urllib.request
+import pytest
+
+
+def test_cache_render():
+    cache = MetricsCache()
+    cache.register('/dev/ttyUSB0', b'\xab\xcd')
+    text = cache.render().decode('utf-8')
+    assert 'sds011_samples_total{port="/dev/ttyUSB0",id="abcd"} 0' in text
+    assert 'sds011_pm25_ugm3{' not in text
+
+    failures = {'checksum': 2, 'timeout': 0}
+    cache.update('/dev/ttyUSB0', b'\xab\xcd', Measurement(1.5, 2.5, b'\xab\xcd', 100.0), failures)
+    cache.update('/dev/ttyUSB0', b'\xab\xcd', None, failures)
+    text = cache.render(now=110.0).decode('utf-8')
+
+    assert '# TYPE sds011_pm25_ugm3 gauge' in text
+    assert 'sds011_pm25_ugm3{port="/dev/ttyUSB0",id="abcd"} 1.5' in text
+    assert 'sds011_pm10_ugm3{port="/dev/ttyUSB0",id="abcd"} 2.5' in text
+    assert 'sds011_samples_total{port="/dev/ttyUSB0",id="abcd"} 1' in text
+    assert 'sds011_read_errors_total{port="/dev/ttyUSB0",id="abcd"} 1' in text
+    assert 'sds011_checksum_errors_total{port="/dev/ttyUSB0",id="abcd"} 2' in text
+    assert 'sds011_timeouts_total{port="/dev/ttyUSB0",id="abcd"} 0' in text
+    assert 'sds011_sample_age_seconds{port="/dev/ttyUSB0",id="abcd"} 10.000' in text
+
+
+def test_cache_escape_labels():
+    cache = MetricsCache()
+    cache.register('a"b\\c', b'\x00\x01')
+    assert b'{port="a\\"b\\\\c",id="0001"}' in cache.render()
+
+
+@pytest.fixture
+def exporter():
+    sim = SimulatedSDS011(series=[(1.0, 2.0), (3.0, 4.0)], mode=1)
+    sim.port = '/dev/ttySIM'
+    e = SDS011Exporter([(sim, [b'\x12\x34'])], logging.getLogger("SDS011"), address=('localhost', 0),
+                       interval=0.05, warmup=0)
+    e.start()
+    yield e
+    e.stop()
+
+
+def test_serve_metrics(exporter):
+    deadline = time.monotonic() + 5.0
+    while 0 == exporter.cache.entries['/dev/ttySIM', b'\x12\x34']['samples'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    url = 'http://localhost:%d/metrics' % exporter.server.server_address[1]
+
+    with urllib.request.urlopen(url) as r:
+        assert r.headers['Content-Type'].startswith('text/plain')
+        text = r.read().decode('utf-8')
+
+    assert 'sds011_pm25_ugm3{port="/dev/ttySIM",id="1234"} 1.0' in text
+    assert 'sds011_sample_age_seconds{port="/dev/ttySIM",id="1234"}' in text
+    with pytest.raises(urllib.error.HTTPError):
+        urllib.request.urlopen(url.replace('metrics', 'other'))
+
+
+def test_stop_sleeps_sensors(exporter):
+    sim = exporter.ports[0][0]
+    exporter.stop()
+    assert sim.sleeping
+    assert not sim.is_open
@@ -0,0 +1,49 @@
+import subprocess
+import sys
+
+# cumulative import time of pysds011.cli over the one of the libraries it needs to parse the command line,
+# measured about 1.3: a budget relative to them does not depend on the speed of the machine
+IMPORT_BUDGET_RATIO = 2.0
+COMMAND_LINE_MODULES = ['click', 'click_log']
+# modules that only some subcommands need
+LAZY_MODULES = ['serial', 'json', 'socketserver', 'concurrent.futures',
+                'pysds011.driver', 'pysds011.capture', 'pysds011.daemon', 'pysds011.fleet', 'pysds011.session',
+                'pysds011.aggregate', 'pysds011.exporter', 'http.server']
+
+
+def import_times(module):
+    '''
+    Import a module in a new interpreter
+
+    :return: cumulative import time in us by imported module
+    :rtype: dict
+    '''
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                         stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = dict()
+    for line in res.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_cli_lazy_imports():
+    '''
+    Heavy modules are not imported just to parse the command line
+    '''
+    times = import_times('pysds011.cli')
+    assert 'pysds011.cli' in times
+    assert [] == [m for m in LAZY_MODULES if m in times]
+
+
+def test_cli_import_budget():
+    '''
+    Import time of the command line app, best of some runs, see also benchmarks/run.py cli_import
+    '''
+    ratios = list()
+    for _ in range(3):
+        times = import_times('pysds011.cli')
+        ratios.append(times['pysds011.cli'] / sum(times[m] for m in COMMAND_LINE_MODULES))
+    assert min(ratios) < IMPORT_BUDGET_RATIO
@@ -0,0 +1,143 @@
+from pysds011.bus import SDS011Bus
+from pysds011.driver import CMD_QUERY_DATA
+from pysds011.driver import SDS011
+from pysds011.metrics import DriverMetrics
+from pysds011.sim import SimulatedSDS011
+import json
+import logging
+
+
+def test_latency_histogram():
+    metrics = DriverMetrics(buckets=(0.01, 0.1))
+    for latency in (0.001, 0.01, 0.05, 3.0):
+        metrics.request(CMD_QUERY_DATA, b'\xab\xcd')
+        metrics.reply(CMD_QUERY_DATA, b'\xab\xcd', latency)
+    metrics.reply(CMD_QUERY_DATA, b'\xab\xcd', 5.0, ok=False)
+
+    stats = metrics.snapshot()['query_data']['abcd']
+    assert 4 == stats['requests']
+    assert 4 == stats['replies']
+    assert 1 == stats['failures']
+    assert {'0.01': 2, '0.1': 3, '+Inf': 4} == stats['latency']['buckets']
+    assert 4 == stats['latency']['count']
+    assert 3.061 == round(stats['latency']['sum'], 3)
+
+
+def test_driver_requests():
+    '''
+    Each command is recorded with the sensor it is sent to
+    '''
+    metrics = DriverMetrics()
+    sd = SDS011(SimulatedSDS011(mode=1), logging.getLogger("SDS011"), metrics=metrics)
+    for _ in range(3):
+        assert sd.cmd_query_data(id=b'\x12\x34') is not None
+    assert sd.cmd_firmware_ver() is not None
+
+    snap = metrics.snapshot()
+    assert 3 == snap['query_data']['1234']['requests']
+    assert 3 == snap['query_data']['1234']['replies']
+    assert 3 == snap['query_data']['1234']['latency']['count']
+    assert 1 == snap['firmware']['ffff']['replies']
+    assert 0 == metrics.totals(b'\x12\x34')['failures']
+    # JSON friendly
+    assert snap == json.loads(json.dumps(snap))
+
+
+def test_driver_failures():
+    '''
+    Corrupted replies are counted per kind
+    '''
+    metrics = DriverMetrics()
+    sim = SimulatedSDS011(mode=1, bad_checksum_rate=1.0)
+    sim.timeout = 0.1
+    sd = SDS011(sim, logging.getLogger("SDS011"), metrics=metrics)
+    sd.reader.timeout = 0.1
+
+    assert sd.cmd_query_data() is None
+
+    stats = metrics.snapshot()['query_data']['ffff']
+    assert 1 == stats['requests']
+    assert 1 == stats['checksum']
+    assert 1 == stats['failures']
+    assert 0 == stats['replies']
+
+
+def test_driver_wrong_checksum():
+    '''
+    A set command with a corrupted reply is a failure
+    '''
+    metrics = DriverMetrics()
+    sim = SimulatedSDS011(mode=1, bad_checksum_rate=1.0)
+    sd = SDS011(sim, logging.getLogger("SDS011"), metrics=metrics)
+    sd.reader.timeout = 0.1
+
+    assert sd.cmd_set_sleep() is False
+
+    stats = metrics.snapshot()['sleep']['ffff']
+    assert 1 == stats['requests']
+    assert 1 == stats['checksum']
+    assert 1 == stats['failures']
+
+
+def test_driver_not_read_reply():
+    '''
+    Setting the working period does not read the reply, so it is not recorded
+    '''
+    metrics = DriverMetrics()
+    sd = SDS011(SimulatedSDS011(mode=1), logging.getLogger("SDS011"), metrics=metrics)
+
+    assert sd.cmd_set_working_period(1, id=b'\x12\x34')
+
+    assert {} == metrics.snapshot()
+
+
+def test_driver_set_id():
+    '''
+    Setting the id is recorded under the new id, the reply comes from it
+    '''
+    metrics = DriverMetrics()
+    sd = SDS011(SimulatedSDS011(mode=1), logging.getLogger("SDS011"), metrics=metrics)
+
+    assert sd.cmd_set_id(b'\x12\x34', b'\xab\xcd')
+
+    stats = metrics.snapshot()['device_id']
+    assert ['abcd'] == list(stats)
+    assert 1 == stats['abcd']['requests']
+    assert 1 == stats['abcd']['replies']
+
+
+def test_driver_stream():
+    '''
+    Pushed frames are not replies, only the mode request is recorded
+    '''
+    metrics = DriverMetrics()
+    sim = SimulatedSDS011(mode=1, active_interval=0.01)
+    sd = SDS011(sim, logging.getLogger("SDS011"), metrics=metrics)
+
+    assert 3 == len(list(sd.stream(count=3, period=0)))
+
+    snap = metrics.snapshot()
+    assert ['mode'] == list(snap)
+    assert 1 == snap['mode']['ffff']['replies']
+    assert 0 == metrics.totals()['failures']
+
+
+def test_bus_poll():
+    metrics = DriverMetrics()
+    bus = SDS011Bus(SimulatedSDS011(mode=1), logging.getLogger("SDS011"), metrics=metrics)
+    bus.reader.timeout = 0.1
+
+    bus.poll([b'\x12\x34', b'\x00\x01'])
+
+    assert 1 == metrics.totals(b'\x12\x34')['replies']
+    assert 1 == metrics.totals(b'\x00\x01')['failures']
+    assert 1 == metrics.totals(b'\x00\x01')['timeout']
+    assert 2 == metrics.totals()['requests']
+
+
+def test_reset():
+    metrics = DriverMetrics()
+    metrics.count('skipped', None, None, 5)
+    assert 5 == metrics.snapshot()['any']['any']['skipped']
+    metrics.reset()
+    assert {} == metrics.snapshot()
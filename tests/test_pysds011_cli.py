@@ -458,3 +458,254 @@ def test_id_get(mocker):
 
     assert '12' in result.output and '34' in result.output
     assert result.exit_code == 0
+
+
+def test_fleet(mocker):
+    '''
+    Read many sensors, each on its own port
+    '''
+    pf = mocker.patch('pysds011.fleet.poll_fleet')
+    pf.return_value = [{'port': 'COM1', 'id': 'ffff', 'dust': {'pretty': 'woman'}},
+                       {'port': 'COM2', 'id': 'abcd', 'dust': {'pretty': 'man'}}]
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['fleet', '-t', 'COM1', '-t', 'COM2@abcd', '--warmup', '5'])
+
+    assert [('COM1', b'\xff\xff'), ('COM2', b'\xab\xcd')] == pf.call_args[0][0]
+    assert 5 == pf.call_args[1]['warmup']
+    assert 'COM1 ffff: woman' in result.output
+    assert 'COM2 abcd: man' in result.output
+    assert result.exit_code == 0
+
+
+def test_fleet_json_with_error(mocker):
+    '''
+    Read many sensors, one of them fails
+    '''
+    pf = mocker.patch('pysds011.fleet.poll_fleet')
+    pf.return_value = [{'port': 'COM1', 'id': 'ffff', 'dust': None},
+                       {'port': 'COM2', 'id': 'ffff', 'dust': {'pm25': 1.0}}]
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['fleet', '-t', 'COM1', '-t', 'COM2', '--format', 'JSON'])
+
+    obj = json.loads(result.output.splitlines()[-1])
+    assert obj[0]['dust'] is None
+    assert 1.0 == obj[1]['dust']['pm25']
+    assert result.exit_code == 1
+
+
+def test_dust_adaptive_warmup(mocker):
+    '''
+    Read dust with adaptive warm up: warmup is the max time
+    '''
+    mocker.patch('serial.Serial.open')
+    mocker.patch('serial.Serial.flushInput')
+    mocker.patch('pysds011.driver.SDS011.cmd_set_sleep').return_value = True
+    mocker.patch('pysds011.driver.SDS011.cmd_set_mode').return_value = True
+    ww = mocker.patch('pysds011.driver.SDS011.wait_warmup')
+    ww.return_value = {'pretty': 'woman'}
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['dust', '--adaptive', '--warmup', '10', '--tolerance', '0.5'])
+
+    ww.assert_called_once_with(max_time=10, tolerance=0.5, id=b'\xff\xff')
+    assert 'woman' in result.output
+    assert result.exit_code == 0
+
+
+def test_dust_samples_median(mocker):
+    '''
+    Many samples of a simulated sensor are reduced to their median
+    '''
+    from pysds011.sim import SimulatedSDS011
+
+    sim = SimulatedSDS011(series=[(1.0, 2.0), (90.0, 95.0), (3.0, 4.0)], mode=1)
+    mocker.patch('serial.Serial', return_value=sim)
+    mocker.patch('time.sleep')
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['dust', '--warmup', '0', '--samples', '3', '--reduce', 'median', '--format', 'PM2.5'])
+
+    assert result.exit_code == 0
+    assert '3.0' == result.output.splitlines()[-1]
+
+
+def test_dust_samples_reject(mocker):
+    '''
+    Spikes are discarded before averaging
+    '''
+    from pysds011.sim import SimulatedSDS011
+
+    series = [(10.0, 20.0)] * 3 + [(10.2, 20.2)] * 3 + [(500.0, 900.0)]
+    sim = SimulatedSDS011(series=series, mode=1)
+    mocker.patch('serial.Serial', return_value=sim)
+    mocker.patch('time.sleep')
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['dust', '--warmup', '0', '--samples', '7', '--reject', '3', '--format', 'JSON'])
+
+    assert result.exit_code == 0
+    obj = json.loads(result.output.splitlines()[-1])
+    assert {'pm25': 10.1, 'pm10': 20.1} == {k: obj[k] for k in ('pm25', 'pm10')}
+
+
+def test_capture(mocker, tmp_path):
+    '''
+    Capture the bytes received from a simulated sensor
+    '''
+    from pysds011.capture import CaptureReader
+    from pysds011.sim import SimulatedSDS011
+
+    sim = SimulatedSDS011(active_interval=0.01)
+    mocker.patch('serial.Serial', return_value=sim)
+    path = str(tmp_path / 'test.cap')
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['capture', '--output', path, '--count', '3'])
+
+    assert '3 measurements captured' in result.output
+    assert result.exit_code == 0
+    assert sim.sleeping
+    with CaptureReader(path) as cap:
+        assert ['/dev/ttyUSB0'] == cap.ports
+        assert 3 <= b''.join(cap.chunks()).count(b'\xaa\xc0')
+
+
+def test_monitor_zero_interval(mocker):
+    '''
+    Monitor refuses an interval that is not greater than 0
+    '''
+    sim = mocker.patch('serial.Serial')
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['monitor', '--interval', '0', '--count', '2'])
+
+    assert result.exit_code == 2
+    assert 'greater than 0' in result.output
+    sim.return_value.open.assert_not_called()
+
+
+def test_monitor_csv(mocker):
+    '''
+    Monitor a simulated sensor, one CSV line each sample
+    '''
+    from pysds011.sim import SimulatedSDS011
+
+    sim = SimulatedSDS011(series=[(1.0, 2.0), (3.0, 4.0)], mode=1)
+    mocker.patch('serial.Serial', return_value=sim)
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['monitor', '--interval', '0.01', '--warmup', '0', '--count', '2'])
+
+    assert result.exit_code == 0
+    lines = [line for line in result.output.splitlines() if '1234' in line or 'timestamp' in line]
+    assert 'timestamp,id,pm25,pm10' == lines[0]
+    assert [['1234', '1.0', '2.0'], ['1234', '3.0', '4.0']] == [line.split(',')[1:] for line in lines[1:]]
+    assert sim.sleeping
+
+
+def test_monitor_ndjson(mocker):
+    '''
+    Monitor a simulated sensor, one JSON object each sample
+    '''
+    from pysds011.sim import SimulatedSDS011
+
+    mocker.patch('serial.Serial', return_value=SimulatedSDS011())
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['monitor', '--interval', '0.01', '--warmup', '0', '--count', '3',
+                                  '--format', 'ndjson'])
+
+    assert result.exit_code == 0
+    records = [json.loads(line) for line in result.output.splitlines() if line.startswith('{')]
+    assert 3 == len(records)
+    assert {'timestamp', 'id', 'pm25', 'pm10'} == set(records[0])
+    assert 10.0 == records[0]['pm25']
+
+
+def test_daemon_forward(mocker, tmp_path):
+    '''
+    Commands on a port owned by the daemon are forwarded to it
+    '''
+    import logging
+    from pysds011.daemon import SDS011Daemon
+    from pysds011.sim import SimulatedSDS011
+
+    sim = SimulatedSDS011(mode=1)
+    sim.port = '/dev/ttyUSB0'
+    path = str(tmp_path / 's.sock')
+    d = SDS011Daemon([(sim, [b'\xff\xff'])], logging.getLogger("SDS011"), path=path)
+    d.start()
+    try:
+        so = mocker.patch('serial.Serial.open')
+        runner = CliRunner()
+        result = runner.invoke(main, ['--socket', path, 'dust', '--format', 'PM10'])
+        assert '20.0' in result.output
+        assert result.exit_code == 0
+        result = runner.invoke(main, ['--socket', path, 'id'])
+        assert '1234' in result.output
+        assert result.exit_code == 0
+        result = runner.invoke(main, ['--socket', path, 'mode'])
+        assert '1' in result.output
+        assert result.exit_code == 0
+        so.assert_not_called()
+        # other ports are not forwarded
+        runner.invoke(main, ['--socket', path, '--port', '/dev/ttyUSB1', 'sleep'])
+        so.assert_called_once_with()
+    finally:
+        d.stop()
+
+
+def test_batch(mocker):
+    '''
+    Run a script from stdin on a simulated sensor, with one wake up and one final sleep
+    '''
+    from pysds011.sim import SimulatedSDS011
+
+    sim = SimulatedSDS011(mode=0)
+    mocker.patch('serial.Serial', return_value=sim)
+    css = mocker.spy(sim, 'write')
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['batch', '-i', '1234'], input='mode 1\ndust\nfw_version\n')
+
+    assert result.exit_code == 0
+    res = [json.loads(line) for line in result.output.splitlines() if line.startswith('{')]
+    assert ['mode', 'dust', 'fw_version'] == [r['cmd'] for r in res]
+    assert all(r['ok'] for r in res)
+    assert 10.0 == res[1]['result']['pm25']
+    assert sim.sleeping
+    # wake, mode, dust, fw_version, sleep
+    assert 5 == css.call_count
+
+
+def test_batch_invalid_script(mocker):
+    '''
+    Nothing is sent to the sensor if the script is not valid
+    '''
+    so = mocker.patch('serial.Serial.open')
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['batch'], input='dust\nreboot\n')
+
+    assert result.exit_code == 1
+    so.assert_not_called()
+
+
+def test_exporter(mocker):
+    '''
+    Exporter is built with the sensors grouped by port
+    '''
+    exp = mocker.patch('pysds011.exporter.SDS011Exporter')
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['exporter', '-t', 'COM1@0001', '-t', 'COM1@0002', '-t', 'COM2',
+                                  '--http-port', '9000', '--interval', '300'])
+
+    assert result.exit_code == 0
+    ports = exp.call_args[0][0]
+    assert [('COM1', [b'\x00\x01', b'\x00\x02']), ('COM2', [b'\xff\xff'])] == [(s.port, ids) for s, ids in ports]
+    assert ('localhost', 9000) == exp.call_args[1]['address']
+    assert 300 == exp.call_args[1]['interval']
+    exp.return_value.serve_forever.assert_called_once_with()
@@ -0,0 +1,152 @@
+from pysds011.driver import Measurement
+from pysds011.rollup import DAY
+from pysds011.rollup import HOUR
+from pysds011.rollup import MINUTE
+from pysds011.rollup import RAW
+from pysds011.rollup import RawRing
+from pysds011.rollup import RollupStore
+from pysds011.rollup import SensorRollup
+import pytest
+import time
+
+# a midnight, UTC
+T0 = 100 * DAY
+
+
+def test_raw_ring_overwrites_oldest():
+    ring = RawRing(3)
+    for i in range(5):
+        ring.push(float(i), i, i)
+
+    assert 3 == len(ring)
+    assert [2.0, 3.0, 4.0] == [ring.time(i) for i in range(3)]
+    assert [3, 4] == [ring.columns[1][p] for p in ring.rows(3.0, 10.0)]
+
+
+def test_buckets():
+    '''
+    Readings are summarized in per minute buckets
+    '''
+    s = SensorRollup(raw=10)
+    for i in range(120):
+        s.push(T0 + i, i, 2 * i)
+
+    buckets = s.buckets(MINUTE)
+    assert [T0, T0 + MINUTE] == [b['start'] for b in buckets]
+    assert 60 == buckets[0]['count']
+    assert {'min': 0.0, 'max': 5.9, 'mean': 2.95} == buckets[0]['pm25']
+    assert {'min': 12.0, 'max': 23.8, 'mean': 17.9} == buckets[1]['pm10']
+    assert 1 == len(s.buckets(HOUR))
+    with pytest.raises(ValueError):
+        s.buckets(RAW)
+
+
+def test_query_coarsest():
+    '''
+    Whole buckets are summarized from the coarsest resolution, edges from the finer ones
+    '''
+    s = SensorRollup(raw=2 * HOUR)
+    for i in range(2 * HOUR):
+        s.push(T0 + i, 10, 20)
+
+    res = s.query(T0, T0 + HOUR)
+    assert HOUR == res['resolution']
+    assert HOUR == res['count']
+    assert 1.0 == res['pm25']['mean']
+
+    res = s.query(T0 + 30, T0 + HOUR + 90)
+    assert MINUTE == res['resolution']
+    assert HOUR + 60 == res['count']
+
+    res = s.query()
+    assert HOUR == res['resolution']
+    assert 2 * HOUR == res['count']
+
+
+def test_query_after_raw_eviction():
+    '''
+    Old readings are still answered by the buckets
+    '''
+    s = SensorRollup(raw=60, minutes=60)
+    for i in range(0, 3 * DAY, 10):
+        s.push(T0 + i, 10, 20)
+
+    assert 60 == len(s.raw)
+    res = s.query(T0, T0 + DAY)
+    assert DAY == res['resolution']
+    assert DAY // 10 == res['count']
+    assert 3 * DAY // 10 == s.query()['count']
+
+
+def test_query_evicted_edges():
+    '''
+    Edges older than the finer levels are taken with the whole enclosing buckets, the window is widened
+    '''
+    s = SensorRollup(raw=60, minutes=60)
+    for i in range(0, 3 * DAY, 10):
+        s.push(T0 + i, 10, 20)
+
+    res = s.query(T0 + 30 * MINUTE + 5, T0 + 2 * DAY + 90)
+    assert DAY == res['resolution']
+    assert (T0, T0 + 2 * DAY + HOUR) == (res['start'], res['end'])
+    assert (2 * DAY + HOUR) // 10 == res['count']
+
+    # older than the raw readings, within the minutes
+    res = s.query(T0 + 3 * DAY - 30 * MINUTE - 5, T0 + 3 * DAY)
+    assert MINUTE == res['resolution']
+    assert (T0 + 3 * DAY - 31 * MINUTE, T0 + 3 * DAY) == (res['start'], res['end'])
+    assert 31 * MINUTE // 10 == res['count']
+
+    # held by the raw readings, not widened
+    res = s.query(T0 + 3 * DAY - 5 * MINUTE - 5, T0 + 3 * DAY)
+    assert (T0 + 3 * DAY - 5 * MINUTE - 5, T0 + 3 * DAY) == (res['start'], res['end'])
+    assert 5 * MINUTE // 10 == res['count']
+
+
+def test_query_empty():
+    s = SensorRollup()
+    assert 0 == s.query()['count']
+    assert s.query()['pm25'] is None
+
+
+def test_old_reading():
+    s = SensorRollup()
+    s.push(T0 + 1, 1, 1)
+    with pytest.raises(ValueError):
+        s.push(T0, 1, 1)
+
+
+def test_store_memory_ceiling():
+    '''
+    Sensors that do not fit in max_bytes are dropped
+    '''
+    sizes = dict(raw=100, minutes=10, hours=10, days=10)
+    one = RollupStore(**sizes).sensor_bytes()
+    store = RollupStore(max_bytes=2 * one, **sizes)
+
+    for i in range(3):
+        assert (i < 2) == store.push(Measurement(1.0, 2.0, bytes([0, i]), T0))
+    store.extend([Measurement(1.0, 2.0, b'\x00\x00', T0 + 1), None])
+
+    assert [b'\x00\x00', b'\x00\x01'] == store.ids()
+    assert 1 == store.dropped
+    assert store.nbytes() <= store.max_bytes
+    assert 2 == store.query(b'\x00\x00')['count']
+    assert store.query(b'\x00\x02') is None
+    assert [] == store.buckets(b'\x00\x02', MINUTE)
+
+
+def test_store_no_timestamp():
+    '''
+    A reading without timestamp is taken as 'now'
+    '''
+    store = RollupStore()
+    before = time.time()
+    assert store.push(Measurement(1.0, 2.0, b'\x00\x01'))
+    _, newest = store.sensors[b'\x00\x01'].span()
+    assert before <= newest <= time.time()
+
+
+def test_store_too_small():
+    with pytest.raises(ValueError):
+        RollupStore(max_bytes=1024)
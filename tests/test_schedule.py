@@ -0,0 +1,193 @@
+from pysds011.bus import SDS011Bus
+from pysds011.driver import SDS011
+from pysds011.schedule import AWAKE
+from pysds011.schedule import PERIOD
+from pysds011.schedule import SLEEP
+from pysds011.schedule import DutyCycleScheduler
+from pysds011.schedule import choose_strategy
+from unittest.mock import call
+import logging
+import pytest
+
+
+@pytest.fixture
+def clock(mocker):
+    '''
+    Fake clock, advanced by time.sleep
+    '''
+    now = [0.0]
+    mocker.patch('time.monotonic', side_effect=lambda: now[0])
+    mocker.patch('time.sleep', side_effect=lambda t: now.__setitem__(0, now[0] + t))
+    return now
+
+
+@pytest.mark.parametrize('interval,warmup,strategy', [
+    (10, 3, AWAKE),
+    (45, 20, AWAKE),
+    (90, 10, SLEEP),
+    (300, 10, SLEEP),
+    (300, 29, PERIOD),
+    (300, 40, SLEEP),
+    (3600, 40, SLEEP),
+])
+def test_choose_strategy(interval, warmup, strategy):
+    assert strategy == choose_strategy(interval, warmup).strategy
+
+
+def test_choose_strategy_tie():
+    '''
+    On equal fan duty the strategy with fewer commands wins
+    '''
+    plan = choose_strategy(60, 29, overhead=1.0, min_sleep=30)
+    assert PERIOD == plan.strategy
+    assert 1 == plan.period
+    assert 0.5 == plan.fan_duty
+
+
+def test_plan_groups_bus():
+    '''
+    Sensors on the same bus, with the same interval and strategy, are grouped
+    '''
+    log = logging.getLogger("SDS011")
+    bus = SDS011Bus(None, log)
+    other = SDS011(None, log)
+    sched = DutyCycleScheduler(log)
+    sched.add(bus, b'\x00\x01', 120, 10)
+    sched.add(bus, b'\x00\x02', 120, 15)
+    sched.add(bus, b'\x00\x03', 20, 3)
+    sched.add(other, b'\x00\x04', 120, 10)
+
+    groups = sched.plan()
+
+    assert 3 == len(groups)
+    assert [b'\x00\x01', b'\x00\x02'] == groups[0].ids
+    assert 15 == groups[0].warmup
+    assert SLEEP == groups[0].plan.strategy
+    assert AWAKE == groups[1].plan.strategy
+    assert other is groups[2].sd
+
+
+def test_plan_final_strategy():
+    '''
+    Groups are keyed by the plan computed with their slowest sensor
+    '''
+    log = logging.getLogger("SDS011")
+    sd = SDS011(None, log)
+    sched = DutyCycleScheduler(log)
+    sched.add(sd, b'\x00\x01', 300, 10)
+    sched.add(sd, b'\x00\x02', 300, 29.5)
+    sched.add(sd, b'\x00\x03', 300, 40)
+
+    groups = sched.plan()
+
+    assert [[b'\x00\x01', b'\x00\x03'], [b'\x00\x02']] == [g.ids for g in groups]
+    assert [SLEEP, PERIOD] == [g.plan.strategy for g in groups]
+    for g in groups:
+        assert choose_strategy(g.interval, g.warmup) == g.plan
+
+
+def test_run_sleep(mocker, clock):
+    '''
+    Sleeping sensors are woken up warmup sec before each reading
+    '''
+    log = logging.getLogger("SDS011")
+    sd = SDS011(None, log)
+    css = mocker.patch.object(sd, 'cmd_set_sleep', return_value=True)
+    mocker.patch.object(sd, 'cmd_set_working_period', return_value=True)
+    mocker.patch.object(sd, 'cmd_set_mode', return_value=True)
+    mocker.patch.object(sd, 'cmd_query_data', side_effect=lambda id: clock[0])
+    sched = DutyCycleScheduler(log)
+    sched.add(sd, b'\x00\x01', 90, 10)
+
+    res = list(sched.run(count=3))
+
+    assert [(b'\x00\x01', 10.0), (b'\x00\x01', 100.0), (b'\x00\x01', 190.0)] == res
+    # configure, then wake up and sleep around each reading
+    assert [call(0, id=b'\x00\x01'), call(1, id=b'\x00\x01')] + \
+        [call(0, id=b'\x00\x01'), call(1, id=b'\x00\x01')] * 3 == css.call_args_list
+
+
+def test_run_interleaves_groups(mocker, clock):
+    '''
+    Groups with different intervals are read in time order
+    '''
+    log = logging.getLogger("SDS011")
+    sd = SDS011(None, log)
+    for cmd in ('cmd_set_sleep', 'cmd_set_working_period', 'cmd_set_mode'):
+        mocker.patch.object(sd, cmd, return_value=True)
+    mocker.patch.object(sd, 'cmd_query_data', side_effect=lambda id: clock[0])
+    sched = DutyCycleScheduler(log)
+    sched.add(sd, b'\x00\x01', 20, 3)
+    sched.add(sd, b'\x00\x02', 50, 3)
+
+    res = list(sched.run(count=3))
+
+    assert [(b'\x00\x01', 3.0), (b'\x00\x02', 3.0), (b'\x00\x01', 23.0), (b'\x00\x01', 43.0),
+            (b'\x00\x02', 53.0), (b'\x00\x02', 103.0)] == res
+
+
+def test_run_bus_poll(mocker, clock):
+    '''
+    Sensors of a group on a bus are read with a single sweep
+    '''
+    log = logging.getLogger("SDS011")
+    bus = SDS011Bus(None, log)
+    for cmd in ('cmd_set_sleep', 'cmd_set_working_period', 'cmd_set_mode'):
+        mocker.patch.object(bus, cmd, return_value=True)
+    poll = mocker.patch.object(bus, 'poll', side_effect=lambda ids: {id: 1.0 for id in ids})
+    sched = DutyCycleScheduler(log)
+    sched.add(bus, b'\x00\x01', 20, 3)
+    sched.add(bus, b'\x00\x02', 20, 3)
+
+    res = list(sched.run(count=2))
+
+    assert 4 == len(res)
+    assert [call([b'\x00\x01', b'\x00\x02'])] * 2 == poll.call_args_list
+
+
+def test_run_period_resync(mocker, clock):
+    '''
+    PERIOD reports are waited around the time given by the previous one, not by the host clock
+    '''
+    log = logging.getLogger("SDS011")
+    sd = SDS011(None, log)
+    for cmd in ('cmd_set_sleep', 'cmd_set_working_period', 'cmd_set_mode'):
+        mocker.patch.object(sd, cmd, return_value=True)
+    # the sensor clock is 1% slower
+    reports = [33.0, 336.0, 639.0]
+    waits = list()
+
+    def read_frame(cmd, id):
+        waits.append((clock[0], sd.reader.timeout))
+        clock[0] = reports[len(waits) - 1]
+        return bytes.fromhex('aac0d4043a0aabcd94ab')
+
+    mocker.patch.object(sd.reader, 'read_frame', side_effect=read_frame)
+    sched = DutyCycleScheduler(log)
+    sched.add(sd, b'\x00\x01', 300, 29.5)
+
+    res = list(sched.run(count=3))
+
+    assert [123.6] * 3 == [pm.pm25 for _, pm in res]
+    assert [(20.0, 25.0), (323.0, 25.0), (626.0, 25.0)] == waits
+    assert 5.0 == sd.reader.timeout
+
+
+def test_run_period_fallback(mocker, clock):
+    '''
+    Sensors whose working period cannot be set are queried
+    '''
+    log = logging.getLogger("SDS011")
+    sd = SDS011(None, log)
+    for cmd in ('cmd_set_sleep', 'cmd_set_mode'):
+        mocker.patch.object(sd, cmd, return_value=True)
+    mocker.patch.object(sd, 'cmd_set_working_period', side_effect=lambda period, id: 0 == period)
+    mocker.patch.object(sd, 'cmd_query_data', side_effect=lambda id: clock[0])
+    read_frame = mocker.patch.object(sd.reader, 'read_frame')
+    sched = DutyCycleScheduler(log)
+    sched.add(sd, b'\x00\x01', 300, 29.5)
+
+    res = list(sched.run(count=2))
+
+    assert [(b'\x00\x01', 29.5), (b'\x00\x01', 329.5)] == res
+    read_frame.assert_not_called()
@@ -0,0 +1,51 @@
+from pysds011.driver import Measurement
+from pysds011.series import TimeSeries
+import pytest
+
+
+def make_series(n=10):
+    ts = TimeSeries(id=b'\xab\xcd')
+    for i in range(n):
+        ts.append(Measurement(i + 0.1, i + 0.2, b'\xab\xcd', 100.0 + i))
+    return ts
+
+
+def test_append_and_get():
+    ts = make_series()
+    assert 10 == len(ts)
+    pm = ts[3]
+    assert 3.1 == pm.pm25
+    assert 3.2 == pm.pm10
+    assert 103.0 == pm.timestamp
+    assert b'\xab\xcd' == pm.id
+    # raw tenths are stored
+    assert 31 == ts.pm25[3]
+    assert 120 == ts.nbytes()
+
+
+def test_append_out_of_order():
+    ts = make_series()
+    with pytest.raises(ValueError):
+        ts.append_raw(50.0, 1, 1)
+
+
+def test_between():
+    ts = make_series()
+    part = ts.between(102.0, 104.5)
+    assert [102.0, 103.0, 104.0] == [pm.timestamp for pm in part]
+    assert 0 == len(ts.between(200.0, 300.0))
+    assert 10 == len(ts.between())
+    assert 2 == len(ts.between(end=101.0))
+
+
+def test_to_numpy_zero_copy():
+    numpy = pytest.importorskip('numpy')
+    ts = make_series()
+    t, pm25, pm10 = ts.to_numpy(start=105.0)
+    assert 5 == len(t)
+    assert numpy.uint16 == pm25.dtype
+    assert [5.1, 6.1, 7.1, 8.1, 9.1] == list(pm25 / 10.0)
+    # same memory of the series
+    assert not pm10.flags.owndata
+    del t, pm25, pm10
+    ts.append_raw(200.0, 1, 2)
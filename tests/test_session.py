@@ -0,0 +1,123 @@
+from pysds011.session import SDS011Session
+from pysds011.session import SessionError
+from unittest.mock import call
+import logging
+import pytest
+
+
+def test_session(mocker):
+    '''
+    Port is opened and sensor woken up once for many readings
+    '''
+    ser = mocker.MagicMock()
+    ser.is_open = False
+    css = mocker.patch('pysds011.driver.SDS011.cmd_set_sleep')
+    css.return_value = True
+    cgm = mocker.patch('pysds011.driver.SDS011.cmd_get_mode')
+    cgm.return_value = 0
+    csm = mocker.patch('pysds011.driver.SDS011.cmd_set_mode')
+    csm.return_value = True
+    cqd = mocker.patch('pysds011.driver.SDS011.cmd_query_data')
+    cqd.return_value = {'pm25': 1.0}
+
+    with SDS011Session(ser, logging.getLogger("SDS011"), id=b'\xab\xcd') as s:
+        res = [s.query_data() for _ in range(5)]
+
+    assert 5 == len(res)
+    ser.open.assert_called_once_with()
+    ser.close.assert_called_once_with()
+    css.assert_has_calls([call(0, id=b'\xab\xcd'), call(1, id=b'\xab\xcd')], any_order=False)
+    assert 2 == css.call_count
+    csm.assert_called_once_with(1, id=b'\xab\xcd')
+    assert 5 == cqd.call_count
+
+
+def test_session_mode_already_set(mocker):
+    '''
+    Mode is not set again if it is already the requested one,
+    an already opened port is left open
+    '''
+    ser = mocker.MagicMock()
+    ser.is_open = True
+    mocker.patch('pysds011.driver.SDS011.cmd_set_sleep').return_value = True
+    mocker.patch('pysds011.driver.SDS011.cmd_get_mode').return_value = 1
+    csm = mocker.patch('pysds011.driver.SDS011.cmd_set_mode')
+
+    with SDS011Session(ser, logging.getLogger("SDS011")):
+        pass
+
+    csm.assert_not_called()
+    ser.open.assert_not_called()
+    ser.close.assert_not_called()
+
+
+def test_session_wakeup_failure(mocker):
+    '''
+    Session does not start if the sensor cannot be woken up
+    and the port is closed again
+    '''
+    ser = mocker.MagicMock()
+    ser.is_open = False
+    mocker.patch('pysds011.driver.SDS011.cmd_set_sleep').return_value = False
+
+    with pytest.raises(SessionError):
+        with SDS011Session(ser, logging.getLogger("SDS011")):
+            pass
+
+    ser.close.assert_called_once_with()
+
+
+def test_monitor_keep_awake(mocker):
+    '''
+    Sensor is kept awake if it cannot sleep long enough between readings
+    '''
+    mocker.patch('time.monotonic', return_value=0.0)
+    sleep = mocker.patch('time.sleep')
+    ser = mocker.MagicMock()
+    css = mocker.patch('pysds011.driver.SDS011.cmd_set_sleep')
+    css.return_value = True
+    mocker.patch('pysds011.driver.SDS011.cmd_get_mode').return_value = 1
+    cqd = mocker.patch('pysds011.driver.SDS011.cmd_query_data')
+    cqd.return_value = {'pm25': 1.0}
+
+    with SDS011Session(ser, logging.getLogger("SDS011"), sleep_on_exit=False) as s:
+        res = list(s.monitor(10, count=3, warmup=3))
+
+    assert 3 == len(res)
+    css.assert_called_once_with(0, id=b'\xff\xff')
+    # warmup, then interval after each reading
+    assert [call(3.0), call(13.0), call(23.0)] == sleep.call_args_list
+
+
+def test_monitor_interval_not_positive(mocker):
+    ser = mocker.MagicMock()
+    mocker.patch('pysds011.driver.SDS011.cmd_set_sleep').return_value = True
+    mocker.patch('pysds011.driver.SDS011.cmd_get_mode').return_value = 1
+
+    with SDS011Session(ser, logging.getLogger("SDS011"), sleep_on_exit=False) as s:
+        with pytest.raises(ValueError):
+            list(s.monitor(0, count=3, warmup=0))
+
+
+def test_monitor_sleep_between(mocker):
+    '''
+    Sensor sleeps between readings and is woken up warmup sec before the next one
+    '''
+    clock = [0.0]
+    mocker.patch('time.monotonic', side_effect=lambda: clock[0])
+    sleep = mocker.patch('time.sleep', side_effect=lambda t: clock.__setitem__(0, clock[0] + t))
+    ser = mocker.MagicMock()
+    css = mocker.patch('pysds011.driver.SDS011.cmd_set_sleep')
+    css.return_value = True
+    mocker.patch('pysds011.driver.SDS011.cmd_get_mode').return_value = 1
+    cqd = mocker.patch('pysds011.driver.SDS011.cmd_query_data')
+    cqd.side_effect = lambda id: clock[0]
+
+    with SDS011Session(ser, logging.getLogger("SDS011"), sleep_on_exit=False) as s:
+        res = list(s.monitor(60, count=3, warmup=5))
+
+    assert [5.0, 65.0, 125.0] == res
+    css.assert_has_calls([call(0, id=b'\xff\xff'),
+                          call(1, id=b'\xff\xff'), call(0, id=b'\xff\xff'),
+                          call(1, id=b'\xff\xff'), call(0, id=b'\xff\xff')], any_order=False)
+    assert [5.0, 55.0, 5.0, 55.0, 5.0] == [c[0][0] for c in sleep.call_args_list]
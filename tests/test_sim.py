@@ -0,0 +1,96 @@
+from pysds011.driver import SDS011
+from pysds011.sim import PtyBridge
+from pysds011.sim import SimulatedSDS011
+import logging
+import pytest
+import sys
+
+
+def driver(sim):
+    d = SDS011(sim, logging.getLogger("SDS011"))
+    # do not wait for replies that will never come
+    d.reader.timeout = 0.05
+    return d
+
+
+def test_query_data():
+    sim = SimulatedSDS011(mode=1, series=[(1.5, 2.5), (3.0, 4.0)])
+    d = driver(sim)
+    assert 1.5 == d.cmd_query_data()['pm25']
+    res = d.cmd_query_data()
+    assert 3.0 == res['pm25']
+    assert 4.0 == res['pm10']
+    # last value is kept
+    assert 3.0 == d.cmd_query_data()['pm25']
+
+
+def test_configuration():
+    sim = SimulatedSDS011(id=b'\xab\xcd', firmware=(15, 7, 10), mode=1)
+    d = driver(sim)
+    assert 1 == d.cmd_get_mode()
+    assert 15 == d.cmd_firmware_ver(id=b'\xab\xcd')['year']
+    assert 0 == d.cmd_get_working_period()
+    assert d.cmd_set_working_period(5)
+    assert 5 == d.cmd_get_working_period()
+    assert d.cmd_set_id(b'\xab\xcd', b'\x11\x22')
+    assert b'\x11\x22' == sim.id
+    assert d.cmd_query_data(id=b'\x11\x22') is not None
+
+
+def test_other_id_ignored():
+    sim = SimulatedSDS011(id=b'\xab\xcd', mode=1)
+    d = driver(sim)
+    assert d.cmd_query_data(id=b'\x12\x12') is None
+    assert 1 == sim.stats['ignored']
+
+
+def test_sleep():
+    sim = SimulatedSDS011(mode=1)
+    d = driver(sim)
+    assert d.cmd_set_sleep(1)
+    assert sim.sleeping
+    # a sleeping sensor does not reply
+    assert d.cmd_query_data() is None
+    assert d.cmd_set_sleep(0)
+    assert d.cmd_get_sleep() is False
+    assert d.cmd_query_data() is not None
+
+
+def test_active_mode():
+    sim = SimulatedSDS011(active_interval=0.01, series=[(i, i) for i in range(100)])
+    d = driver(sim)
+    res = list(d.stream(count=5))
+    assert 5 == len(res)
+    assert sorted(r['pm25'] for r in res) == [r['pm25'] for r in res]
+
+
+def test_latency():
+    sim = SimulatedSDS011(mode=1, latency=0.1)
+    d = driver(sim)
+    assert d.cmd_query_data() is None
+    d.reader.timeout = 1.0
+    assert d.cmd_query_data() is not None
+
+
+def test_bad_checksum():
+    sim = SimulatedSDS011(mode=1, bad_checksum_rate=1.0)
+    d = driver(sim)
+    assert d.cmd_query_data() is None
+
+
+def test_garbage():
+    sim = SimulatedSDS011(mode=1, garbage_rate=1.0, seed=1)
+    d = driver(sim)
+    assert all(d.cmd_query_data() is not None for _ in range(10))
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='pseudo terminal are Unix only')
+def test_pty():
+    import serial
+    with PtyBridge(SimulatedSDS011(mode=1)) as bridge:
+        ser = serial.Serial(bridge.port, 9600, timeout=1)
+        try:
+            d = SDS011(ser, logging.getLogger("SDS011"))
+            assert 10.0 == d.cmd_query_data()['pm25']
+        finally:
+            ser.close()